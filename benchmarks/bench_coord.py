@@ -0,0 +1,106 @@
+"""
+Benchmarks for stuff.coord
+
+Run from the repo root:
+    python -m benchmarks.bench_coord
+"""
+import time
+import numpy as np
+from stuff.coord import box_iou, box_iou_matrix, point_in_box, BoxGrid
+from stuff.coord import unmap_roi_point, unmap_roi_points, interpolate
+
+def random_boxes(n, rng, max_size=0.1):
+    xy=rng.random((n, 2))
+    wh=rng.random((n, 2))*max_size
+    return np.concatenate([xy, xy+wh], axis=1)
+
+def bench_iou_matrix(sizes=((100, 100), (1000, 1000), (10000, 1000)), max_scalar_pairs=200000):
+    """
+    box_iou over all pairs in a Python loop vs box_iou_matrix. The scalar
+    loop is timed on at most 'max_scalar_pairs' pairs and scaled up
+    """
+    rng=np.random.default_rng(0)
+    for n, m in sizes:
+        b1=random_boxes(n, rng)
+        b2=random_boxes(m, rng)
+        l1=b1.tolist()
+        l2=b2.tolist()
+
+        rows=max(1, min(n, max_scalar_pairs//m))
+        t=time.perf_counter()
+        for i in range(rows):
+            for j in range(m):
+                box_iou(l1[i], l2[j])
+        dt_scalar=(time.perf_counter()-t)*n/rows
+
+        t=time.perf_counter()
+        box_iou_matrix(b1, b2)
+        dt_vector=time.perf_counter()-t
+
+        print(f"iou {n:5d}x{m:5d}: scalar {1000*dt_scalar:10.2f} ms"
+              f"  matrix {1000*dt_vector:8.2f} ms  speedup {dt_scalar/dt_vector:6.1f}x")
+
+def bench_box_grid(counts=(10, 1000, 10000), num_points=1000):
+    """
+    Hit testing points against boxes as Display.selected_boxes did (a
+    point_in_box scan and sort) vs BoxGrid.query, including building
+    the grid once
+    """
+    rng=np.random.default_rng(0)
+    points=rng.random((num_points, 2)).tolist()
+    for n in counts:
+        boxes=random_boxes(n, rng).tolist()
+        t=time.perf_counter()
+        for pt in points:
+            hits=[]
+            for i, b in enumerate(boxes):
+                d=point_in_box(pt, b)
+                if d is not None:
+                    hits.append((d, i))
+            hits.sort()
+        dt_scan=(time.perf_counter()-t)/num_points
+        t=time.perf_counter()
+        grid=BoxGrid(boxes)
+        for pt in points:
+            grid.query(pt)
+        dt_grid=(time.perf_counter()-t)/num_points
+        print(f"hit test {n:6d} boxes: scan {1e6*dt_scan:10.1f} us/point  grid {1e6*dt_grid:8.1f} us/point")
+
+def bench_unmap_interpolate(frames=100, people=20, num_kp=17):
+    """
+    Unmapping skeletons from per-frame crops and interpolating them
+    between frames, one point / list at a time vs whole arrays
+    """
+    rng=np.random.default_rng(0)
+    kp=rng.random((frames, people, num_kp, 3))
+    rois=np.concatenate([rng.random((frames, 2))*0.5, rng.random((frames, 2))*0.5+0.5], axis=1)
+    kp_lists=kp.tolist()
+    roi_lists=rois.tolist()
+    t=time.perf_counter()
+    for roi, people_kp in zip(roi_lists, kp_lists):
+        for person in people_kp:
+            for p in person:
+                p[0:2]=unmap_roi_point(roi, p)
+    dt_scalar=time.perf_counter()-t
+    t=time.perf_counter()
+    out=unmap_roi_points(rois[:,None,None,:], kp)
+    dt_array=time.perf_counter()-t
+    assert np.array_equal(out, np.array(kp_lists))
+    print(f"unmap {frames}x{people}x{num_kp} points: per point {1000*dt_scalar:8.2f} ms  array {1000*dt_array:6.2f} ms")
+
+    f=rng.random(frames-1)
+    t=time.perf_counter()
+    for i in range(frames-1):
+        for a, b in zip(kp_lists[i], kp_lists[i+1]):
+            for p, q in zip(a, b):
+                interpolate(p, q, f[i])
+    dt_scalar=time.perf_counter()-t
+    t=time.perf_counter()
+    interpolate(out[:-1], out[1:], f[:,None,None,None], out=out[:-1])
+    dt_array=time.perf_counter()-t
+    print(f"interpolate {frames-1}x{people}x{num_kp} points: lists {1000*dt_scalar:8.2f} ms  array {1000*dt_array:6.2f} ms")
+
+if __name__ == "__main__":
+    bench_iou_matrix()
+    bench_box_grid()
+    bench_unmap_interpolate()
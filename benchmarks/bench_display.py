@@ -0,0 +1,281 @@
+"""
+Benchmarks for stuff.display
+
+Run from the repo root:
+    python -m benchmarks.bench_display
+"""
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+import stuff.draw as draw
+from stuff.display import OverlayBlender, DirtyTiles, composite, clear_overlay, Display, VideoSink, window_mouse_callback
+
+def legacy_blend(image, overlays):
+    """
+    The float64 split/merge blend Display.show used to do
+    """
+    blended=image
+    for overlay in overlays:
+        alpha, r, g, b = cv2.split(overlay)
+        alpha = alpha.astype(float) / 255
+        base = blended.astype(float)
+        overlay_rgb = cv2.merge((r, g, b))
+        blended = (1 - alpha[..., np.newaxis]) * base + alpha[..., np.newaxis] * overlay_rgb
+        blended = blended.astype(np.uint8)
+    return blended
+
+def random_overlay(height, width, rng, num_boxes=100):
+    overlay=np.zeros((height, width, 4), np.uint8)
+    for _ in range(num_boxes):
+        x, y=rng.integers(0, width-100), rng.integers(0, height-100)
+        clr=[128]+rng.integers(0, 256, 3).tolist()
+        cv2.rectangle(overlay, (int(x), int(y)), (int(x)+100, int(y)+100), clr, 2)
+    return overlay
+
+def bench_blend(width=1920, height=1080, repeats=10):
+    """
+    Legacy float64 blend of two overlays vs OverlayBlender
+    """
+    rng=np.random.default_rng(0)
+    image=rng.integers(0, 256, (height, width, 3), np.uint8)
+    overlays=[random_overlay(height, width, rng) for _ in range(2)]
+    t=time.perf_counter()
+    for _ in range(repeats):
+        ref=legacy_blend(image, overlays)
+    dt_legacy=(time.perf_counter()-t)/repeats
+
+    blender=OverlayBlender(height, width)
+    out=np.empty_like(image)
+    t=time.perf_counter()
+    for _ in range(repeats):
+        blender.blend(image, overlays[0], out)
+        blender.blend(out, overlays[1], out)
+    dt_new=(time.perf_counter()-t)/repeats
+    err=np.abs(out.astype(np.int16)-ref).max()
+    print(f"blend 2 overlays {width}x{height}: legacy {1000*dt_legacy:8.2f} ms  "
+          f"integer {1000*dt_new:8.2f} ms  max diff {err}")
+
+def draw_frame(front, back, rng, num_boxes, front_tiles=None, back_tiles=None):
+    """
+    Draw 'num_boxes' labelled boxes like draw_boxes does, recording the
+    touched rects in the tiles if given
+    """
+    for _ in range(num_boxes):
+        x, y=rng.random(2)*0.9
+        w, h=rng.random(2)*0.05+0.02
+        rect=draw.draw_box(front, [x, y, x+w, y+h], clr="half_green", thickness=2)
+        if front_tiles is not None:
+            front_tiles.add(rect)
+        rect=draw.draw_text(front, "person 0.87", x, y+h, img_bg=back,
+                            fontColor=(255,255,255,255), bgColor=(128,0,0,0), fontScale=0.75)
+        if front_tiles is not None:
+            front_tiles.add(rect)
+            back_tiles.add(rect)
+
+def bench_dirty(box_counts=(10, 100, 1000), width=1920, height=1080, repeats=5):
+    """
+    Clear and composite a frame of labelled boxes: full frame clear and
+    blend vs dirty tiles. Drawing is the same for both and not timed
+    """
+    image=np.random.default_rng(0).integers(0, 256, (height, width, 3), np.uint8)
+    front=np.zeros((height, width, 4), np.uint8)
+    back=np.zeros((height, width, 4), np.uint8)
+    blender=OverlayBlender(height, width)
+    out=np.empty_like(image)
+    for n in box_counts:
+        rng=np.random.default_rng(n)
+        dt_full=0
+        for _ in range(repeats):
+            t=time.perf_counter()
+            front[:]=0
+            back[:]=0
+            dt_full+=time.perf_counter()-t
+            draw_frame(front, back, rng, n)
+            t=time.perf_counter()
+            blender.blend(image, back, out)
+            blender.blend(out, front, out)
+            dt_full+=time.perf_counter()-t
+
+        front_tiles=DirtyTiles(height, width)
+        back_tiles=DirtyTiles(height, width)
+        dt_dirty=0
+        for _ in range(repeats):
+            t=time.perf_counter()
+            clear_overlay(front, front_tiles)
+            clear_overlay(back, back_tiles)
+            dt_dirty+=time.perf_counter()-t
+            draw_frame(front, back, rng, n, front_tiles, back_tiles)
+            t=time.perf_counter()
+            composite(image, [(back, back_tiles), (front, front_tiles)], blender, out)
+            dt_dirty+=time.perf_counter()-t
+        print(f"{n:5d} boxes: clear+blend full frame {1000*dt_full/repeats:7.2f} ms  "
+              f"dirty tiles {1000*dt_dirty/repeats:7.2f} ms  ({100*front_tiles.fraction():5.1f}% of tiles dirty)")
+
+def bench_draw_batch(counts=(10, 200, 1000), width=1920, height=1080, repeats=5):
+    """
+    Per primitive draw_box/draw_line calls vs draw_boxes_batch and
+    draw_polylines_batch for boxes with 17 line skeletons
+    """
+    from stuff.ultralytics import SKELETON_LINES, skeleton_segments
+    rng=np.random.default_rng(0)
+    img=np.zeros((height, width, 4), np.uint8)
+    for n in counts:
+        xy=rng.random((n, 2))*0.9
+        boxes=np.concatenate([xy, xy+0.05], axis=1)
+        kp=np.concatenate([xy[:,None,:]+rng.random((n, 17, 2))*0.05, np.ones((n, 17, 1))], axis=2)
+        segments, visible=skeleton_segments(kp, SKELETON_LINES)
+        segments=segments[visible]
+        t=time.perf_counter()
+        for _ in range(repeats):
+            for b in boxes.tolist():
+                draw.draw_box(img, b, clr="half_green", thickness=2)
+            for p0, p1 in segments.tolist():
+                draw.draw_line(img, p0, p1, clr="half_blue", thickness=2)
+        dt_single=(time.perf_counter()-t)/repeats
+        t=time.perf_counter()
+        for _ in range(repeats):
+            draw.draw_boxes_batch(img, boxes, clr="half_green", thickness=2)
+            draw.draw_polylines_batch(img, segments, clr="half_blue", thickness=2)
+        dt_batch=(time.perf_counter()-t)/repeats
+        print(f"{n:5d} skeletons: per primitive {1000*dt_single:8.2f} ms  batched {1000*dt_batch:8.2f} ms")
+
+def legacy_set_colour(clr, chan, default, default_alpha=255):
+    """
+    set_colour as it was, building its tables on every call
+    """
+    colours={"red":[0,0,255],
+             "orange":[0,128,255],
+             "green":[0,255,0],
+             "cyan":[255,255,0],
+             "blue":[255,0,0],
+             "yellow":[0,255,255],
+             "white":[255,255,255],
+             "black":[0,0,0]}
+    alphas={"solid":255,
+            "half":128,
+            "flashing":128,
+            "transparent":64}
+    if clr is None:
+        clr=default
+    if isinstance(clr, str):
+        alpha=None
+        if "_" in clr:
+            alpha,clr=clr.split("_")
+        clr=colours[clr]
+        if alpha in alphas and chan==4:
+            clr=[alphas[alpha]]+clr
+            if alpha=="flashing":
+                t=int(time.time()*512) & 511
+                if t>255:
+                    t=511-t
+                clr[0]=t
+    if chan==4 and len(clr)==3:
+        clr=[default_alpha]+clr
+    return clr
+
+def bench_set_colour(n=100000):
+    """
+    Colour lookups as draw_boxes makes them, legacy vs cached
+    """
+    specs=["half_green", "half_blue", "half_red", "flashing_yellow", None]
+    for name, fn in [("legacy", legacy_set_colour), ("cached", draw.set_colour)]:
+        t=time.perf_counter()
+        for i in range(n):
+            fn(specs[i%5], 4, "white")
+        print(f"set_colour {name}: {1e6*(time.perf_counter()-t)/n:6.3f} us/call")
+
+def bench_text_sprites(counts=(10, 100, 500), width=1920, height=1080, repeats=5):
+    """
+    draw_text labels like draw_boxes makes, rendered each time vs from the
+    sprite cache (after the first frame)
+    """
+    rng=np.random.default_rng(0)
+    front=np.zeros((height, width, 4), np.uint8)
+    back=np.zeros((height, width, 4), np.uint8)
+    cache=draw.TextSpriteCache()
+    for n in counts:
+        pos=rng.random((n, 2))*0.9
+        labels=[f"person {c:4.2f} " for c in rng.integers(50, 100, n)/100]
+        results=[]
+        for sprite_cache in [None, cache]:
+            t=time.perf_counter()
+            for _ in range(repeats):
+                for label, (x, y) in zip(labels, pos.tolist()):
+                    draw.draw_text(front, label, x, y, img_bg=back, fontScale=0.75,
+                                   fontColor=(255,255,255,255), bgColor=(128,0,0,0),
+                                   sprite_cache=sprite_cache)
+            results.append((time.perf_counter()-t)/repeats)
+        print(f"{n:5d} labels: rendered {1000*results[0]:8.2f} ms  sprites {1000*results[1]:8.2f} ms  "
+              f"(cache {cache.nbytes>>10} KB, {len(cache.entries)} sprites)")
+
+def bench_offscreen_render(counts=(10, 100), width=1920, height=1080, num_frames=30):
+    """
+    The whole render path on an offscreen Display: clear, draw_boxes of
+    people with skeletons, then show 720p frames, alone and writing to a
+    VideoSink
+    """
+    from stuff.ultralytics import draw_boxes
+    from benchmarks.bench_ultralytics import random_person_dets
+    rng=np.random.default_rng(0)
+    frames=[rng.integers(0, 256, (720, 1280, 3), np.uint8) for _ in range(4)]
+    with tempfile.TemporaryDirectory() as folder:
+        for n in counts:
+            dets=[random_person_dets(n, rng, spread=0.9) for _ in range(4)]
+            results=[]
+            for sink in [None, VideoSink(os.path.join(folder, f"render_{n}.mp4"))]:
+                display=Display(width, height, offscreen=True, sink=sink)
+                t=time.perf_counter()
+                for i in range(num_frames):
+                    display.clear()
+                    draw_boxes(display, dets[i%4], class_names=["person"])
+                    display.show(frames[i%4])
+                results.append((time.perf_counter()-t)/num_frames)
+                display.close()
+            print(f"{n:5d} people: render {1000*results[0]:7.2f} ms/frame  "
+                  f"render+VideoSink {1000*results[1]:7.2f} ms/frame")
+
+def legacy_mouse_callback(event, x, y, flags, display):
+    """
+    The mouse callback as it was: every move queued and hit tested at once
+    """
+    xc=(x-display.pad_l)/display.img_width
+    yc=(y-display.pad_t)/display.img_height
+    if xc<0 or xc>1 or yc<0 or yc>1:
+        return
+    if event==cv2.EVENT_LBUTTONDOWN or event==cv2.EVENT_MOUSEMOVE:
+        boxes=display.selected_boxes([xc,yc])
+        display.events.append({"x":xc, "y":yc, "key":None, "lbutton":event==cv2.EVENT_LBUTTONDOWN,
+                               "rbutton":False, "selected":boxes})
+
+def bench_mouse_events(box_counts=(100, 2000), moves_per_frame=200, frames=10):
+    """
+    A frame's worth of mouse moves and a click over selectable boxes, then
+    get_events: legacy callback vs the coalescing one
+    """
+    from benchmarks.bench_coord import random_boxes
+    rng=np.random.default_rng(0)
+    display=Display(1280, 720, offscreen=True)
+    for n in box_counts:
+        display.clear()
+        display.draw_boxes_batch(random_boxes(n, rng)*0.9, select_contexts=list(range(n)))
+        xy=(rng.random((moves_per_frame, 2))*[1280, 720]).astype(int).tolist()
+        for name, callback in [("legacy", legacy_mouse_callback), ("coalesced", window_mouse_callback)]:
+            t=time.perf_counter()
+            for _ in range(frames):
+                for x, y in xy:
+                    callback(cv2.EVENT_MOUSEMOVE, x, y, 0, display)
+                callback(cv2.EVENT_LBUTTONDOWN, x, y, 0, display)
+                events=display.get_events(1)
+            dt=(time.perf_counter()-t)/frames
+            print(f"{n:5d} boxes {moves_per_frame} moves: {name:9s} {1000*dt:7.2f} ms/frame, {len(events)} events")
+
+if __name__ == "__main__":
+    bench_blend()
+    bench_dirty()
+    bench_draw_batch()
+    bench_set_colour()
+    bench_text_sprites()
+    bench_offscreen_render()
+    bench_mouse_events()
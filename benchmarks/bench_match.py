@@ -0,0 +1,115 @@
+"""
+Benchmarks for stuff.match
+
+Run from the repo root:
+    python -m benchmarks.bench_match
+"""
+import time
+import numpy as np
+import stuff.coord as coord
+from stuff.match import match_lsa, match_lsa_gated, match_greedy
+from benchmarks.bench_coord import random_boxes
+
+def box_iou_mfn(det, gt, context):
+    return coord.box_iou(det, gt)
+
+def bench_lsa(sizes=(30, 100, 300), repeats=3):
+    """
+    match_lsa with a per-pair mfn on box lists vs box arrays
+    """
+    rng=np.random.default_rng(0)
+    for n in sizes:
+        dets=random_boxes(n, rng)
+        gts=random_boxes(n, rng)
+        det_list=dets.tolist()
+        gt_list=gts.tolist()
+
+        t=time.perf_counter()
+        for _ in range(repeats):
+            r1=match_lsa(det_list, gt_list, mfn=box_iou_mfn)
+        dt_pair=(time.perf_counter()-t)/repeats
+
+        t=time.perf_counter()
+        for _ in range(repeats):
+            r2=match_lsa(dets, gts)
+        dt_matrix=(time.perf_counter()-t)/repeats
+
+        assert np.array_equal(r1[0], r2[0]) and np.array_equal(r1[1], r2[1])
+        print(f"match_lsa {n:4d}x{n:4d}: per-pair mfn {1000*dt_pair:8.2f} ms"
+              f"  matrix {1000*dt_matrix:8.2f} ms")
+
+def crowd_scene(n, rng, density=0.5):
+    """
+    n gt boxes and dets that are jittered copies of them. Box size shrinks
+    with n so the fraction of the frame covered ('density') stays the same
+    """
+    box_size=2*np.sqrt(density/n)
+    gts=random_boxes(n, rng, box_size)
+    dets=gts+rng.normal(0, 0.1*box_size, gts.shape)
+    return dets[rng.permutation(n)], gts
+
+def bench_gated(sizes=(300, 1000, 3000, 10000), max_dense=3000):
+    """
+    Dense match_lsa on box arrays vs match_lsa_gated for crowded scenes
+    """
+    rng=np.random.default_rng(0)
+    for n in sizes:
+        dets, gts=crowd_scene(n, rng)
+        dense="   skipped"
+        if n<=max_dense:
+            t=time.perf_counter()
+            match_lsa(dets, gts)
+            dense=f"{1000*(time.perf_counter()-t):10.2f}"
+        t=time.perf_counter()
+        match_lsa_gated(dets, gts)
+        dt_gated=time.perf_counter()-t
+        print(f"crowd {n:5d}: dense match_lsa {dense} ms  gated {1000*dt_gated:8.2f} ms")
+
+def legacy_match_greedy(dets, gts, mfn, mfn_context=None):
+    """
+    The previous match_greedy: dets in input order, each rescanning every gt
+    """
+    gt_matched=[False]*len(gts)
+    out_det_index=[]
+    out_gt_index=[]
+    out_cost=[]
+    for i,det in enumerate(dets):
+        best_v=0
+        best_match=None
+        for j,gt in enumerate(gts):
+            v=mfn(det,gt,mfn_context)
+            if gt_matched[j] is False and v>best_v:
+                best_v=v
+                best_match=j
+        if best_match is not None:
+            gt_matched[best_match]=True
+            out_det_index.append(i)
+            out_gt_index.append(best_match)
+            out_cost.append(best_v)
+    return out_det_index, out_gt_index, out_cost
+
+def bench_greedy(sizes=(100, 300, 1000, 3000), max_legacy=1000):
+    """
+    Legacy greedy vs sorted-pairs match_greedy vs match_lsa on box arrays
+    """
+    rng=np.random.default_rng(0)
+    for n in sizes:
+        dets, gts=crowd_scene(n, rng)
+        legacy="   skipped"
+        if n<=max_legacy:
+            t=time.perf_counter()
+            legacy_match_greedy(dets.tolist(), gts.tolist(), box_iou_mfn)
+            legacy=f"{1000*(time.perf_counter()-t):10.2f}"
+        t=time.perf_counter()
+        match_greedy(dets, gts)
+        dt_greedy=time.perf_counter()-t
+        t=time.perf_counter()
+        match_lsa(dets, gts)
+        dt_lsa=time.perf_counter()-t
+        print(f"greedy {n:5d}: legacy {legacy} ms  sorted pairs {1000*dt_greedy:8.2f} ms"
+              f"  match_lsa {1000*dt_lsa:8.2f} ms")
+
+if __name__ == "__main__":
+    bench_lsa()
+    bench_gated()
+    bench_greedy()
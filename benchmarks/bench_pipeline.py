@@ -0,0 +1,65 @@
+"""
+Benchmarks for stuff.pipeline
+
+Run from the repo root, optionally with a video file:
+    python -m benchmarks.bench_pipeline [video]
+"""
+import sys
+import time
+import cv2
+import numpy as np
+from stuff.video import RandomAccessVideoReader
+from stuff.ultralytics import YoloConverter
+from stuff.pipeline import video_detection_pipeline, format_pipeline_stats
+from benchmarks.bench_video import get_test_video
+from benchmarks.bench_ultralytics import random_results
+
+class FakeModel:
+    """
+    Stands in for a detector: some cv2 work on the frame (which, like
+    real inference, releases the GIL) then random Results
+    """
+    def __init__(self, dets_per_frame=20, work=4):
+        self.rng=np.random.default_rng(0)
+        self.dets_per_frame=dets_per_frame
+        self.work=work
+
+    def __call__(self, frame):
+        x=cv2.resize(frame, (640, 640))
+        for _ in range(self.work):
+            x=cv2.GaussianBlur(x, (9, 9), 0)
+        return [random_results(self.dets_per_frame, self.rng)]
+
+def bench_pipeline(video_path, num_frames=300, queue_size=4):
+    """
+    Serial read -> model -> convert loop vs video_detection_pipeline
+    """
+    kwargs={"yolo_class_names":["person", "face", "person_male", "person_hat"],
+            "class_names":["person", "face"],
+            "pose_kp":True,
+            "params":{"pose_nms":0.5, "nms_iou":0.7}}
+    converter=YoloConverter(**kwargs)
+
+    reader=RandomAccessVideoReader(video_path)
+    model=FakeModel()
+    t=time.perf_counter()
+    n=0
+    for frame in reader.iter_frames(stop=num_frames):
+        converter.convert(model(frame)[0])
+        n+=1
+    dt_serial=time.perf_counter()-t
+    reader.close()
+    print(f"serial:   {n/dt_serial:8.1f} fps")
+
+    reader=RandomAccessVideoReader(video_path)
+    pipeline=video_detection_pipeline(reader, FakeModel(), converter, stop=num_frames, queue_size=queue_size)
+    for frame, dets in pipeline:
+        pass
+    reader.close()
+    stats=pipeline.stats()
+    print(f"pipeline: {stats['fps']:8.1f} fps")
+    print(format_pipeline_stats(stats))
+
+if __name__ == "__main__":
+    video_path=get_test_video(sys.argv)
+    bench_pipeline(video_path)
@@ -0,0 +1,60 @@
+"""
+Benchmarks for stuff.tiling
+
+Run from the repo root:
+    python -m benchmarks.bench_tiling
+"""
+import time
+import numpy as np
+import stuff.coord as coord
+from stuff.ultralytics import yolo_results_to_detections_batch
+from stuff.tiling import make_tiles, tile_rois, merge_tile_detections
+from benchmarks.bench_ultralytics import random_results
+
+def loop_merge(dets_list, rois, nms_iou=0.5):
+    """
+    Unmap per tile det dicts one box and point at a time, then merge
+    them with plain IoU NMS
+    """
+    merged=[]
+    for dets, roi in zip(dets_list, rois.tolist()):
+        for d in dets:
+            d["box"]=coord.unmap_roi_box(roi, d["box"])
+            kp=d["pose_points"]
+            for i in range(0, len(kp), 3):
+                kp[i:i+2]=coord.unmap_roi_point(roi, kp[i:i+2])
+            merged.append(d)
+    merged.sort(key=lambda d: -d["confidence"])
+    out=[]
+    for d in merged:
+        if all(d["class"]!=o["class"] or coord.box_iou(d["box"], o["box"])<=nms_iou for o in out):
+            out.append(d)
+    return out
+
+def bench_merge(dets_per_tile=(5, 20, 50), width=3840, height=2160, tile_size=640, repeats=3):
+    """
+    Unmapping and merging the detections of the tiles of a 4K frame:
+    per det dict loops with IoU NMS vs merge_tile_detections (which also
+    joins boxes cut off at tile edges, so can keep fewer)
+    """
+    rng=np.random.default_rng(0)
+    rects=make_tiles(width, height, tile_size)
+    rois=tile_rois(rects, width, height)
+    for n in dets_per_tile:
+        results=[random_results(n, rng) for _ in range(len(rects))]
+        dt_loop=0
+        dt_array=0
+        for _ in range(repeats):
+            dets_list=yolo_results_to_detections_batch(results)
+            dicts=[d.to_dicts() for d in dets_list]
+            t=time.perf_counter()
+            r1=loop_merge(dicts, rois)
+            dt_loop+=time.perf_counter()-t
+            t=time.perf_counter()
+            r2=merge_tile_detections(dets_list, rois)
+            dt_array+=time.perf_counter()-t
+        print(f"{len(rects)} tiles x {n:3d} dets: loops {1000*dt_loop/repeats:8.2f} ms  "
+              f"arrays {1000*dt_array/repeats:7.2f} ms  kept {len(r1)} / {len(r2)}")
+
+if __name__ == "__main__":
+    bench_merge()
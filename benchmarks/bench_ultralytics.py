@@ -0,0 +1,237 @@
+"""
+Benchmarks for stuff.ultralytics
+
+Run from the repo root:
+    python -m benchmarks.bench_ultralytics
+"""
+import copy
+import time
+import numpy as np
+import stuff.coord as coord
+from stuff.detections import Detections
+from stuff.ultralytics import pose_nms_dets, yolo_results_to_dets, YoloConverter, fold_detections_to_attributes
+from stuff.ultralytics import map_keypoints
+
+def random_person_dets(n, rng, num_kp=17, spread=0.5):
+    """
+    n person det dicts with pose points, sorted by confidence like yolo
+    output. Boxes are packed into a 'spread' sized square so they overlap
+    """
+    xy=rng.random((n, 2))*spread
+    wh=rng.random((n, 2))*0.1+0.02
+    conf=np.sort(rng.random(n))[::-1]
+    dets=[]
+    for i in range(n):
+        box=[xy[i,0], xy[i,1], xy[i,0]+wh[i,0], xy[i,1]+wh[i,1]]
+        kp=np.zeros((num_kp, 3))
+        kp[:,0]=box[0]+rng.random(num_kp)*wh[i,0]
+        kp[:,1]=box[1]+rng.random(num_kp)*wh[i,1]
+        kp[:,2]=rng.random(num_kp)
+        dets.append({"box":box, "class":0, "confidence":float(conf[i]),
+                     "pose_points":kp.reshape(-1).tolist()})
+    return dets
+
+def legacy_pose_nms(out_det, person_class, pose_nms, nms_iou):
+    """
+    The pose_nms/nms_iou loops previously inline in yolo_results_to_dets
+    """
+    p_index=[]
+    for i,d in enumerate(out_det):
+        if d["class"]==person_class:
+            num=0
+            if "pose_points" in d:
+                for j in range(len(d["pose_points"])//3):
+                    if d["pose_points"][j*3+2]>0.01:
+                        num+=1
+            if num>=2:
+                p_index.append(i)
+    for n,i in enumerate(p_index):
+        d=out_det[i]
+        if d["confidence"]==0:
+            continue
+        for m in range(n+1, len(p_index)):
+            j=p_index[m]
+            d2=out_det[j]
+            ioma=coord.box_ioma(d["box"],d2["box"])
+            if ioma==0:
+                continue
+            iou=coord.kp_iou2(d["pose_points"], d2["pose_points"],
+                              max(coord.box_a(d["box"]), coord.box_a(d2["box"])), len(d["pose_points"])//3)
+            if iou>pose_nms:
+                f=d["confidence"]/(d["confidence"]+d2["confidence"])
+                for k in range(4):
+                    d["box"][k]=f*d["box"][k]+(1.0-f)*d2["box"][k]
+                d2["confidence"]=0
+    out_det=[d for d in out_det if d["confidence"]!=0]
+    for i,d in enumerate(out_det):
+        if d["class"]==person_class:
+            for j in range(i+1, len(out_det)):
+                d2=out_det[j]
+                if d["confidence"]==0:
+                    continue
+                if d2["class"]==person_class and coord.box_iou(d["box"],d2["box"])>nms_iou:
+                    d2["confidence"]=0
+    return [d for d in out_det if d["confidence"]!=0]
+
+def bench_pose_nms(sizes=(10, 50, 200, 500), pose_nms=0.5, nms_iou=0.7):
+    """
+    Legacy pose NMS loops vs pose_nms_dets
+    """
+    rng=np.random.default_rng(0)
+    for n in sizes:
+        dets=random_person_dets(n, rng)
+        d1=copy.deepcopy(dets)
+        t=time.perf_counter()
+        r1=legacy_pose_nms(d1, 0, pose_nms, nms_iou)
+        dt_legacy=time.perf_counter()-t
+        d2=copy.deepcopy(dets)
+        t=time.perf_counter()
+        r2=pose_nms_dets(d2, 0, pose_nms=pose_nms, nms_iou=nms_iou)
+        dt_new=time.perf_counter()-t
+        assert r1==r2
+        print(f"pose nms {n:4d} dets: legacy {1000*dt_legacy:9.2f} ms  vectorized {1000*dt_new:8.2f} ms"
+              f"  kept {len(r2)}")
+
+class FakeBoxes:
+    def __init__(self, xyxyn, cls, conf):
+        self.xyxyn=xyxyn
+        self.cls=cls
+        self.conf=conf
+        self.id=None
+
+class FakeKeypoints:
+    def __init__(self, xyn, conf):
+        self.xyn=xyn
+        self.conf=conf
+        self.has_visible=True
+
+class FakeResults:
+    """
+    Stand in for ultralytics Results backed by float32 numpy arrays
+    """
+    def __init__(self, boxes, keypoints=None):
+        self.boxes=boxes
+        self.keypoints=keypoints
+
+def random_results(n, rng, num_classes=4, num_kp=17):
+    xy=rng.random((n, 2))*0.8
+    wh=rng.random((n, 2))*0.2+0.01
+    boxes=np.concatenate([xy, xy+wh], axis=1).astype(np.float32)
+    conf=np.sort(rng.random(n))[::-1].astype(np.float32)
+    cls=rng.integers(0, num_classes, n).astype(np.float32)
+    kp=boxes[:,None,:2]+rng.random((n, num_kp, 2))*(boxes[:,None,2:]-boxes[:,None,:2])
+    kp_conf=rng.random((n, num_kp))
+    return FakeResults(FakeBoxes(boxes, cls, conf),
+                       FakeKeypoints(kp.astype(np.float32), kp_conf.astype(np.float32)))
+
+def bench_batch_convert(batch_sizes=(1, 16, 64), dets_per_frame=20, repeats=5):
+    """
+    yolo_results_to_dets per frame vs one YoloConverter.convert_batch call
+    """
+    rng=np.random.default_rng(0)
+    yolo_class_names=["person", "face", "person_male", "person_hat"]
+    kwargs={"yolo_class_names":yolo_class_names,
+            "class_names":["person", "face"],
+            "pose_kp":True,
+            "params":{"pose_nms":0.5, "nms_iou":0.7}}
+    for batch in batch_sizes:
+        results=[random_results(dets_per_frame, rng) for _ in range(batch)]
+        t=time.perf_counter()
+        for _ in range(repeats):
+            r1=[yolo_results_to_dets(r, **kwargs) for r in results]
+        dt_frame=(time.perf_counter()-t)/repeats
+        converter=YoloConverter(**kwargs)
+        t=time.perf_counter()
+        for _ in range(repeats):
+            r2=converter.convert_batch(results)
+        dt_batch=(time.perf_counter()-t)/repeats
+        assert r1==r2
+        print(f"convert batch {batch:3d}: per frame {1000*dt_frame:8.2f} ms  batched {1000*dt_batch:8.2f} ms"
+              f"  ({1000*dt_batch/batch:.3f} ms/frame)")
+
+def legacy_fold(gts, class_names, attributes):
+    """
+    fold_detections_to_attributes as it was: map rebuilt per call and a
+    scalar box_iou scan over all detections per attribute detection
+    """
+    class_to_attribute_map=[{"base_class_index":None, "attr_index":None}]*len(class_names)
+    for i,a in enumerate(attributes):
+        base_class=a.split(":")[0]
+        if base_class in class_names:
+            base_class_index=class_names.index(base_class)
+            an=a.replace(":","_")
+            if an in class_names:
+                j=class_names.index(an)
+                class_to_attribute_map[j]={"base_class_index":base_class_index,
+                                           "attr_index":i}
+    for d in gts:
+        m=class_to_attribute_map[d["class"]]
+        base_class_index=m["base_class_index"]
+        attr_index=m["attr_index"]
+        if attr_index is not None:
+            best_iou=0
+            for i,d2 in enumerate(gts):
+                if d2["class"]==base_class_index:
+                    iou=coord.box_iou(d2["box"], d["box"])
+                    if iou>best_iou:
+                        best_iou=iou
+                        best_match=i
+            if best_iou>0.3:
+                d2=gts[best_match]
+                if not "attrs" in d2:
+                    d2["attrs"]=[0]*len(attributes)
+                d2["attrs"][attr_index]=max(d2["attrs"][attr_index], d["confidence"])
+                d["confidence"]=0
+    return [x for x in gts if x["confidence"]!=0]
+
+def bench_fold(sizes=(10, 100, 500), attrs_per_person=3):
+    """
+    Legacy attribute folding vs fold_detections_to_attributes
+    """
+    rng=np.random.default_rng(0)
+    attributes=["person:male", "person:hat", "person:glasses", "person:bag"]
+    class_names=["person", "face"]+[a.replace(":", "_") for a in attributes]
+    for n in sizes:
+        dets=random_person_dets(n, rng, spread=1.0)
+        for d in dets[:n]:
+            for a in rng.choice(len(attributes), attrs_per_person, replace=False):
+                box=[v+rng.normal()*0.003 for v in d["box"]]
+                dets.append({"box":box, "class":2+int(a), "confidence":float(rng.random())})
+        d1=copy.deepcopy(dets)
+        t=time.perf_counter()
+        r1=legacy_fold(d1, class_names, attributes)
+        dt_legacy=time.perf_counter()-t
+        d2=copy.deepcopy(dets)
+        t=time.perf_counter()
+        r2=fold_detections_to_attributes(d2, class_names, attributes)
+        dt_new=time.perf_counter()-t
+        assert r1==r2
+        print(f"fold attributes {len(dets):5d} dets: legacy {1000*dt_legacy:9.2f} ms  planned {1000*dt_new:8.2f} ms")
+
+def bench_keypoint_map(sizes=(10, 100, 1000), num_kp=22, repeats=5):
+    """
+    to_dicts then per dict map_keypoints vs mapping the keypoint arrays
+    in to_dicts, for each keypoint type (best of 'repeats')
+    """
+    rng=np.random.default_rng(0)
+    for n in sizes:
+        dets=Detections(rng.random((n, 4)), np.zeros(n), rng.random(n), None, rng.random((n, num_kp, 3)))
+        for flags in [(False, True, False), (True, True, False), (False, False, True)]:
+            dt_dict=dt_array=float("inf")
+            for _ in range(repeats):
+                t=time.perf_counter()
+                r1=dets.to_dicts()
+                map_keypoints(r1, *flags)
+                dt_dict=min(dt_dict, time.perf_counter()-t)
+                t=time.perf_counter()
+                r2=dets.to_dicts(*flags)
+                dt_array=min(dt_array, time.perf_counter()-t)
+            assert r1==r2
+            print(f"keypoint map {n:5d} dets face/pose/facepose={flags!s:20s}: per dict {1000*dt_dict:8.2f} ms"
+                  f"  arrays {1000*dt_array:8.2f} ms")
+
+if __name__ == "__main__":
+    bench_pose_nms()
+    bench_batch_convert()
+    bench_fold()
+    bench_keypoint_map()
@@ -0,0 +1,131 @@
+"""
+Benchmarks for stuff.video
+
+Run from the repo root:
+    python -m benchmarks.bench_video [video_file]
+If no video is given a synthetic one is written to a temp directory.
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import cv2
+import numpy as np
+from stuff.video import RandomAccessVideoReader, parallel_scan
+
+def make_test_video(path, num_frames=3000, width=640, height=360, fps=30):
+    writer=cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(num_frames):
+        frame=np.full((height, width, 3), i%256, np.uint8)
+        cv2.putText(frame, str(i), (20, height//2), cv2.FONT_HERSHEY_SIMPLEX, 3, (255,255,255), 3)
+        writer.write(frame)
+    writer.release()
+
+def get_test_video(argv):
+    if len(argv)>1:
+        return argv[1]
+    path=os.path.join(tempfile.mkdtemp(), "bench.mp4")
+    print(f"writing synthetic video {path}")
+    make_test_video(path)
+    return path
+
+def bench_random_access(video_path, num_requests=50, seed=0):
+    """
+    Time random frame requests with and without the keyframe index
+    """
+    reader=RandomAccessVideoReader(video_path, max_size=10)
+    n=int(reader.num_frames)
+    rng=random.Random(seed)
+    requests=[rng.randrange(n) for _ in range(num_requests)]
+
+    for use_index in [False, True]:
+        reader=RandomAccessVideoReader(video_path, max_size=10, use_keyframe_index=use_index)
+        t=time.perf_counter()
+        for i in requests:
+            reader.get_frame_at_index(i)
+        dt=time.perf_counter()-t
+        name="keyframe index" if use_index else "decode from 0"
+        print(f"random access {name:16s}: {1000*dt/num_requests:8.2f} ms/frame")
+
+def bench_prefetch(video_path, work_ms=5, num_frames=600, prefetch=8):
+    """
+    Forward playback throughput with and without the prefetch thread.
+    'work_ms' of sleeping per frame stands in for inference/drawing
+    done by the caller (which releases the GIL like most native code)
+    """
+    for n in [0, prefetch]:
+        reader=RandomAccessVideoReader(video_path, max_size=2*prefetch, prefetch=n)
+        count=min(num_frames, int(reader.num_frames))
+        t=time.perf_counter()
+        for i in range(count):
+            reader.get_frame_at_index(i)
+            time.sleep(work_ms/1000)
+        dt=time.perf_counter()-t
+        reader.close()
+        print(f"forward playback prefetch={n:2d} work={work_ms}ms: {count/dt:8.1f} fps")
+
+def bench_strided(video_path, step=5, num_frames=1500):
+    """
+    Sample every 'step'th frame with a get_frame_at_index loop vs iter_frames
+    """
+    reader=RandomAccessVideoReader(video_path)
+    stop=min(num_frames, int(reader.num_frames))
+    indices=range(0, stop, step)
+
+    t=time.perf_counter()
+    for i in indices:
+        reader.get_frame_at_index(i)
+    dt_loop=time.perf_counter()-t
+
+    reader=RandomAccessVideoReader(video_path)
+    t=time.perf_counter()
+    for _ in reader.iter_frames(0, stop, step):
+        pass
+    dt_iter=time.perf_counter()-t
+
+    reader=RandomAccessVideoReader(video_path)
+    t=time.perf_counter()
+    for _ in reader.iter_frames(0, stop, step, batch_size=16):
+        pass
+    dt_batch=time.perf_counter()-t
+
+    n=len(indices)
+    print(f"every {step}th frame get_frame_at_index: {1000*dt_loop/n:6.2f} ms/frame")
+    print(f"every {step}th frame iter_frames       : {1000*dt_iter/n:6.2f} ms/frame")
+    print(f"every {step}th frame iter_frames batch : {1000*dt_batch/n:6.2f} ms/frame")
+
+def frame_mean(frame):
+    return float(frame.mean())
+
+def bench_parallel_scan(video_path):
+    """
+    Whole file scan fps with a trivial per-frame function, for 1, 2, 4..
+    worker processes, against a single RandomAccessVideoReader
+    """
+    reader=RandomAccessVideoReader(video_path)
+    n=0
+    t=time.perf_counter()
+    for frame in reader.iter_frames():
+        frame_mean(frame)
+        n+=1
+    print(f"scan single reader      : {n/(time.perf_counter()-t):8.1f} fps")
+
+    num_workers=1
+    while num_workers<=os.cpu_count():
+        for fn in [frame_mean, None]:
+            n=0
+            t=time.perf_counter()
+            for _, result in parallel_scan(video_path, fn=fn, num_workers=num_workers):
+                n+=1
+            name="fn" if fn is not None else "frames"
+            print(f"scan {num_workers:2d} workers {name:6s}: {n/(time.perf_counter()-t):8.1f} fps")
+        num_workers*=2
+
+if __name__ == "__main__":
+    video_path=get_test_video(sys.argv)
+    bench_random_access(video_path)
+    bench_prefetch(video_path, work_ms=0)
+    bench_prefetch(video_path, work_ms=5)
+    bench_strided(video_path)
+    bench_parallel_scan(video_path)
@@ -1,9 +1,14 @@
 # Expose things at the package level
-from .video import RandomAccessVideoReader
-from .draw import draw_box, draw_line, draw_text
-from .coord import box_w,box_h,box_iou,box_a,box_i,box_ioma,clip01, interpolate
-from .display import Display
-from .match import match_lsa
+from .video import RandomAccessVideoReader, FrameCache, parallel_scan
+from .draw import draw_box, draw_line, draw_text, draw_boxes_batch, draw_polylines_batch, draw_circles_batch
+from .coord import box_w,box_h,box_iou,box_a,box_i,box_ioma,clip01, interpolate, BoxGrid
+from .coord import unmap_roi_points, unmap_roi_boxes
+from .coord import box_a_array,box_i_matrix,box_iou_matrix,box_ioma_matrix
+from .display import Display, VideoSink, ImageSequenceSink
+from .match import match_lsa, match_lsa_gated, match_greedy
 from .misc import load_dictionary,rm,rename,rmdir,makedir,save_atomic_pickle
-from .ultralytics import yolo_results_to_dets, draw_boxes, map_keypoints, fold_detections_to_attributes,find_gt_from_point
-from .image import image_append_exif_comment, image_get_exif_comment
\ No newline at end of file
+from .detections import Detections, yolo_keypoints, split_keypoints, map_keypoint_arrays
+from .ultralytics import yolo_results_to_dets, yolo_results_to_detections, yolo_results_to_detections_batch, YoloConverter, draw_boxes, map_keypoints, fold_detections_to_attributes, AttributeFoldPlan, find_gt_from_point
+from .image import image_append_exif_comment, image_get_exif_comment
+from .pipeline import Pipeline, Stage, video_detection_pipeline, render_dets, format_pipeline_stats
+from .tiling import make_tiles, tiled_detections, tiled_inference, merge_tile_detections
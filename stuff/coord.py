@@ -1,3 +1,5 @@
+import numpy as np
+
 def clip01(x):
     if x<0:
         return 0
@@ -27,6 +29,38 @@ def unmap_roi_box(roi, box):
          roi[1]+box[3]*(roi[3]-roi[1])]
     return ret
 
+def unmap_roi_points(roi, points, out=None):
+    """
+    Map an (...,D) array of points (x,y then e.g. confidence), normalized
+    to 'roi' [x0,y0,x1,y1], to the coordinates 'roi' is in; D>2 columns
+    are copied. 'roi' can be (...,4) to broadcast against the points'
+    leading dims, e.g. (F,1,4) rois with (F,K,3) keypoints. 'out' can be
+    'points' to map in place
+    """
+    roi=np.asarray(roi, dtype=np.float64)
+    points=np.asarray(points, dtype=np.float64)
+    if out is None:
+        out=np.empty(np.broadcast_shapes(points.shape[:-1], roi.shape[:-1])+points.shape[-1:])
+    xy=out[...,0:2]
+    np.multiply(points[...,0:2], roi[...,2:4]-roi[...,0:2], out=xy)
+    np.add(xy, roi[...,0:2], out=xy)
+    if points.shape[-1]>2 and out is not points:
+        out[...,2:]=points[...,2:]
+    return out
+
+def unmap_roi_boxes(roi, boxes, out=None):
+    """
+    Map an (...,4) array of [x0,y0,x1,y1] boxes normalized to 'roi' to
+    the coordinates 'roi' is in, as unmap_roi_points
+    """
+    roi=np.asarray(roi, dtype=np.float64)
+    boxes=np.asarray(boxes, dtype=np.float64)
+    wh=roi[...,2:4]-roi[...,0:2]
+    scale=np.concatenate([wh, wh], axis=-1)
+    offset=np.concatenate([roi[...,0:2], roi[...,0:2]], axis=-1)
+    out=np.multiply(boxes, scale, out=out)
+    return np.add(out, offset, out=out)
+
 def box_w(b1):
     """
     Return width of box
@@ -91,6 +125,150 @@ def box_ioma(b1, b2):
     iou=(iw*ih)/(min(a1,a2)+1e-7)
     return iou
 
+def boxes_array(boxes):
+    """
+    Return boxes (a list of [x1,y1,x2,y2] or an array) as a float64 (N,4) array
+    """
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+def box_a_array(b1):
+    """
+    Return areas of (N,4) xyxy boxes as an (N,) array
+    """
+    b1=boxes_array(b1)
+    return (b1[:,3]-b1[:,1])*(b1[:,2]-b1[:,0])
+
+def box_i_matrix(b1, b2):
+    """
+    Vectorized box_i: areas of intersection between every box in b1 (N,4)
+    and every box in b2 (M,4), as an (N,M) array
+    """
+    b1=boxes_array(b1)
+    b2=boxes_array(b2)
+    iw=np.minimum(b1[:,None,2], b2[None,:,2])
+    iw-=np.maximum(b1[:,None,0], b2[None,:,0])
+    np.maximum(iw, 0, out=iw)
+    ih=np.minimum(b1[:,None,3], b2[None,:,3])
+    ih-=np.maximum(b1[:,None,1], b2[None,:,1])
+    np.maximum(ih, 0, out=ih)
+    iw*=ih
+    return iw
+
+def box_iou_matrix(b1, b2):
+    """
+    Vectorized box_iou: iou between every box in b1 (N,4) and every box
+    in b2 (M,4), in xyxy format. Gives the same values as box_iou.
+
+    Returns:
+        (N,M) float64 array
+    """
+    b1=boxes_array(b1)
+    b2=boxes_array(b2)
+    ai=box_i_matrix(b1, b2)
+    a1=(b1[:,2]-b1[:,0])*(b1[:,3]-b1[:,1])
+    a2=(b2[:,2]-b2[:,0])*(b2[:,3]-b2[:,1])
+    d=a1[:,None]+a2[None,:]
+    d-=ai
+    d+=1e-7
+    ai/=d
+    return ai
+
+def box_ioma_matrix(b1, b2):
+    """
+    Vectorized box_ioma: intersection over minimum area between every box
+    in b1 (N,4) and every box in b2 (M,4), in xyxy format. Gives the same
+    values as box_ioma.
+
+    Returns:
+        (N,M) float64 array
+    """
+    b1=boxes_array(b1)
+    b2=boxes_array(b2)
+    ai=box_i_matrix(b1, b2)
+    a1=(b1[:,2]-b1[:,0])*(b1[:,3]-b1[:,1])
+    a2=(b2[:,2]-b2[:,0])*(b2[:,3]-b2[:,1])
+    d=np.minimum(a1[:,None], a2[None,:])
+    d+=1e-7
+    ai/=d
+    return ai
+
+def box_iou_pairs(b1, b2):
+    """
+    Elementwise box_iou between b1[i] and b2[i] for (N,4) box arrays
+
+    Returns:
+        (N,) float64 array
+    """
+    b1=boxes_array(b1)
+    b2=boxes_array(b2)
+    iw=np.minimum(b1[:,2], b2[:,2])
+    iw-=np.maximum(b1[:,0], b2[:,0])
+    np.maximum(iw, 0, out=iw)
+    ih=np.minimum(b1[:,3], b2[:,3])
+    ih-=np.maximum(b1[:,1], b2[:,1])
+    np.maximum(ih, 0, out=ih)
+    iw*=ih
+    a1=(b1[:,2]-b1[:,0])*(b1[:,3]-b1[:,1])
+    a2=(b2[:,2]-b2[:,0])*(b2[:,3]-b2[:,1])
+    d=a1+a2
+    d-=iw
+    d+=1e-7
+    iw/=d
+    return iw
+
+def kp_iou2_array(kp1, kp2, s, sigma=0.06):
+    """
+    Vectorized kp_iou2: OKS style similarity between keypoint arrays kp1
+    and kp2 of shape (...,K,3) (x,y,conf), broadcasting over the leading
+    dimensions, with object scale s (an area, shape (...)).
+    Only points with conf>0 in both count, the similarity is 0 if there
+    are none.
+    """
+    kp1=np.asarray(kp1, dtype=np.float64)
+    kp2=np.asarray(kp2, dtype=np.float64)
+    s=np.asarray(s, dtype=np.float64)
+    d2=(kp1[...,0]-kp2[...,0])**2+(kp1[...,1]-kp2[...,1])**2
+    visible=(kp1[...,2]>0) & (kp2[...,2]>0)
+    e=np.exp(-d2/(2*s[...,None]*(2*sigma)**2+1e-9))
+    n=visible.sum(axis=-1)
+    total=np.where(visible, e, 0).sum(axis=-1)
+    return np.where(n>0, total/np.maximum(n, 1), 0.0)
+
+def kp_iou2(kp_gt, kp_det, s, num_pt, sigma=0.06):
+    """
+    OKS style similarity between two flat [x,y,conf,...] keypoint lists
+    of 'num_pt' points with object scale s (an area), see kp_iou2_array
+    """
+    kp_gt=np.asarray(kp_gt[0:3*num_pt], dtype=np.float64).reshape(num_pt, 3)
+    kp_det=np.asarray(kp_det[0:3*num_pt], dtype=np.float64).reshape(num_pt, 3)
+    return float(kp_iou2_array(kp_gt, kp_det, s, sigma))
+
+def box_nms(boxes, scores, iou_thr, classes=None):
+    """
+    Greedy non-maximum suppression: going through boxes in descending
+    score order (ties in input order) suppress later boxes with
+    iou>'iou_thr' to a box that isn't itself suppressed. With 'classes'
+    only boxes of the same class suppress each other.
+
+    Returns:
+        (N,) bool keep mask in input order
+    """
+    boxes=boxes_array(boxes)
+    n=len(boxes)
+    order=np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    iou=box_iou_matrix(boxes[order], boxes[order])
+    if classes is not None:
+        c=np.asarray(classes)[order]
+        iou[c[:,None]!=c[None,:]]=0
+    suppressed=np.zeros(n, bool)
+    for i in range(n):
+        if suppressed[i]:
+            continue
+        suppressed[i+1:]|=iou[i,i+1:]>iou_thr
+    keep=np.zeros(n, bool)
+    keep[order]=~suppressed
+    return keep
+
 def point_in_box(pt, box):
     if pt[0]<box[0] or pt[0]>box[2]:
         return None
@@ -100,13 +278,125 @@ def point_in_box(pt, box):
     d+=abs(pt[1]-0.5*(box[1]+box[3]))
     return d
 
-def interpolate(x, y, f):
-    if isinstance(x, float) or isinstance(x, int):
+class BoxGrid:
+    """
+    Uniform grid over normalized [x0,y0,x1,y1] boxes for finding the boxes
+    containing a point. Boxes are added with add() and removed with
+    clear(); the grid is (re)built on the next query. Boxes spanning more
+    than 'max_box_cells' cells are kept in a list checked on every query
+    rather than in the grid. With fewer than 'scan_below' boxes queries
+    just check them all.
+    """
+    def __init__(self, boxes=None, cells=None, max_box_cells=64, scan_below=32):
+        self.cells=cells
+        self.max_box_cells=max_box_cells
+        self.scan_below=scan_below
+        self.boxes=[]
+        self.built=None
+        if boxes is not None:
+            self.add_boxes(boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def add(self, box):
+        """
+        Add a box; returns its index
+        """
+        self.boxes.append(list(box[0:4]))
+        self.built=None
+        return len(self.boxes)-1
+
+    def add_boxes(self, boxes):
+        for b in boxes:
+            self.add(b)
+
+    def clear(self):
+        self.boxes=[]
+        self.built=None
+
+    def build(self):
+        """
+        Bucket the boxes into cells: 'order' lists box indices by cell and
+        cell i holds order[start[i]:start[i+1]]
+        """
+        boxes=np.array(self.boxes, dtype=np.float64).reshape(-1, 4)
+        n=len(boxes)
+        g=self.cells if self.cells is not None else max(1, min(64, int(np.sqrt(n))))
+        c=np.clip(np.floor(boxes*g).astype(np.int64), 0, g-1)
+        nx=c[:,2]-c[:,0]+1
+        ny=c[:,3]-c[:,1]+1
+        big=nx*ny>self.max_box_cells
+        small=np.flatnonzero(~big)
+        # one (cell, box) entry for every cell each small box covers
+        counts=(nx*ny)[small]
+        box_ids=np.repeat(small, counts)
+        offsets=np.arange(len(box_ids))-np.repeat(np.cumsum(counts)-counts, counts)
+        w=nx[box_ids]
+        cx=c[box_ids,0]+offsets%w
+        cy=c[box_ids,1]+offsets//w
+        cell_ids=cy*g+cx
+        order=np.argsort(cell_ids, kind="stable")
+        start=np.zeros(g*g+1, np.int64)
+        start[1:]=np.cumsum(np.bincount(cell_ids, minlength=g*g))
+        self.built={"boxes":boxes, "g":g, "order":box_ids[order], "start":start,
+                    "big":np.flatnonzero(big)}
+
+    def query(self, pt, metric="l1"):
+        """
+        Return (indices, distances) of the boxes containing point 'pt'
+        (edges included), nearest centre first, ties in index order.
+        'metric' is "l1" for |dx|+|dy| as point_in_box, or "sq" for the
+        squared distance to the centre
+        """
+        x, y=pt[0], pt[1]
+        if len(self.boxes)<self.scan_below:
+            hits=[]
+            for i, box in enumerate(self.boxes):
+                if x<box[0] or x>box[2] or y<box[1] or y>box[3]:
+                    continue
+                dx=x-0.5*(box[0]+box[2])
+                dy=y-0.5*(box[1]+box[3])
+                hits.append((abs(dx)+abs(dy) if metric=="l1" else dx*dx+dy*dy, i))
+            hits.sort()
+            return (np.array([i for _, i in hits], np.int64),
+                    np.array([d for d, _ in hits], np.float64))
+        if self.built is None:
+            self.build()
+        b=self.built
+        g=b["g"]
+        cx=min(max(int(np.floor(x*g)), 0), g-1)
+        cy=min(max(int(np.floor(y*g)), 0), g-1)
+        cell=cy*g+cx
+        cand=np.concatenate([b["order"][b["start"][cell]:b["start"][cell+1]], b["big"]])
+        boxes=b["boxes"][cand]
+        inside=(x>=boxes[:,0]) & (x<=boxes[:,2]) & (y>=boxes[:,1]) & (y<=boxes[:,3])
+        cand=cand[inside]
+        boxes=boxes[inside]
+        dx=x-0.5*(boxes[:,0]+boxes[:,2])
+        dy=y-0.5*(boxes[:,1]+boxes[:,3])
+        if metric=="l1":
+            d=np.abs(dx)+np.abs(dy)
+        else:
+            d=dx*dx+dy*dy
+        order=np.lexsort((cand, d))
+        return cand[order], d[order]
+
+def interpolate(x, y, f, out=None):
+    """
+    (1-f)*x+f*y. Numbers are returned, lists are updated in place (and
+    None returned). Anything else, e.g. arrays of boxes or keypoints, is
+    done with numpy, broadcasting x, y and f (so f can be an array, say
+    one weight per frame), and returned; pass out=x to update x in place
+    """
+    if out is None and (isinstance(x, float) or isinstance(x, int)):
         return (1.0-f)*x+f*y
-    if isinstance(x, list):
+    if out is None and isinstance(x, list):
         assert len(x)==len(y)
         for i in range(len(x)):
             x[i]=(1.0-f)*x[i]+f*y[i]
         return
-    print("interpolate: unsupported type")
-    exit()
\ No newline at end of file
+    f=np.asarray(f, dtype=np.float64)
+    fy=np.multiply(y, f)
+    out=np.multiply(x, 1.0-f, out=out)
+    return np.add(out, fy, out=out)
@@ -0,0 +1,220 @@
+import numpy as np
+
+def keypoint_layout(num_kp):
+    """
+    Return slices for the face, pose, facepose and attribute keypoints in
+    a set of 'num_kp' yolo keypoints (None where a type isn't present):
+      5  - face points
+      17 - pose points
+      19 - facepose points
+      22 - face points then pose points
+      >22 - face points, pose points then attribute points
+    """
+    if num_kp==17:
+        return None, slice(0, 17), None, None
+    elif num_kp==22:
+        return slice(0, 5), slice(5, 22), None, None
+    elif num_kp==5:
+        return slice(0, 5), None, None, None
+    elif num_kp==19:
+        return None, None, slice(0, 19), None
+    elif num_kp>22:
+        return slice(0, 5), slice(5, 22), None, slice(22, num_kp)
+    print("Bad number of yolo keypoints "+str(3*num_kp))
+    return None, None, None, None
+
+# face point order is right eye, left eye, nose, right mouth, left mouth;
+# these are their positions in the coco/facepose order
+FACE_TO_FACEPOSE=np.array([2, 1, 0, 18, 17])
+
+def yolo_keypoints(xy, conf=None):
+    """
+    Combine (N,K,2) yolo keypoint positions and (N,K) confidences (all 1
+    if None) into (N,K,3) x,y,conf with conf 0 for points at (0,0)
+    """
+    xy=np.asarray(xy, dtype=np.float64)
+    if conf is None:
+        conf=np.ones(xy.shape[:2])
+    conf=np.where((xy[...,0]<=0) & (xy[...,1]<=0), 0, conf)
+    return np.concatenate([xy, conf[...,None]], axis=-1)
+
+def split_keypoints(keypoints):
+    """
+    Split (N,K,3) keypoints into their face (N,5,3), pose (N,17,3),
+    facepose (N,19,3) and attribute (N,A,3) parts per keypoint_layout,
+    None for the parts that aren't there
+    """
+    if keypoints is None:
+        return None, None, None, None
+    return tuple(None if s is None else keypoints[:, s, :]
+                 for s in keypoint_layout(keypoints.shape[1]))
+
+def map_keypoint_arrays(face, pose, facepose, n, face_kp=False, pose_kp=False, facepose_kp=False):
+    """
+    Array version of ultralytics.map_one_gt_keypoints for n detections:
+    convert face/pose/facepose (N,k,3) keypoints (or None) to the wanted
+    types. With facepose_kp the pose points and any face points with a
+    visible point go into facepose points; otherwise facepose points are
+    split into face and pose points and missing wanted types are zero.
+    Returns face, pose, facepose with None for types not wanted
+    """
+    if facepose_kp:
+        assert face_kp is False
+        assert pose_kp is False
+        if facepose is not None:
+            return None, None, facepose
+        facepose=np.zeros((n, 19, 3))
+        if pose is not None:
+            facepose[:, 0:17]=pose
+        if face is not None:
+            has_fp=np.any(face[:,:,2]>0, axis=1)
+            facepose[:, FACE_TO_FACEPOSE]=np.where(has_fp[:,None,None], face, facepose[:, FACE_TO_FACEPOSE])
+        return None, None, facepose
+
+    if facepose is not None:
+        face=facepose[:, FACE_TO_FACEPOSE]
+        pose=facepose[:, 0:17]
+    if face_kp and face is None:
+        face=np.zeros((n, 5, 3))
+    if pose_kp and pose is None:
+        pose=np.zeros((n, 17, 3))
+    return face if face_kp else None, pose if pose_kp else None, None
+
+def facepose_face_boxes(facepose, min_points=2):
+    """
+    Face boxes from the five face points (eyes, nose, mouth corners) of
+    (N,19,3) facepose keypoints: a square of twice the larger side of
+    the visible points' extent, about its centre, clipped to 0..1.
+    Returns (N,4) boxes and an (N,) bool mask of the detections with at
+    least 'min_points' visible face points and a non-zero extent
+    """
+    face=facepose[:, FACE_TO_FACEPOSE]
+    visible=face[:,:,2]>0
+    lo=np.where(visible[:,:,None], face[:,:,0:2], np.inf).min(axis=1)
+    hi=np.where(visible[:,:,None], face[:,:,0:2], -np.inf).max(axis=1)
+    valid=visible.sum(axis=1)>=min_points
+    lo[~valid]=0
+    hi[~valid]=0
+    centre=0.5*(lo+hi)
+    size=(hi-lo).max(axis=1, keepdims=True)
+    valid&=size[:,0]>0
+    boxes=np.clip(np.concatenate([centre-size, centre+size], axis=1), 0.0, 1.0)
+    return boxes, valid
+
+class Detections:
+    """
+    A set of N detections stored as arrays rather than one dict each:
+        boxes       (N,4) float64 xyxy, normalized
+        classes     (N,) int64
+        confidences (N,) float64
+        ids         (N,) float64 track ids, nan where there is none
+        keypoints   (N,K,3) float64 x,y,conf or None
+
+    Index it with a slice, index array or mask to get a subset. to_dicts()
+    gives the per-detection dicts used by yolo_results_to_dets and friends.
+    """
+    def __init__(self, boxes=None, classes=None, confidences=None, ids=None, keypoints=None):
+        self.boxes=np.zeros((0, 4)) if boxes is None else np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n=len(self.boxes)
+        self.classes=np.zeros(n, np.int64) if classes is None else np.asarray(classes, dtype=np.int64)
+        self.confidences=np.ones(n) if confidences is None else np.asarray(confidences, dtype=np.float64)
+        self.ids=np.full(n, np.nan) if ids is None else np.asarray(ids, dtype=np.float64)
+        self.keypoints=None if keypoints is None else np.asarray(keypoints, dtype=np.float64)
+        assert len(self.classes)==n and len(self.confidences)==n and len(self.ids)==n
+        assert self.keypoints is None or self.keypoints.shape[0]==n
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, index):
+        return Detections(self.boxes[index],
+                          self.classes[index],
+                          self.confidences[index],
+                          self.ids[index],
+                          None if self.keypoints is None else self.keypoints[index])
+
+    @staticmethod
+    def concatenate(dets_list):
+        """
+        Join several Detections; keypoints are kept only if all of them
+        have the same number of keypoints
+        """
+        dets_list=list(dets_list)
+        if len(dets_list)==0:
+            return Detections()
+        keypoints=None
+        kp=[d.keypoints for d in dets_list]
+        if all(k is not None for k in kp) and len(set(k.shape[1] for k in kp))==1:
+            keypoints=np.concatenate(kp)
+        return Detections(np.concatenate([d.boxes for d in dets_list]),
+                          np.concatenate([d.classes for d in dets_list]),
+                          np.concatenate([d.confidences for d in dets_list]),
+                          np.concatenate([d.ids for d in dets_list]),
+                          keypoints)
+
+    def poseattr(self):
+        """
+        Return the (N,A) attribute keypoint confidences, or None
+        """
+        if self.keypoints is None:
+            return None
+        attr=keypoint_layout(self.keypoints.shape[1])[3]
+        if attr is None:
+            return None
+        return self.keypoints[:, attr, 2]
+
+    def expand_attributes(self, attr_class_map, thr=0.01):
+        """
+        Return a copy of each detection for every pose attribute with
+        confidence>'thr', with class attr_class_map[attribute] and that
+        confidence, in detection then attribute order
+        """
+        poseattr=self.poseattr()
+        if poseattr is None or len(attr_class_map)==0:
+            return self[np.zeros(0, np.int64)]
+        poseattr=poseattr[:, :len(attr_class_map)]
+        i, j=np.nonzero(poseattr>thr)
+        out=self[i]
+        out.classes=np.asarray(attr_class_map, dtype=np.int64)[j]
+        out.confidences=poseattr[i, j]
+        return out
+
+    def to_dicts(self, face_kp=None, pose_kp=None, facepose_kp=None):
+        """
+        Return a list of per-detection dicts with keys box, id, class,
+        confidence and, depending on the keypoints, face_points,
+        pose_points, facepose_points (flat [x,y,conf,...] lists) and
+        poseattr (attribute keypoint confidences)
+
+        If any of face_kp, pose_kp, facepose_kp is given the keypoints are
+        first converted to those types (see map_keypoint_arrays), giving
+        the same dicts as map_one_gt_keypoints would
+        """
+        boxes=self.boxes.tolist()
+        classes=self.classes.tolist()
+        confidences=self.confidences.tolist()
+        ids=[None if np.isnan(i) else i for i in self.ids.tolist()]
+        kp_fields=[]
+        if len(self)>0:
+            face, pose, facepose, attr=split_keypoints(self.keypoints)
+            if face_kp is not None or pose_kp is not None or facepose_kp is not None:
+                face, pose, facepose=map_keypoint_arrays(face, pose, facepose, len(self),
+                                                         face_kp=bool(face_kp),
+                                                         pose_kp=bool(pose_kp),
+                                                         facepose_kp=bool(facepose_kp))
+            for name, kp in [("face_points", face), ("pose_points", pose), ("facepose_points", facepose)]:
+                if kp is not None:
+                    kp_fields.append((name, kp.reshape(len(kp), -1).tolist()))
+            if attr is not None:
+                kp_fields.append(("poseattr", attr[:,:,2].tolist()))
+
+        out=[]
+        for i in range(len(boxes)):
+            det={"box":boxes[i],
+                 "id":ids[i],
+                 "class":classes[i],
+                 "confidence":confidences[i]}
+            for name, values in kp_fields:
+                det[name]=values[i]
+            out.append(det)
+        return out
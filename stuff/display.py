@@ -1,57 +1,319 @@
+import asyncio
+import os
 import cv2
 import numpy as np
 import stuff.coord as coord
 import stuff.draw as draw
 
 def window_mouse_callback(event, x, y, flags, display):
+    """
+    HighGUI mouse callback: queue clicks, and moves coalesced so only the
+    latest is kept until the events are read. Hit testing ("selected")
+    is left to Display.get_events
+    """
     xc=(x-display.pad_l)/display.img_width
     yc=(y-display.pad_t)/display.img_height
     #print(xc,yc)
     if xc<0 or xc>1 or yc<0 or yc>1:
         return
     if event==cv2.EVENT_LBUTTONDOWN or event==cv2.EVENT_MOUSEMOVE:
-        boxes=display.selected_boxes([xc,yc])
         lbutton=event==cv2.EVENT_LBUTTONDOWN
+        if not lbutton:
+            display.events=[e for e in display.events if not is_move_event(e)]
         event={"x":xc,
                "y":yc,
                "key":None, 
                "lbutton":lbutton, 
                "rbutton":False, 
-               "selected":boxes}
+               "selected":None}
         display.events.append(event)
 
+def is_move_event(event):
+    return event["key"] is None and not event["lbutton"] and not event["rbutton"]
+
+class OverlayBlender:
+    """
+    Alpha blends (alpha,b,g,r) uint8 overlays onto uint8 images with cv2
+    integer ops, using scratch buffers allocated once for images up to
+    height x width
+    """
+    def __init__(self, height, width):
+        self.alpha=np.empty((height, width), np.uint8)
+        self.alpha3=np.empty((height, width, 3), np.uint8)
+        self.inv_alpha3=np.empty((height, width, 3), np.uint8)
+        self.colour=np.empty((height, width, 3), np.uint8)
+        self.weighted=np.empty((height, width, 3), np.uint8)
+
+    def blend(self, src, overlay, dst):
+        """
+        dst=(src*(255-alpha)+overlay*alpha)/255 for (h,w,3) src and dst and
+        (h,w,4) overlay; dst can be src
+        """
+        h, w=src.shape[:2]
+        alpha=self.alpha[:h, :w]
+        alpha3=self.alpha3[:h, :w]
+        inv_alpha3=self.inv_alpha3[:h, :w]
+        colour=self.colour[:h, :w]
+        weighted=self.weighted[:h, :w]
+        cv2.extractChannel(overlay, 0, dst=alpha)
+        cv2.cvtColor(alpha, cv2.COLOR_GRAY2BGR, dst=alpha3)
+        cv2.bitwise_not(alpha3, dst=inv_alpha3)
+        cv2.mixChannels([overlay], [colour], [1,0, 2,1, 3,2])
+        cv2.multiply(colour, alpha3, dst=weighted, scale=1/255)
+        cv2.multiply(src, inv_alpha3, dst=dst, scale=1/255)
+        cv2.add(dst, weighted, dst=dst)
+
+class DirtyTiles:
+    """
+    Tracks which 'tile' x 'tile' pixel tiles of a height x width overlay
+    have been drawn on since the last reset()
+    """
+    def __init__(self, height, width, tile=32):
+        self.height=height
+        self.width=width
+        self.tile=tile
+        self.mask=np.zeros(((height+tile-1)//tile, (width+tile-1)//tile), bool)
+        self.dirty=False
+
+    def add(self, rect=None):
+        """
+        Mark pixel rect [x0,y0,x1,y1) dirty, or everything if None
+        """
+        self.dirty=True
+        if rect is None:
+            self.mask[:]=True
+            return
+        t=self.tile
+        x0=max(0, rect[0])//t
+        y0=max(0, rect[1])//t
+        x1=(min(self.width, rect[2])+t-1)//t
+        y1=(min(self.height, rect[3])+t-1)//t
+        if x1>x0 and y1>y0:
+            self.mask[y0:y1, x0:x1]=True
+
+    def add_rects(self, rects):
+        """
+        Mark an (N,4) array of pixel rects [x0,y0,x1,y1) dirty
+        """
+        if len(rects)==0:
+            return
+        self.dirty=True
+        t=self.tile
+        rects=np.asarray(rects)
+        x0=np.maximum(rects[:,0], 0)//t
+        y0=np.maximum(rects[:,1], 0)//t
+        x1=(np.minimum(rects[:,2], self.width)+t-1)//t
+        y1=(np.minimum(rects[:,3], self.height)+t-1)//t
+        for tx0, ty0, tx1, ty1 in np.stack([x0, y0, x1, y1], axis=1).tolist():
+            if tx1>tx0 and ty1>ty0:
+                self.mask[ty0:ty1, tx0:tx1]=True
+
+    def reset(self):
+        if self.dirty:
+            self.mask[:]=False
+        self.dirty=False
+
+    def fraction(self):
+        """
+        Fraction of the tiles that are dirty
+        """
+        if not self.dirty:
+            return 0.0
+        return np.count_nonzero(self.mask)/self.mask.size
+
+    def rects(self):
+        """
+        Return the dirty area as a list of pixel rects [x0,y0,x1,y1): runs
+        of dirty tiles along each tile row, merged with identical runs in
+        the rows below
+        """
+        if not self.dirty:
+            return []
+        t=self.tile
+        edges=np.diff(self.mask.astype(np.int8), axis=1, prepend=0, append=0)
+        rects=[]
+        open_runs={}    # (c0,c1) -> first tile row
+        for r in range(self.mask.shape[0]):
+            starts=np.flatnonzero(edges[r]==1)
+            stops=np.flatnonzero(edges[r]==-1)
+            runs={(int(c0), int(c1)) for c0, c1 in zip(starts, stops)}
+            for run in list(open_runs):
+                if not run in runs:
+                    rects.append((run, open_runs.pop(run), r))
+            for run in runs:
+                if not run in open_runs:
+                    open_runs[run]=r
+        for run, r0 in open_runs.items():
+            rects.append((run, r0, self.mask.shape[0]))
+        return [[c0*t, r0*t, min(self.width, c1*t), min(self.height, r1*t)]
+                for (c0, c1), r0, r1 in rects]
+
+def composite(frame, layers, blender, out, full_fraction=0.6):
+    """
+    Blend the overlays in 'layers', a list of (overlay, DirtyTiles), onto
+    'frame' in order. Only dirty rects are blended unless more than
+    'full_fraction' of an overlay is dirty. Returns 'out' with the result,
+    or 'frame' itself if nothing was drawn
+    """
+    src=frame
+    for overlay, tiles in layers:
+        if not tiles.dirty:
+            continue
+        if tiles.fraction()>full_fraction:
+            blender.blend(src, overlay, out)
+        else:
+            if src is frame:
+                np.copyto(out, frame)
+            for x0, y0, x1, y1 in tiles.rects():
+                roi=out[y0:y1, x0:x1]
+                blender.blend(roi, overlay[y0:y1, x0:x1], roi)
+        src=out
+    return src
+
+def clear_overlay(overlay, tiles, full_fraction=0.6):
+    """
+    Zero the dirty parts of 'overlay' and reset 'tiles'
+    """
+    if tiles.fraction()>full_fraction:
+        overlay[:]=0
+    else:
+        for x0, y0, x1, y1 in tiles.rects():
+            overlay[y0:y1, x0:x1]=0
+    tiles.reset()
+
+class VideoSink:
+    """
+    Writes frames to a video file with cv2.VideoWriter, opened on the
+    first write() with that frame's size
+    """
+    def __init__(self, path, fps=30.0, fourcc="mp4v"):
+        self.path=path
+        self.fps=fps
+        self.fourcc=fourcc
+        self.writer=None
+        self.count=0
+
+    def write(self, frame):
+        if self.writer is None:
+            h, w=frame.shape[:2]
+            self.writer=cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+            if not self.writer.isOpened():
+                raise IOError(f"Could not open {self.path} for writing")
+        self.writer.write(frame)
+        self.count+=1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer=None
+
+class ImageSequenceSink:
+    """
+    Writes frames to numbered image files, 'pattern' % frame number,
+    e.g. "out/frame_%06d.jpg"; 'params' are passed to cv2.imwrite
+    """
+    def __init__(self, pattern, start=0, params=None):
+        self.pattern=pattern
+        self.count=start
+        self.params=params if params is not None else []
+        folder=os.path.dirname(pattern)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def write(self, frame):
+        path=self.pattern % self.count
+        if not cv2.imwrite(path, frame, self.params):
+            raise IOError(f"Could not write {path}")
+        self.count+=1
+
+    def close(self):
+        pass
+
 class Display:
-    def __init__(self, width=1920, height=1080, image=None, name="noname"):
+    """
+    Shows images scaled and padded to width x height in a window, with
+    two RGBA overlays (drawn to with the draw_ methods and cleared with
+    clear()) blended on top. Only the tiles of the overlays drawn on
+    since the last clear() are blended and cleared; code drawing on the
+    overlays directly should call mark_drawn().
+
+    With offscreen=True no window is opened, so it works without a
+    display: show() just composites. Every shown frame is also passed to
+    'sink' (e.g. a VideoSink or ImageSequenceSink) if given.
+    """
+    def __init__(self, width=1920, height=1080, image=None, name="noname", offscreen=False, sink=None):
         self.width=width
         self.height=height
         self.window_name=name
         self.events=[]
         self.selected_boxes_list=[]
+        self.selected_boxes_index=coord.BoxGrid()
+        self.selected_boxes_indexed=None  # the list selected_boxes_index was built from
         self.overlay_front=np.zeros((self.height, self.width, 4), np.uint8)
         self.overlay_back=np.zeros((self.height, self.width, 4), np.uint8)
+        self.front_tiles=DirtyTiles(self.height, self.width)
+        self.back_tiles=DirtyTiles(self.height, self.width)
+        self.frame=np.zeros((self.height, self.width, 3), np.uint8)     # padded input image
+        self.blended=np.zeros((self.height, self.width, 3), np.uint8)   # frame with overlays
+        self.blender=OverlayBlender(self.height, self.width)
+        self.image_shape=None
+        self.offscreen=offscreen
+        self.sink=None
         if image is None:
             image=np.zeros((self.height, self.width, 3), np.uint8)
-        self.show(image)
-
-        cv2.imshow(self.window_name, image)
-        cv2.setMouseCallback(self.window_name, window_mouse_callback, self)
+        if offscreen:
+            self.compose(image)
+        else:
+            self.show(image)
+            cv2.imshow(self.window_name, image)
+            cv2.setMouseCallback(self.window_name, window_mouse_callback, self)
+        self.sink=sink
 
     def __del__(self):
-        cv2.destroyWindow(self.window_name)
+        if not getattr(self, "offscreen", True):
+            cv2.destroyWindow(self.window_name)
+
+    def close(self):
+        """
+        Close the sink, if any
+        """
+        if self.sink is not None:
+            self.sink.close()
+            self.sink=None
 
     def selected_boxes(self, pt):
+        """
+        Return copies of the selectable boxes containing 'pt' with their
+        distance from it as "dist", nearest first
+        """
+        indices, dists=self.selected_boxes_grid().query(pt)
         best_boxes=[]
-        for b in self.selected_boxes_list:
-            d=coord.point_in_box(pt, b["box"])
-            if d is not None:
-                bc=b.copy()
-                bc["dist"]=d
-                best_boxes.append(bc)
-        best_boxes.sort(key=lambda x: x["dist"])
+        for i, d in zip(indices.tolist(), dists.tolist()):
+            bc=self.selected_boxes_list[i].copy()
+            bc["dist"]=d
+            best_boxes.append(bc)
         return best_boxes
 
-    def show(self, image, title=None):
-        h, w, _ = image.shape
+    def selected_boxes_grid(self):
+        """
+        Return selected_boxes_index brought up to date with
+        selected_boxes_list: entries appended since the last query are
+        added, and it is rebuilt if the list was replaced or shortened
+        """
+        boxes=self.selected_boxes_list
+        index=self.selected_boxes_index
+        if self.selected_boxes_indexed is not boxes or len(index)>len(boxes):
+            index.clear()
+            self.selected_boxes_indexed=boxes
+        for d in boxes[len(index):]:
+            index.add(d["box"])
+        return index
+
+    def set_geometry(self, image_shape):
+        """
+        Work out the scale and padding for images of 'image_shape'
+        """
+        h, w=image_shape[:2]
         scale=min(self.width/w, self.height/h)
         self.img_width=min(self.width, int(scale*w))
         self.img_height=min(self.height, int(scale*h))
@@ -65,62 +327,167 @@ class Display:
                       1.0-self.pad_r/self.width,
                       1.0-self.pad_b/self.height]
 
-        image_resized=cv2.resize(image, (self.img_width, self.img_height))
-        image_padded=cv2.copyMakeBorder(image_resized,
-                                        self.pad_t, self.pad_b, self.pad_l, self.pad_r,
-                                        cv2.BORDER_CONSTANT, (0,0,0))
-        
-        blended=image_padded
-        
-        for overlay in [self.overlay_back, self.overlay_front]:
-            # Split the overlay into its channels
-            alpha, r, g, b = cv2.split(overlay)
-            # Normalize the alpha channel to the range [0, 1]
-            alpha = alpha.astype(float) / 255
-            # Ensure the base is float for blending
-            base = blended.astype(float)
-            # Stack the RGB channels of the overlay for blending
-            overlay_rgb = cv2.merge((r, g, b))
-            # Blend the images using alpha
-            blended = (1 - alpha[..., np.newaxis]) * base + alpha[..., np.newaxis] * overlay_rgb
-            # Convert the result back to uint8
-            blended = blended.astype(np.uint8)
-
-        cv2.imshow(self.window_name, blended)
-        if title is not None:
-            cv2.setWindowTitle(self.window_name, title)
+        self.frame[:]=0
+        self.frame_image=self.frame[self.pad_t:self.pad_t+self.img_height,
+                                    self.pad_l:self.pad_l+self.img_width]
+        self.image_shape=image_shape
 
-    def get_events(self, delay_ms):
-        r=cv2.waitKey(delay_ms)  # Press any key to move to the next image
-        if r==27:
+    def compose(self, image):
+        """
+        Scale and pad 'image' and blend the overlays on top. Returns the
+        composited frame, a buffer that is reused by the next call
+        """
+        if image.shape!=self.image_shape:
+            self.set_geometry(image.shape)
+        if image.shape[0]==self.img_height and image.shape[1]==self.img_width:
+            np.copyto(self.frame_image, image)
+        else:
+            cv2.resize(image, (self.img_width, self.img_height), dst=self.frame_image)
+
+        return composite(self.frame,
+                         [(self.overlay_back, self.back_tiles), (self.overlay_front, self.front_tiles)],
+                         self.blender,
+                         self.blended)
+
+    def show(self, image, title=None):
+        """
+        Composite 'image' with the overlays, show it in the window (unless
+        offscreen) and write it to the sink. Returns the composited frame,
+        a buffer that is reused by the next call
+        """
+        blended=self.compose(image)
+        if self.sink is not None:
+            self.sink.write(blended)
+        if not self.offscreen:
+            cv2.imshow(self.window_name, blended)
+            if title is not None:
+                cv2.setWindowTitle(self.window_name, title)
+        return blended
+
+    def take_events(self, key=-1):
+        """
+        Queue the key code 'key' from waitKey/pollKey (if not -1), then
+        return and empty the event queue, hit testing the mouse events
+        """
+        if key==27:
             print("Quitting")
             quit()
-        if r!=-1:
-            event={"x":None, "y":None, "key":chr(r), "lbutton":False, "rbutton":False}
+        if key!=-1:
+            event={"x":None, "y":None, "key":chr(key), "lbutton":False, "rbutton":False}
             self.events.append(event)
         ret=self.events
         self.events=[]
+        for e in ret:
+            if "selected" in e and e["selected"] is None:
+                e["selected"]=self.selected_boxes([e["x"], e["y"]])
         return ret
-    
+
+    def get_events(self, delay_ms):
+        if self.offscreen:
+            # no window, so no keys or mouse events to wait for
+            return self.take_events()
+        r=cv2.waitKey(delay_ms)  # Press any key to move to the next image
+        return self.take_events(r)
+
+    def poll_events(self):
+        """
+        Like get_events but doesn't wait: handles pending window events
+        with cv2.pollKey and returns what is queued
+        """
+        if self.offscreen:
+            return self.take_events()
+        return self.take_events(cv2.pollKey())
+
+    async def wait_events(self, timeout=None, interval=0.005):
+        """
+        Wait for events without blocking an asyncio event loop, polling
+        every 'interval' seconds. Returns them, or [] after 'timeout'
+        seconds. HighGUI must be pumped from one thread, so await this
+        from the thread that made the window
+        """
+        loop=asyncio.get_running_loop()
+        end=None if timeout is None else loop.time()+timeout
+        while True:
+            events=self.poll_events()
+            if events or (end is not None and loop.time()>=end):
+                return events
+            await asyncio.sleep(interval)
+
     def clear(self):
-        self.overlay_front[0:self.height, 0:self.width]=(0,0,0,0)
-        self.overlay_back[0:self.height, 0:self.width]=(0,0,0,0)
+        draw.update_flashing()
+        clear_overlay(self.overlay_front, self.front_tiles)
+        clear_overlay(self.overlay_back, self.back_tiles)
         self.selected_boxes_list=[]
 
+    def mark_drawn(self, rect=None, front=True, back=False):
+        """
+        Record that pixel rect [x0,y0,x1,y1) (everything if None) of the
+        front and/or back overlay has been drawn on
+        """
+        if front:
+            self.front_tiles.add(rect)
+        if back:
+            self.back_tiles.add(rect)
+
     def draw_line(self, start, stop, clr=None, thickness=1):
         start_img=coord.unmap_roi_point(self.img_roi, start)
         stop_img=coord.unmap_roi_point(self.img_roi, stop)
-        draw.draw_line(self.overlay_front, start_img, stop_img, clr=clr, thickness=thickness)
+        rect=draw.draw_line(self.overlay_front, start_img, stop_img, clr=clr, thickness=thickness)
+        self.front_tiles.add(rect)
 
     def draw_box(self, box, clr=None, thickness=1, select_context=None):
         box_img=coord.unmap_roi_box(self.img_roi, box)
-        draw.draw_box(self.overlay_front, box_img, clr=clr, thickness=thickness)
+        rect=draw.draw_box(self.overlay_front, box_img, clr=clr, thickness=thickness)
+        self.front_tiles.add(rect)
         if select_context:
             self.selected_boxes_list.append({"box":box, "context":select_context})
 
+    def unmap_points(self, points):
+        """
+        Map an (...,2) array of normalized image points to the display
+        """
+        return coord.unmap_roi_points(self.img_roi, points)
+
+    def draw_boxes_batch(self, boxes, clr=None, thickness=1, select_contexts=None):
+        """
+        Draw an (N,4) array of boxes; 'clr' and 'thickness' can be one value
+        or one per box (see draw.style_groups). 'select_contexts' is an
+        optional list with a select_context (or None) per box
+        """
+        boxes=np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        boxes_img=coord.unmap_roi_boxes(self.img_roi, boxes)
+        rects=draw.draw_boxes_batch(self.overlay_front, boxes_img, clr=clr, thickness=thickness)
+        self.front_tiles.add_rects(rects)
+        if select_contexts is not None:
+            for box, context in zip(boxes.tolist(), select_contexts):
+                if context:
+                    self.selected_boxes_list.append({"box":box, "context":context})
+
+    def draw_polylines_batch(self, lines, clr=None, thickness=1, closed=False):
+        """
+        Draw an (N,P,2) array of polylines, e.g. (N,2,2) line segments;
+        'clr' and 'thickness' can be one value or one per line
+        """
+        if len(lines)==0:
+            return
+        rects=draw.draw_polylines_batch(self.overlay_front, self.unmap_points(lines),
+                                        clr=clr, thickness=thickness, closed=closed)
+        self.front_tiles.add_rects(rects)
+
+    def draw_circles_batch(self, centres, radius, clr=None):
+        """
+        Draw filled circles at an (N,2) array of centres; 'clr' can be one
+        value or one per circle
+        """
+        if len(centres)==0:
+            return
+        rects=draw.draw_circles_batch(self.overlay_front, self.unmap_points(centres), radius, clr=clr)
+        self.front_tiles.add_rects(rects)
+
     def draw_circle(self, centre, radius, clr=None, thickness=1):
         c=coord.unmap_roi_point(self.img_roi, centre)
-        draw.draw_circle(self.overlay_front, c, radius, clr=clr, thickness=thickness)
+        rect=draw.draw_circle(self.overlay_front, c, radius, clr=clr, thickness=thickness)
+        self.front_tiles.add(rect)
 
     def draw_text(self, text, xc, yc,
               font=cv2.FONT_HERSHEY_SIMPLEX,
@@ -135,7 +502,7 @@ class Display:
         else:
             pos_img=[xc,yc]
     
-        draw.draw_text(self.overlay_front,
+        rect=draw.draw_text(self.overlay_front,
                        text,
                        pos_img[0], pos_img[1],
                        img_bg=self.overlay_back,
@@ -145,6 +512,8 @@ class Display:
                        bgColor=bgColor,
                        lineType=lineType,
                        thickness=thickness)
+        self.front_tiles.add(rect)
+        self.back_tiles.add(rect)
 
 def display_image_wait_key(image, scale=0, title="no title"):
     display=Display(image=image, name=title)
@@ -1,68 +1,351 @@
 import cv2
+import numpy as np
+from collections import OrderedDict
 import stuff.coord as coord
 import time
 
-def set_colour(clr, chan, default, default_alpha=255):
+COLOURS={"red":(0,0,255),
+         "orange":(0,128,255),
+         "green":(0,255,0),
+         "cyan":(255,255,0),
+         "blue":(255,0,0),
+         "yellow":(0,255,255),
+         "white":(255,255,255),
+         "black":(0,0,0)}
+
+ALPHAS={"solid":255,
+        "half":128,
+        "flashing":128,
+        "transparent":64}
+
+FLASHING_HOLD=0.02          # seconds a flashing alpha is reused before it is worked out again
+
+_colour_cache={}            # (clr, chan, default, default_alpha) -> colour tuple, named colours only
+_flashing_colour_cache={}   # as _colour_cache for "flashing_" colours
+_flashing_alpha=None
+_flashing_time=None
+
+def update_flashing(t=None):
     """
-    Set a cv2 colour : check number of channels is consistent
-    change a text colour to numeric
-    """
-    colours={"red":[0,0,255],
-             "orange":[0,128,255],
-             "green":[0,255,0],
-             "cyan":[255,255,0],
-             "blue":[255,0,0],
-             "yellow":[0,255,255],
-             "white":[255,255,255],
-             "black":[0,0,0]}
-    
-    alphas={"solid":255,
-            "half":128,
-            "flashing":128,
-            "transparent":64}
+    Set the alpha used for "flashing_" colours, which cycles 0-255-0
+    every second, from time 't' (default now). Display.clear calls this
+    so a frame is drawn with one alpha; otherwise set_colour does when
+    the alpha is more than FLASHING_HOLD seconds old.
+    """
+    global _flashing_alpha, _flashing_time
+    if t is None:
+        t=time.time()
+    a=int(t*512) & 511
+    if a>255:
+        a=511-a
+    _flashing_alpha=a
+    _flashing_time=time.time()
+    _flashing_colour_cache.clear()
 
+def _resolve_colour(clr, chan, default, default_alpha):
     if clr is None:
         clr=default
+    flashing=False
     if isinstance(clr, str):
         alpha=None
         if "_" in clr:
             alpha,clr=clr.split("_")
-        assert clr in colours, f"unknown colour {clr}"
-        clr=colours[clr]
-        if alpha in alphas and chan==4:
-            clr=[alphas[alpha]]+clr
+        assert clr in COLOURS, f"unknown colour {clr}"
+        clr=COLOURS[clr]
+        if alpha in ALPHAS and chan==4:
             # special case "flashing" make alpha
             # change between 0-255 based on time
             if alpha=="flashing":
-                t=int(time.time()*512) & 511
-                if t>255:
-                    t=511-t
-                clr[0]=t
+                if _flashing_time is None or time.time()-_flashing_time>FLASHING_HOLD:
+                    update_flashing()
+                clr=(_flashing_alpha,)+clr
+                flashing=True
+            else:
+                clr=(ALPHAS[alpha],)+clr
+    clr=tuple(clr)
     if chan==4 and len(clr)==3:
-        clr=[default_alpha]+clr
+        clr=(default_alpha,)+clr
     assert chan==len(clr), "Bad colour size"
-    return clr
+    return clr, flashing
+
+def set_colour(clr, chan, default, default_alpha=255):
+    """
+    Set a cv2 colour : check number of channels is consistent
+    change a text colour to numeric. Returns a tuple; named colours are
+    cached per (clr, chan, default, default_alpha) if 'default' is a
+    name or None too
+    """
+    if not (clr is None or isinstance(clr, str)) or not (default is None or isinstance(default, str)):
+        # numeric colours can take any value (and may be lists), so aren't cached
+        return _resolve_colour(clr, chan, default, default_alpha)[0]
+    key=(clr, chan, default, default_alpha)
+    ret=_colour_cache.get(key)
+    if ret is None:
+        ret=_flashing_colour_cache.get(key)
+        if ret is not None and time.time()-_flashing_time>FLASHING_HOLD:
+            ret=None
+        if ret is None:
+            ret, flashing=_resolve_colour(clr, chan, default, default_alpha)
+            if flashing:
+                _flashing_colour_cache[key]=ret
+            else:
+                _colour_cache[key]=ret
+    return ret
+
+def line_rect(p0, p1, thickness):
+    """
+    Pixel rect [x0,y0,x1,y1) covering a line or box from p0 to p1
+    """
+    return [min(p0[0], p1[0])-thickness, min(p0[1], p1[1])-thickness,
+            max(p0[0], p1[0])+thickness+1, max(p0[1], p1[1])+thickness+1]
 
 def draw_line(img, start, stop, clr=None, thickness=1):
+    """
+    Draw a line; returns the pixel rect [x0,y0,x1,y1) it touched
+    """
     height, width, chan = img.shape
     p0=[int(coord.clip01(start[0])*width), int(coord.clip01(start[1])*height)]
     p1=[int(coord.clip01(stop[0])*width), int(coord.clip01(stop[1])*height)]
     clr=set_colour(clr, chan, "white")
     cv2.line(img, p0, p1, clr, thickness=thickness)
+    return line_rect(p0, p1, thickness)
 
 def draw_box(img, box, clr=None, thickness=1):
+    """
+    Draw a box outline; returns the pixel rect [x0,y0,x1,y1) it touched
+    """
     height, width, chan = img.shape
     p0=[int(coord.clip01(box[0])*width), int(coord.clip01(box[1])*height)]
     p1=[int(coord.clip01(box[2])*width), int(coord.clip01(box[3])*height)]
     clr=set_colour(clr, chan, "white")
     cv2.rectangle(img, p0, p1, clr, thickness)
+    return line_rect(p0, p1, thickness)
 
 def draw_circle(img, centre, radius, clr=None, thickness=1):
+    """
+    Draw a filled circle; returns the pixel rect [x0,y0,x1,y1) it touched
+    """
     height, width, chan= img.shape
     p=[int(coord.clip01(centre[0])*width), int(coord.clip01(centre[1])*height)]
     r=int(radius*width+0.5)
     clr=set_colour(clr, chan, "white")
     cv2.circle(img, p, r, clr, -1)
+    return [p[0]-r-1, p[1]-r-1, p[0]+r+2, p[1]+r+2]
+
+def style_groups(clr, thickness, n):
+    """
+    Group n primitives by colour and thickness. 'clr' is one colour spec
+    (anything set_colour takes) or a list of n specs, 'thickness' an int
+    or n ints. Returns a list of (clr, thickness, indices)
+    """
+    per_item_clr=isinstance(clr, (list, tuple)) and len(clr)==n and n>0 and not isinstance(clr[0], (int, float, np.integer))
+    if not per_item_clr and np.ndim(thickness)==0:
+        return [(clr, int(thickness), np.arange(n))]
+    clrs=clr if per_item_clr else [clr]*n
+    thicknesses=[int(thickness)]*n if np.ndim(thickness)==0 else [int(t) for t in thickness]
+    groups={}
+    for i, (c, t) in enumerate(zip(clrs, thicknesses)):
+        key=(tuple(c) if isinstance(c, (list, np.ndarray)) else c, t)
+        groups.setdefault(key, []).append(i)
+    return [(c, t, np.array(idx)) for (c, t), idx in groups.items()]
+
+def points_to_pixels(points, width, height):
+    """
+    Convert normalized [...,2] points to int32 pixel coordinates, clipping
+    to 0-1 like the single primitive functions
+    """
+    points=np.clip(np.asarray(points, dtype=np.float64), 0, 1)
+    points=points*np.array([width, height])
+    return points.astype(np.int32)
+
+def draw_polylines_batch(img, lines, clr=None, thickness=1, closed=False):
+    """
+    Draw N polylines of P normalized points each, given as an (N,P,2)
+    array, with one cv2.polylines call per colour and thickness (see
+    style_groups). Skeletons are (N,2,2) arrays of line segments. Returns
+    an (N,4) int array of the pixel rects [x0,y0,x1,y1) touched.
+    """
+    height, width, chan = img.shape
+    if len(lines)==0:
+        return np.zeros((0, 4), np.int32)
+    pts=points_to_pixels(lines, width, height).reshape(len(lines), -1, 2)
+    t=np.broadcast_to(np.asarray(thickness), (len(pts),))
+    rects=np.concatenate([pts.min(axis=1)-t[:,None], pts.max(axis=1)+t[:,None]+1], axis=1)
+    for c, th, idx in style_groups(clr, thickness, len(pts)):
+        c=set_colour(c, chan, "white")
+        cv2.polylines(img, pts[idx], closed, c, th)
+    return rects
+
+def draw_boxes_batch(img, boxes, clr=None, thickness=1):
+    """
+    Draw the outlines of an (N,4) array of normalized xyxy boxes, grouped
+    into cv2.polylines calls by colour and thickness (see style_groups).
+    Draws the same pixels as draw_box. Returns an (N,4) int array of the
+    pixel rects [x0,y0,x1,y1) touched.
+    """
+    boxes=np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    corners=boxes[:, [[0,1], [2,1], [2,3], [0,3]]]
+    return draw_polylines_batch(img, corners, clr=clr, thickness=thickness, closed=True)
+
+def draw_circles_batch(img, centres, radius, clr=None):
+    """
+    Draw filled circles at an (N,2) array of normalized centres, resolving
+    each colour once (see style_groups). Draws the same pixels as
+    draw_circle. Returns an (N,4) int array of the pixel rects touched.
+    """
+    height, width, chan = img.shape
+    if len(centres)==0:
+        return np.zeros((0, 4), np.int32)
+    pts=points_to_pixels(centres, width, height).reshape(-1, 2)
+    r=int(radius*width+0.5)
+    for c, _, idx in style_groups(clr, 0, len(pts)):
+        c=set_colour(c, chan, "white")
+        for x, y in pts[idx].tolist():
+            cv2.circle(img, (x, y), r, c, -1)
+    return np.concatenate([pts-r-1, pts+r+2], axis=1)
+
+def render_text(img, img_bg, text, x, y, font, fontScale, fontColor, bgColor, lineType, thickness):
+    """
+    Draw lines of text at pixel x,y with resolved colours, as draw_text;
+    returns the pixel rect [x0,y0,x1,y1) touched
+    """
+    rect=[x, y, x, y]
+    for t in text.split("\n"):
+        xp=x
+        yp=y
+        (text_width, text_height), baseline = cv2.getTextSize(t,
+                                                              font,
+                                                              fontScale=fontScale,
+                                                              thickness=thickness)
+        box_coords = ((xp, yp+2),
+                      (xp + text_width + 2, yp - text_height - 2))
+        y+=text_height+5
+        m=thickness+2+text_height//8    # glyphs can overhang their text size a little
+        rect=[min(rect[0], xp-m), min(rect[1], yp-text_height-2-m),
+              max(rect[2], xp+text_width+3+m), max(rect[3], yp+max(baseline, 2)+m+1)]
+
+        if img is not None:
+            cv2.rectangle(img_bg, box_coords[0], box_coords[1], bgColor, cv2.FILLED)
+            cv2.putText(img,
+                        t,
+                        (xp, yp),
+                        font,
+                        fontScale,
+                        fontColor,
+                        thickness,
+                        lineType)
+    return rect
+
+class TextSprite:
+    """
+    Rendered text relative to the text origin. The text is stored as the
+    colour drawn over black and the fraction (/255) of the underlying
+    pixel that shows through: 0 where drawn solid, 255 where not drawn,
+    in between on antialiased edges. If there are no antialiased pixels
+    a mask of the drawn pixels is kept instead. Background boxes drawn
+    to a separate image are kept as rectangles and redrawn
+    """
+    def __init__(self, text, chan, separate_bg, font, fontScale, fontColor, bgColor, lineType, thickness):
+        x0, y0, x1, y1=render_text(None, None, text, 0, 0, font, fontScale, fontColor, bgColor, lineType, thickness)
+        self.x0=x0
+        self.y0=y0
+        self.shape=(y1-y0, x1-x0)
+        self.bg_rects=None
+        self.bg_colour=bgColor
+        if separate_bg:
+            self.bg_rects=[]
+            for t, yp in zip(*self.line_positions(text, font, fontScale, thickness)):
+                (text_width, text_height)=cv2.getTextSize(t, font, fontScale=fontScale, thickness=thickness)[0]
+                self.bg_rects.append(((0, yp+2), (text_width+2, yp-text_height-2)))
+        layers=[]
+        for fill in [0, 255]:
+            fg=np.full(self.shape+(chan,), fill, np.uint8)
+            bg=np.full(self.shape+(chan,), fill, np.uint8) if separate_bg else fg
+            render_text(fg, bg, text, -x0, -y0, font, fontScale, fontColor, bgColor, lineType, thickness)
+            layers.append(fg)
+        fg0, fg255=layers
+        self.colour=fg0
+        self.keep=fg255-fg0
+        self.mask=None
+        if np.all((self.keep==0) | (self.keep==255)):
+            # no antialiasing: a plain masked copy will do
+            self.mask=np.all(self.keep==0, axis=2).astype(np.uint8)
+            self.keep=None
+        self.nbytes=sum(a.nbytes for a in [self.colour, self.keep, self.mask] if a is not None)
+
+    @staticmethod
+    def line_positions(text, font, fontScale, thickness):
+        lines=text.split("\n")
+        ys=[]
+        y=0
+        for t in lines:
+            ys.append(y)
+            y+=cv2.getTextSize(t, font, fontScale=fontScale, thickness=thickness)[0][1]+5
+        return lines, ys
+
+    def blit(self, img, img_bg, x, y):
+        """
+        Draw the sprite at pixel x,y (the text origin) of img (and img_bg);
+        returns the pixel rect touched
+        """
+        if self.bg_rects is not None:
+            for p0, p1 in self.bg_rects:
+                cv2.rectangle(img_bg, (x+p0[0], y+p0[1]), (x+p1[0], y+p1[1]), self.bg_colour, cv2.FILLED)
+        height, width=img.shape[:2]
+        h, w=self.shape
+        x0=x+self.x0
+        y0=y+self.y0
+        cx0=max(0, -x0)
+        cy0=max(0, -y0)
+        cx1=min(w, width-x0)
+        cy1=min(h, height-y0)
+        if cx1>cx0 and cy1>cy0:
+            s=(slice(cy0, cy1), slice(cx0, cx1))
+            roi=img[y0+cy0:y0+cy1, x0+cx0:x0+cx1]
+            if self.mask is not None:
+                cv2.copyTo(self.colour[s], self.mask[s], roi)
+            else:
+                cv2.multiply(roi, self.keep[s], dst=roi, scale=1/255)
+                cv2.add(roi, self.colour[s], dst=roi)
+        return [x0, y0, x0+w, y0+h]
+
+class TextSpriteCache:
+    """
+    LRU cache of TextSprites, keyed by text, font, colours etc, holding at
+    most 'max_bytes' of sprites
+    """
+    def __init__(self, max_bytes=16<<20):
+        self.max_bytes=max_bytes
+        self.entries=OrderedDict()
+        self.nbytes=0
+        self.hits=0
+        self.misses=0
+
+    def get(self, key, *args):
+        """
+        Return the sprite for 'key', making it with TextSprite(*args) if
+        it isn't cached
+        """
+        sprite=self.entries.get(key)
+        if sprite is not None:
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return sprite
+        self.misses+=1
+        sprite=TextSprite(*args)
+        if sprite.nbytes<=self.max_bytes:
+            self.entries[key]=sprite
+            self.nbytes+=sprite.nbytes
+            while self.nbytes>self.max_bytes:
+                _, old=self.entries.popitem(last=False)
+                self.nbytes-=old.nbytes
+        return sprite
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes=0
+
+text_sprite_cache=TextSpriteCache()
 
 def draw_text(img, text, xc, yc, img_bg=None,
               font=cv2.FONT_HERSHEY_SIMPLEX,
@@ -70,8 +353,15 @@ def draw_text(img, text, xc, yc, img_bg=None,
               fontColor=None,
               bgColor=None,
               lineType=2,
-              thickness=1
+              thickness=1,
+              sprite_cache=text_sprite_cache
               ):
+    """
+    Draw lines of text on 'img' with background boxes on 'img_bg'
+    (default 'img'); returns the pixel rect [x0,y0,x1,y1) touched on both.
+    Text is rendered once into a sprite kept in 'sprite_cache' and copied
+    from there afterwards; pass sprite_cache=None to draw directly
+    """
     height, width, chan = img.shape
 
     fontColor=set_colour(fontColor, chan, "white", default_alpha=128)
@@ -79,28 +369,13 @@ def draw_text(img, text, xc, yc, img_bg=None,
 
     x=(int)(xc*width)
     y=(int)(yc*height)
-    text_split=text.split("\n")
 
+    separate_bg=img_bg is not None and img_bg is not img
     if img_bg is None:
         img_bg=img
 
-    for t in text_split:
-        xp=x
-        yp=y
-        (text_width, text_height) = cv2.getTextSize(t,
-                                                    font,
-                                                    fontScale=fontScale,
-                                                    thickness=thickness)[0]
-        box_coords = ((xp, yp+2),
-                      (xp + text_width + 2, yp - text_height - 2))
-        y+=text_height+5
-        
-        cv2.rectangle(img_bg, box_coords[0], box_coords[1], bgColor, cv2.FILLED)
-        cv2.putText(img,
-                    t,
-                    (xp, yp),
-                    font,
-                    fontScale,
-                    fontColor,
-                    thickness,
-                    lineType)
+    if sprite_cache is None:
+        return render_text(img, img_bg, text, x, y, font, fontScale, fontColor, bgColor, lineType, thickness)
+    key=(text, chan, separate_bg, font, fontScale, fontColor, bgColor, lineType, thickness)
+    sprite=sprite_cache.get(key, text, chan, separate_bg, font, fontScale, fontColor, bgColor, lineType, thickness)
+    return sprite.blit(img, img_bg, x, y)
@@ -1,49 +1,240 @@
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+import stuff.coord as coord
 
 def default_match(det, gt, context):
     return det.match_score(gt, context)
 
-def match_greedy(dets, gts, mfn=default_match, mfn_context=None):
+def box_iou_match(dets, gts, context=None):
+    """
+    mfn_matrix for array-backed boxes: iou between (N,4) det boxes
+    and (M,4) gt boxes
+    """
+    return coord.box_iou_matrix(dets, gts)
+
+def match_score_matrix(dets, gts, mfn=default_match, mfn_context=None, mfn_matrix=None):
+    """
+    Return the (n_dets, n_gts) array of match scores.
+
+    Uses mfn_matrix(dets, gts, mfn_context) if given, which should compute
+    all scores in one call; otherwise calls mfn(det, gt, mfn_context)
+    per pair (pairs where either is None score 0). If both dets and gts
+    are arrays and no mfn was given they're taken to be (N,4) boxes
+    and scored with box iou.
+    """
+    if (mfn_matrix is None and mfn is default_match
+        and isinstance(dets, np.ndarray) and isinstance(gts, np.ndarray)):
+        mfn_matrix=box_iou_match
+    if mfn_matrix is not None:
+        return np.asarray(mfn_matrix(dets, gts, mfn_context), dtype=np.float64)
+
+    n_gts=len(gts)
+    n_dets=len(dets)
+    scores=np.zeros((n_dets, n_gts))
+    for jj in range(n_dets):
+        if dets[jj] is None:
+            continue
+        for ii in range(n_gts):
+            if gts[ii] is not None:
+                scores[jj, ii]=mfn(dets[jj], gts[ii], mfn_context)
+    return scores
+
+def match_greedy(dets, gts, mfn=default_match, mfn_context=None, mfn_matrix=None):
+    """
+    Greedy matching: take (det, gt) pairs in descending score order,
+    skipping pairs where the det or gt is already matched. Only pairs with
+    score>0 match. The result doesn't depend on the order of dets/gts
+    except to break ties (lower det index, then lower gt index, first).
+
+    Scores come from match_score_matrix; for (N,4)/(M,4) box arrays with
+    no mfn the iou is only computed for overlapping pairs
+    (overlapping_box_pairs) rather than the full matrix.
+
+    Returns:
+        lists det_ind, gt_ind, match_costs for the matched pairs, in det order
+    """
     n_gts=len(gts)
     n_dets=len(dets)
 
     if n_gts==0 or n_dets==0:
         return [], [], []
 
+    if (mfn_matrix is None and mfn is default_match
+        and isinstance(dets, np.ndarray) and isinstance(gts, np.ndarray)):
+        det_i, gt_i=overlapping_box_pairs(dets, gts)
+        v=coord.box_iou_pairs(dets[det_i], gts[gt_i])
+    else:
+        scores=match_score_matrix(dets, gts, mfn, mfn_context, mfn_matrix)
+        det_i, gt_i=np.nonzero(scores>0)
+        v=scores[det_i, gt_i]
+
+    order=np.lexsort((gt_i, det_i, -v))
+    det_matched=[False]*n_dets
     gt_matched=[False]*n_gts
-    out_det_index=[]
-    out_gt_index=[]
-    out_cost=[]
-    for i,det in enumerate(dets):
-        best_v=0
-        best_match=None
-        for j,gt in enumerate(gts):
-            v=mfn(det,gt,mfn_context)
-            if gt_matched[j] is False and v>best_v:
-                best_v=v
-                best_match=j
-        if best_match is not None:
-            gt_matched[best_match]=True
-            out_det_index.append(i)
-            out_gt_index.append(best_match)
-            out_cost.append(best_v)
+    out=[]
+    max_matches=min(n_dets, n_gts)
+    for i, j, c in zip(det_i[order].tolist(), gt_i[order].tolist(), v[order].tolist()):
+        if det_matched[i] or gt_matched[j]:
+            continue
+        det_matched[i]=True
+        gt_matched[j]=True
+        out.append((i, j, c))
+        if len(out)==max_matches:
+            break
+    out.sort()
+    out_det_index=[i for i, _, _ in out]
+    out_gt_index=[j for _, j, _ in out]
+    out_cost=[c for _, _, c in out]
     return out_det_index, out_gt_index, out_cost
 
-def match_lsa(dets, gts, mfn=default_match, mfn_context=None):
+def match_lsa(dets, gts, mfn=default_match, mfn_context=None, mfn_matrix=None):
+    """
+    Optimal (linear sum assignment) matching of dets to gts maximising
+    the total match score, see match_score_matrix for how scores are
+    computed. Pass mfn_matrix, or (N,4)/(M,4) box arrays, for the
+    vectorized path.
+
+    Returns:
+        det_ind, gt_ind, match_costs for the matched pairs, in gt order
+    """
     n_gts=len(gts)
     n_dets=len(dets)
 
     if n_gts==0 or n_dets==0:
         return [], [], []
-    
-    costs = [[0 for x in range(n_dets)] for y in range(n_gts)]
-    for ii in range(n_gts):
-        for jj in range(n_dets):
-            if dets[jj] is not None and gts[ii] is not None:
-                costs[ii][jj]=mfn(dets[jj], gts[ii], mfn_context)
-    costs = np.array(costs)
-    gt_ind, det_ind = linear_sum_assignment(np.array(costs), maximize=True)
+
+    costs = match_score_matrix(dets, gts, mfn, mfn_context, mfn_matrix).T
+    gt_ind, det_ind = linear_sum_assignment(costs, maximize=True)
     match_costs = costs[gt_ind, det_ind]
 
-    return det_ind, gt_ind, match_costs
\ No newline at end of file
+    return det_ind, gt_ind, match_costs
+
+
+def _grid_cells(boxes, cell_size, origin, span_y):
+    """
+    Return (box index, cell key) for every grid cell each box touches
+    """
+    c0=np.floor((boxes[:,0:2]-origin)/cell_size).astype(np.int64)
+    c1=np.floor((boxes[:,2:4]-origin)/cell_size).astype(np.int64)
+    nx=c1[:,0]-c0[:,0]+1
+    ny=c1[:,1]-c0[:,1]+1
+    counts=nx*ny
+    index=np.repeat(np.arange(len(boxes)), counts)
+    k=np.arange(len(index))-np.repeat(np.cumsum(counts)-counts, counts)
+    nx=np.repeat(nx, counts)
+    cx=np.repeat(c0[:,0], counts)+k%nx
+    cy=np.repeat(c0[:,1], counts)+k//nx
+    return index, cx*span_y+cy
+
+def overlapping_box_pairs(b1, b2, cell_size=None):
+    """
+    Find all pairs of boxes from b1 (N,4) and b2 (M,4) that overlap
+    without testing every pair: boxes are binned into a uniform grid
+    and only boxes sharing a cell are tested, so the cost grows with the
+    number of boxes and how crowded they are rather than N*M.
+
+    cell_size defaults to twice the median box width/height.
+
+    Returns:
+        i1, i2 index arrays of the pairs with a non-zero intersection
+    """
+    b1=coord.boxes_array(b1)
+    b2=coord.boxes_array(b2)
+    if len(b1)==0 or len(b2)==0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    both=np.concatenate([b1, b2])
+    if cell_size is None:
+        cell_size=2*max(np.median(both[:,2]-both[:,0]), np.median(both[:,3]-both[:,1]), 1e-6)
+    origin=both[:,0:2].min(axis=0)
+    span_y=int((both[:,3].max()-origin[1])/cell_size)+2
+
+    i1, k1=_grid_cells(b1, cell_size, origin, span_y)
+    i2, k2=_grid_cells(b2, cell_size, origin, span_y)
+    order=np.argsort(k2, kind="stable")
+    i2=i2[order]
+    k2=k2[order]
+    lo=np.searchsorted(k2, k1, side="left")
+    hi=np.searchsorted(k2, k1, side="right")
+    counts=hi-lo
+    p1=np.repeat(i1, counts)
+    offset=np.arange(len(p1))-np.repeat(np.cumsum(counts)-counts, counts)
+    p2=i2[np.repeat(lo, counts)+offset]
+
+    # boxes sharing more than one cell give repeated pairs
+    pair=np.unique(p1*len(b2)+p2)
+    p1=pair//len(b2)
+    p2=pair%len(b2)
+    keep=((np.minimum(b1[p1,2], b2[p2,2])>np.maximum(b1[p1,0], b2[p2,0]))
+          & (np.minimum(b1[p1,3], b2[p2,3])>np.maximum(b1[p1,1], b2[p2,1])))
+    return p1[keep], p2[keep]
+
+def match_lsa_gated(dets, gts, min_iou=0.01):
+    """
+    Box iou matching for large scenes: equivalent to match_lsa on box
+    arrays with scores below 'min_iou' treated as no match, but without
+    building or solving the dense n_dets x n_gts problem.
+
+    Candidate pairs are found with a grid (overlapping_box_pairs) and gated on
+    iou>=min_iou, the resulting det/gt graph is split into connected
+    components and each component is solved on its own (single pairs
+    directly, the rest with linear_sum_assignment).
+
+    Unlike match_lsa, pairs that don't pass the gate are never returned.
+
+    Args:
+        dets, gts: (N,4) and (M,4) xyxy boxes
+    Returns:
+        det_ind, gt_ind, match_costs for the matched pairs, in gt order
+    """
+    dets=coord.boxes_array(dets)
+    gts=coord.boxes_array(gts)
+    n_dets=len(dets)
+    if n_dets==0 or len(gts)==0:
+        return [], [], []
+
+    det_i, gt_i=overlapping_box_pairs(dets, gts)
+    iou=coord.box_iou_pairs(dets[det_i], gts[gt_i])
+    keep=iou>=min_iou
+    det_i=det_i[keep]
+    gt_i=gt_i[keep]
+    iou=iou[keep]
+    if len(iou)==0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+
+    # nodes 0..n_dets-1 are dets, then gts
+    n=n_dets+len(gts)
+    graph=coo_matrix((np.ones(len(iou)), (det_i, gt_i+n_dets)), shape=(n, n))
+    _, labels=connected_components(graph, directed=False)
+    pair_label=labels[det_i]
+    order=np.argsort(pair_label, kind="stable")
+    det_i=det_i[order]
+    gt_i=gt_i[order]
+    iou=iou[order]
+    pair_label=pair_label[order]
+    starts=np.flatnonzero(np.r_[True, pair_label[1:]!=pair_label[:-1]])
+    ends=np.r_[starts[1:], len(pair_label)]
+
+    # components with a single pair match directly
+    single=ends-starts==1
+    out_det=[det_i[starts[single]]]
+    out_gt=[gt_i[starts[single]]]
+    out_cost=[iou[starts[single]]]
+
+    for s, e in zip(starts[~single], ends[~single]):
+        cd, rd=np.unique(det_i[s:e], return_inverse=True)
+        cg, rg=np.unique(gt_i[s:e], return_inverse=True)
+        costs=np.zeros((len(cg), len(cd)))
+        costs[rg, rd]=iou[s:e]
+        g, d=linear_sum_assignment(costs, maximize=True)
+        matched=costs[g, d]>0
+        out_det.append(cd[d[matched]])
+        out_gt.append(cg[g[matched]])
+        out_cost.append(costs[g, d][matched])
+
+    det_ind=np.concatenate(out_det)
+    gt_ind=np.concatenate(out_gt)
+    match_costs=np.concatenate(out_cost)
+    order=np.argsort(gt_ind, kind="stable")
+    return det_ind[order], gt_ind[order], match_costs[order]
@@ -0,0 +1,337 @@
+import queue
+import threading
+import time
+from stuff.ultralytics import draw_boxes
+
+_END=object()   # end of stream marker passed down the queues
+
+class Stage:
+    """
+    One step of a Pipeline: 'fn' is called on each item from the previous
+    stage and its return value is passed on. With workers>1 several
+    threads call 'fn' at once; results are still passed on in order.
+    """
+    def __init__(self, fn, name=None, workers=1):
+        self.fn=fn
+        self.name=name if name is not None else getattr(fn, "__name__", "stage")
+        self.workers=workers
+
+class StageStats:
+    """
+    Counters for one pipeline stage; times in seconds
+    """
+    def __init__(self, name):
+        self.name=name
+        self.lock=threading.Lock()
+        self.count=0
+        self.busy=0.0
+        self.max_time=0.0
+        self.depth_sum=0
+        self.depth_max=0
+
+    def add(self, dt, depth):
+        with self.lock:
+            self.count+=1
+            self.busy+=dt
+            self.max_time=max(self.max_time, dt)
+            self.depth_sum+=depth
+            self.depth_max=max(self.depth_max, depth)
+
+    def as_dict(self, wall_time, workers=1):
+        n=max(self.count, 1)
+        return {"name":self.name,
+                "count":self.count,
+                "mean_ms":1000*self.busy/n,
+                "max_ms":1000*self.max_time,
+                "utilization":self.busy/(workers*wall_time) if wall_time>0 else 0.0,
+                "queue_mean":self.depth_sum/n,
+                "queue_max":self.depth_max}
+
+def _put(q, item, stop):
+    """
+    Put 'item' on bounded queue 'q', blocking while it is full. Returns
+    False if 'stop' was set first
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.05)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q, stop):
+    """
+    Get the next item from 'q', or _END if 'stop' is set first
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.05)
+        except queue.Empty:
+            pass
+    return _END
+
+class Pipeline:
+    """
+    Runs 'source' (an iterable) and a list of stages (Stage objects or
+    plain functions) concurrently, each in its own thread(s), connected
+    by queues of at most 'queue_size' items. A stage that gets ahead
+    blocks on the full queue after it, so throughput is that of the
+    slowest stage rather than the sum of all of them, and memory use is
+    bounded. A stage with several workers holds at most
+    queue_size+workers items waiting to be passed on in order.
+
+    Iterate over the pipeline to get the outputs of the last stage in
+    source order. An exception in any stage stops the pipeline and is
+    re-raised in the iterating thread. stats() gives per-stage timing
+    and queue depths.
+
+    Stages run on threads, so the speed up comes from work that releases
+    the GIL (decoding, cv2, numpy, torch). Anything that must stay on the
+    calling thread (e.g. HighGUI) belongs in the loop over the outputs.
+    """
+    def __init__(self, source, stages, queue_size=4):
+        self.source=source
+        self.stages=[s if isinstance(s, Stage) else Stage(s) for s in stages]
+        self.queue_size=queue_size
+        self.stop=threading.Event()
+        self.error=None
+        self.threads=[]
+        self.queues=[]
+        self.source_stats=StageStats("source")
+        self.stage_stats=[StageStats(s.name) for s in self.stages]
+        self.output_stats=StageStats("output")
+        self.latency_sum=0.0
+        self.latency_max=0.0
+        self.start_time=None
+        self.end_time=None
+
+    def _fail(self, e):
+        if self.error is None:
+            self.error=e
+        self.stop.set()
+
+    def _source_worker(self, out_q):
+        try:
+            it=iter(self.source)
+            seq=0
+            while not self.stop.is_set():
+                t=time.perf_counter()
+                try:
+                    item=next(it)
+                except StopIteration:
+                    break
+                now=time.perf_counter()
+                self.source_stats.add(now-t, out_q.qsize())
+                if not _put(out_q, (seq, now, item), self.stop):
+                    return
+                seq+=1
+            _put(out_q, _END, self.stop)
+        except Exception as e:
+            self._fail(e)
+
+    def _stage_worker(self, stage, stats, in_q, out_q, state):
+        """
+        Take items from 'in_q', run the stage and pass results on in
+        sequence order. 'state' is shared by the stage's workers: the
+        reorder buffer, the next sequence number due, the number of
+        workers still running and 'window', a semaphore with a permit per
+        item taken but not yet passed on. Items arrive in sequence order,
+        so this keeps workers from getting more than the window ahead of
+        a slow item and bounds the reorder buffer.
+        """
+        try:
+            while True:
+                while not state["window"].acquire(timeout=0.05):
+                    if self.stop.is_set():
+                        return
+                depth=in_q.qsize()
+                item=_get(in_q, self.stop)
+                if item is _END:
+                    state["window"].release()
+                    break
+                seq, t0, value=item
+                t=time.perf_counter()
+                value=stage.fn(value)
+                stats.add(time.perf_counter()-t, depth)
+                with state["lock"]:
+                    state["pending"][seq]=(seq, t0, value)
+                    while state["next"] in state["pending"]:
+                        if not _put(out_q, state["pending"].pop(state["next"]), self.stop):
+                            return
+                        state["next"]+=1
+                        state["window"].release()
+            # let the other workers of this stage see the end too
+            _put(in_q, _END, self.stop)
+            with state["lock"]:
+                state["running"]-=1
+                if state["running"]==0:
+                    _put(out_q, _END, self.stop)
+        except Exception as e:
+            self._fail(e)
+
+    def start(self):
+        """
+        Start the threads; called by iterating if not done already
+        """
+        if self.start_time is not None:
+            return
+        self.start_time=time.perf_counter()
+        self.queues=[queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages)+1)]
+        t=threading.Thread(target=self._source_worker, args=(self.queues[0],), daemon=True)
+        self.threads.append(t)
+        for i, stage in enumerate(self.stages):
+            state={"lock":threading.Lock(), "pending":{}, "next":0, "running":stage.workers,
+                   "window":threading.Semaphore(self.queue_size+stage.workers)}
+            for _ in range(stage.workers):
+                t=threading.Thread(target=self._stage_worker,
+                                   args=(stage, self.stage_stats[i], self.queues[i], self.queues[i+1], state),
+                                   daemon=True)
+                self.threads.append(t)
+        for t in self.threads:
+            t.start()
+
+    def __iter__(self):
+        self.start()
+        out_q=self.queues[-1]
+        try:
+            while True:
+                depth=out_q.qsize()
+                item=_get(out_q, self.stop)
+                if item is _END:
+                    break
+                _, t0, value=item
+                latency=time.perf_counter()-t0
+                self.latency_sum+=latency
+                self.latency_max=max(self.latency_max, latency)
+                self.output_stats.add(0.0, depth)
+                yield value
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Stop all stages and wait for their threads to finish
+        """
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+        if self.end_time is None and self.start_time is not None:
+            self.end_time=time.perf_counter()
+
+    def stats(self):
+        """
+        Return a dict with the number of outputs, wall time, fps, mean and
+        max source to output latency (ms) and 'stages': a list of per-stage
+        dicts (source first) with count, mean_ms and max_ms per item,
+        utilization (fraction of the wall time the stage's workers were
+        busy) and the mean and max depth of the queue into the stage
+        """
+        if self.start_time is None:
+            wall_time=0.0
+        elif self.end_time is None:
+            wall_time=time.perf_counter()-self.start_time
+        else:
+            wall_time=self.end_time-self.start_time
+        n=self.output_stats.count
+        stages=[self.source_stats.as_dict(wall_time)]
+        stages+=[s.as_dict(wall_time, stage.workers) for s, stage in zip(self.stage_stats, self.stages)]
+        out=self.output_stats.as_dict(wall_time)
+        return {"frames":n,
+                "time":wall_time,
+                "fps":n/wall_time if wall_time>0 else 0.0,
+                "latency_mean_ms":1000*self.latency_sum/max(n, 1),
+                "latency_max_ms":1000*self.latency_max,
+                "output_queue_mean":out["queue_mean"],
+                "output_queue_max":out["queue_max"],
+                "stages":stages}
+
+def format_pipeline_stats(stats):
+    """
+    Return Pipeline.stats() as a printable table
+    """
+    lines=[f"{stats['frames']} frames in {stats['time']:.2f}s ({stats['fps']:.1f} fps), "
+           f"latency mean {stats['latency_mean_ms']:.1f} ms max {stats['latency_max_ms']:.1f} ms"]
+    for s in stats["stages"]:
+        lines.append(f"  {s['name']:12s} {s['count']:6d} items {s['mean_ms']:8.2f} ms/item "
+                     f"(max {s['max_ms']:8.2f}) util {100*s['utilization']:5.1f}% "
+                     f"queue in {s['queue_mean']:4.1f} (max {s['queue_max']})")
+    lines.append(f"  {'output':12s} queue in {stats['output_queue_mean']:4.1f} (max {stats['output_queue_max']})")
+    return "\n".join(lines)
+
+def video_detection_pipeline(reader,
+                             model,
+                             converter,
+                             start=0,
+                             stop=None,
+                             step=1,
+                             queue_size=4,
+                             infer_workers=1,
+                             display=None,
+                             class_names=None):
+    """
+    Return a Pipeline decode -> model -> YoloConverter over frames
+    start:stop:step of RandomAccessVideoReader 'reader', yielding
+    (frame, dets) in frame order.
+
+    'model' is called with one frame and returns an ultralytics Results
+    (or a list of one, as YOLO.__call__ does). Render in the loop over
+    the pipeline (see render_dets) so HighGUI stays on the calling
+    thread while the following frames are decoded and run through the
+    model:
+
+        pipeline=video_detection_pipeline(reader, model, converter)
+        for frame, dets in pipeline:
+            render_dets(display, frame, dets, class_names)
+            display.get_events(1)
+        print(format_pipeline_stats(pipeline.stats()))
+
+    An offscreen Display (which needs no HighGUI thread) can be given as
+    'display' to render in a pipeline stage instead, e.g. to write
+    annotated video on a machine without a screen:
+
+        display=Display(offscreen=True, sink=VideoSink("out.mp4"))
+        for frame, dets in video_detection_pipeline(reader, model, converter, display=display):
+            pass
+        display.close()
+    """
+    if display is not None and not display.offscreen:
+        raise ValueError("Only an offscreen Display can render in a pipeline stage")
+
+    def frames():
+        # batch_size=1 gives frames we own, so this is safe even if the
+        # reader's cache recycles buffers (FrameCache(recycle=True))
+        for batch in reader.iter_frames(start=start, stop=stop, step=step, batch_size=1):
+            yield batch[0]
+
+    def infer(frame):
+        results=model(frame)
+        if isinstance(results, (list, tuple)):
+            results=results[0]
+        return frame, results
+
+    def convert(item):
+        frame, results=item
+        return frame, converter.convert(results)
+
+    def render(item):
+        frame, dets=item
+        render_dets(display, frame, dets, class_names=class_names)
+        return item
+
+    stages=[Stage(infer, name="infer", workers=infer_workers),
+            Stage(convert, name="convert")]
+    if display is not None:
+        stages.append(Stage(render, name="render"))
+    return Pipeline(frames(), stages, queue_size=queue_size)
+
+def render_dets(display, frame, dets, class_names=None, title=None):
+    """
+    Clear 'display', draw 'dets' with draw_boxes and show 'frame'. Returns
+    the composited frame, a buffer the display reuses
+    """
+    display.clear()
+    draw_boxes(display, dets, class_names=class_names)
+    return display.show(frame, title=title)
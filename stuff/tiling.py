@@ -0,0 +1,171 @@
+import numpy as np
+import stuff.coord as coord
+from stuff.detections import Detections
+from stuff.ultralytics import yolo_results_to_detections_batch
+
+def tile_starts(length, tile, overlap):
+    """
+    Start offsets of tiles of size 'tile' covering 0..length, evenly
+    spread with at least 'overlap' pixels between neighbours
+    """
+    if length<=tile:
+        return np.zeros(1, np.int64)
+    n=int(np.ceil((length-overlap)/(tile-overlap)))
+    return np.round(np.linspace(0, length-tile, n)).astype(np.int64)
+
+def make_tiles(width, height, tile_size=640, overlap=0.2):
+    """
+    Return an (N,4) int array of pixel rects [x0,y0,x1,y1) of tiles of
+    'tile_size' (an int or (w,h)) covering a width x height image, with
+    neighbours overlapping by at least the fraction 'overlap' of a tile.
+    Tiles are clipped to the image if it is smaller than a tile
+    """
+    if not 0<=overlap<1:
+        raise ValueError(f"make_tiles: overlap must be in [0,1), got {overlap}")
+    tw, th=(tile_size, tile_size) if np.isscalar(tile_size) else tile_size
+    tw=min(tw, width)
+    th=min(th, height)
+    xs=tile_starts(width, tw, int(overlap*tw))
+    ys=tile_starts(height, th, int(overlap*th))
+    x0, y0=np.meshgrid(xs, ys)
+    x0=x0.reshape(-1)
+    y0=y0.reshape(-1)
+    return np.stack([x0, y0, x0+tw, y0+th], axis=1)
+
+def tile_rois(rects, width, height):
+    """
+    Pixel rects as normalized rois of the width x height image
+    """
+    return np.asarray(rects, dtype=np.float64)/np.array([width, height, width, height])
+
+def unmap_tile_detections(dets, roi):
+    """
+    Map Detections normalized to the tile 'roi' to the full image, in
+    place. Missing keypoints (at 0,0) stay at 0,0
+    """
+    coord.unmap_roi_boxes(roi, dets.boxes, out=dets.boxes)
+    if dets.keypoints is not None:
+        kp=dets.keypoints
+        missing=(kp[...,0]==0) & (kp[...,1]==0)
+        coord.unmap_roi_points(roi, kp, out=kp)
+        kp[missing, 0:2]=0
+    return dets
+
+def merge_tile_detections(dets_list, rois, merge_ioma=0.5):
+    """
+    Unmap per tile Detections through their tile 'rois' and merge the
+    duplicates where tiles overlap.
+
+    An object crossing a tile edge comes back cut off by each tile, so
+    duplicates are matched on intersection over the smaller box rather
+    than IoU. Going through detections by descending confidence, each
+    starts a group and takes in unused detections of the same class with
+    intersection/smaller area>'merge_ioma' to a group member, at most
+    one per tile (the best IoU), until no more match. The group becomes
+    one detection with the union of the boxes and each keypoint from the
+    member most confident of it. Detections from the same tile are never
+    merged, the model has already done NMS on those.
+    """
+    unmapped=[unmap_tile_detections(d, roi) for d, roi in zip(dets_list, rois)]
+    merged=Detections.concatenate(unmapped)
+    if len(dets_list)<2 or len(merged)<2 or merge_ioma is None:
+        return merged
+    tiles=np.repeat(np.arange(len(unmapped)), [len(d) for d in unmapped])
+    boxes=merged.boxes
+    ioma=coord.box_ioma_matrix(boxes, boxes)
+    match=((ioma>merge_ioma) & (merged.classes[:,None]==merged.classes[None,:])
+           & (tiles[:,None]!=tiles[None,:]))
+    if not match.any():
+        return merged
+
+    order=np.argsort(-merged.confidences, kind="stable")
+    used=np.zeros(len(merged), bool)
+    keep=[]
+    for i in order.tolist():
+        if used[i]:
+            continue
+        used[i]=True
+        keep.append(i)
+        members=[i]
+        grow=[i]
+        while grow:
+            j=grow.pop()
+            cand=np.flatnonzero(match[j] & ~used)
+            cand=cand[~np.isin(tiles[cand], tiles[members])]
+            if len(cand)==0:
+                continue
+            # best IoU first, then the first of those from each tile
+            cand=cand[np.argsort(-coord.box_iou_matrix(boxes[j], boxes[cand])[0], kind="stable")]
+            _, first=np.unique(tiles[cand], return_index=True)
+            cand=cand[first].tolist()
+            used[cand]=True
+            members+=cand
+            grow+=cand
+        if len(members)==1:
+            continue
+        members=np.array(members)
+        boxes[i, 0:2]=boxes[members, 0:2].min(axis=0)
+        boxes[i, 2:4]=boxes[members, 2:4].max(axis=0)
+        if merged.keypoints is not None:
+            kp=merged.keypoints[members]
+            best=np.argmax(kp[:,:,2], axis=0)
+            merged.keypoints[i]=kp[best, np.arange(kp.shape[1])]
+    return merged[np.sort(np.array(keep, np.int64))]
+
+def tiled_detections(image,
+                     model,
+                     tile_size=640,
+                     overlap=0.2,
+                     merge_ioma=0.5,
+                     full_frame=False,
+                     batch_size=None,
+                     det_thr=0.01,
+                     det_class_remap=None):
+    """
+    Run 'model' on overlapping tiles of 'image' and return the merged
+    Detections, normalized to the whole image.
+
+    'model' is called with a list of image crops (at most 'batch_size'
+    at a time, default all of them) and returns a list of ultralytics
+    Results, one per crop, as YOLO.__call__ does. With full_frame=True
+    the whole image is run too, so objects bigger than a tile are found
+    in one piece. Duplicates where tiles overlap are merged, see
+    merge_tile_detections; det_thr and det_class_remap are as for
+    yolo_results_to_detections.
+    """
+    height, width=image.shape[:2]
+    rects=make_tiles(width, height, tile_size, overlap)
+    if full_frame and len(rects)>1:
+        rects=np.concatenate([rects, [[0, 0, width, height]]])
+    crops=[image[y0:y1, x0:x1] for x0, y0, x1, y1 in rects.tolist()]
+    if batch_size is None:
+        batch_size=len(crops)
+    results=[]
+    for i in range(0, len(crops), batch_size):
+        results+=list(model(crops[i:i+batch_size]))
+    dets_list=yolo_results_to_detections_batch(results, det_thr=det_thr, det_class_remap=det_class_remap)
+    return merge_tile_detections(dets_list, tile_rois(rects, width, height), merge_ioma)
+
+def tiled_inference(image,
+                    model,
+                    converter,
+                    tile_size=640,
+                    overlap=0.2,
+                    merge_ioma=0.5,
+                    full_frame=False,
+                    batch_size=None):
+    """
+    tiled_detections followed by the rest of YoloConverter 'converter'
+    (attributes, keypoint mapping, pose NMS) on the merged
+    detections; returns det dicts like converter.convert does for a
+    whole frame
+    """
+    dets=tiled_detections(image, model,
+                          tile_size=tile_size,
+                          overlap=overlap,
+                          merge_ioma=merge_ioma,
+                          full_frame=full_frame,
+                          batch_size=batch_size,
+                          det_thr=converter.det_thr,
+                          det_class_remap=converter.det_class_remap)
+    return converter.detections_to_dets(dets)
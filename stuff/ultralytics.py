@@ -1,5 +1,15 @@
-
+import copy
+import numpy as np
 import stuff.coord as coord
+from stuff.detections import Detections, facepose_face_boxes, yolo_keypoints, split_keypoints
+
+def has_face_points(gt):
+    """
+    True if gt has face points with at least one visible point
+    """
+    if not "face_points" in gt:
+        return False
+    return any(c>0 for c in gt["face_points"][2::3])
 
 def map_one_gt_keypoints(gt, face_points, pose_points, facepose_points):
     # Coco/Facepose order          Facepoint order
@@ -69,88 +79,454 @@ def map_keypoints(gts, face_points, pose_points, facepose_points):
         map_one_gt_keypoints(gt, face_points, pose_points, facepose_points)
 
 def unpack_yolo_keypoints(det_kp_list, det_kp_conf_list, index):
-    if det_kp_list==None:
+    """
+    Return the face, pose, facepose and attribute points (flat
+    [x,y,conf,...] lists or None) of detection 'index' in yolo (N,K,2)
+    keypoints and (N,K) confidences. For all detections at once use
+    yolo_keypoints and split_keypoints
+    """
+    if det_kp_list is None:
         return None, None, None, None
+    det_kp_conf=None
+    if det_kp_conf_list is not None:
+        det_kp_conf=to_numpy(det_kp_conf_list[index])[None]
+    kp=yolo_keypoints(to_numpy(det_kp_list[index])[None], det_kp_conf)
+    return tuple(None if x is None else x.reshape(-1).tolist() for x in split_keypoints(kp))
 
-    if det_kp_conf_list!=None:
-        det_kp_conf=det_kp_conf_list[index]
-    else:
-        det_kp_conf=[1.0]*len(det_kp)
-    det_kp=det_kp_list[index]
-    flat_kp=[0]*3*len(det_kp)
-    for j,_ in enumerate(det_kp):
-        flat_kp[3*j+0]=det_kp[j][0]
-        flat_kp[3*j+1]=det_kp[j][1]
-        flat_kp[3*j+2]=det_kp_conf[j]
-        if det_kp[j][0]<=0 and det_kp[j][1]<=0:
-            flat_kp[3*j+2]=0
-
-    if len(flat_kp)==51:
-        return None, flat_kp, None, None # pose points only
-    elif len(flat_kp)==66:
-        return flat_kp[0:15], flat_kp[15:66], None, None # face points, pose points
-    elif len(flat_kp)==15:
-        return flat_kp[0:15], None, None, None # face points only
-    elif len(flat_kp)==57:
-        return None, None, flat_kp[0:57], None # facepose points
-    elif len(flat_kp)>66:
-        return flat_kp[0:15], flat_kp[15:66], None, flat_kp[66:] # face, pose, attr
-    else:
-        print("Bad number of yolo keypoints "+str(len(flat_kp)))
-    return None, None, None, None
+class AttributeFoldPlan:
+    """
+    The class_to_attribute_map for fold_detections_to_attributes worked
+    out once for a given class_names and attributes: for each class the
+    base class index and attribute index, -1 if it is not an attribute
+    class
+    """
+    def __init__(self, class_names, attributes):
+        self.num_attributes=len(attributes)
+        self.base_class_index=np.full(len(class_names), -1, dtype=np.int64)
+        self.attr_index=np.full(len(class_names), -1, dtype=np.int64)
+        class_index={}
+        for i,cn in enumerate(class_names):
+            class_index.setdefault(cn, i)
+        for i,a in enumerate(attributes):
+            base_class=a.split(":")[0]
+            if base_class in class_index:
+                an=a.replace(":","_")
+                if an in class_index:
+                    j=class_index[an]
+                    self.base_class_index[j]=class_index[base_class]
+                    self.attr_index[j]=i
+
+    def fold(self, gts):
+        """
+        Fold attribute detections in gts into the "attrs" of the best
+        iou (>0.3) detection of their base class and remove them
+        """
+        if len(gts)==0:
+            return gts
+        classes=np.array([d["class"] for d in gts], dtype=np.int64)
+        attr_index=self.attr_index[classes]
+        attr_dets=np.flatnonzero(attr_index!=-1)
+        if len(attr_dets)==0:
+            return [x for x in gts if x["confidence"]!=0]
+        base_class_index=self.base_class_index[classes[attr_dets]]
+        boxes=coord.boxes_array([d["box"][0:4] for d in gts])
+        for base_class in np.unique(base_class_index):
+            attr=attr_dets[base_class_index==base_class]
+            base=np.flatnonzero(classes==base_class)
+            if len(base)==0:
+                continue
+            iou=coord.box_iou_matrix(boxes[base], boxes[attr])
+            best=np.argmax(iou, axis=0)
+            best_iou=iou[best, np.arange(len(attr))]
+            for k in np.flatnonzero(best_iou>0.3):
+                d=gts[attr[k]]
+                d2=gts[base[best[k]]]
+                if not "attrs" in d2:
+                    d2["attrs"]=[0]*self.num_attributes
+                ai=self.attr_index[d["class"]]
+                d2["attrs"][ai]=max(d2["attrs"][ai], d["confidence"])
+                d["confidence"]=0
+        # delete attribute detections
+        return [x for x in gts if x["confidence"]!=0]
+
+_attribute_fold_plans={}
 
-def fold_detections_to_attributes(gts, class_names, attributes):
+def attribute_fold_plan(class_names, attributes):
+    """
+    Return the (cached) AttributeFoldPlan for class_names and attributes
+    """
+    key=(tuple(class_names), tuple(attributes))
+    plan=_attribute_fold_plans.get(key)
+    if plan is None:
+        plan=AttributeFoldPlan(class_names, attributes)
+        _attribute_fold_plans[key]=plan
+    return plan
+
+def fold_detections_to_attributes(gts, class_names, attributes, plan=None):
     """
     Remove GT boxes that correspond to class attributes and build
     and 'attr' vector attched to the primary GT instead
     e.g. separate person_male GT will become the person:male 
     attribute of the person GT with the same box as the original
     person_make
+
+    The class to attribute mapping is worked out once per class_names
+    and attributes (see AttributeFoldPlan); pass 'plan' to skip the
+    lookup.
     """
 
-    # set up class_to_attribute_map
-    # this finds object detector classes that are really detecting
-    # attributes for objects, e.g. the attribute person:is_female is
-    # detected with a class person_is_female
+    # class_to_attribute_map finds object detector classes that are
+    # really detecting attributes for objects, e.g. the attribute
+    # person:is_female is detected with a class person_is_female
     # this is going to let us remove those detections and map them
     # back to a vector of attributes in the base object
 
-    class_to_attribute_map=None
-    if attributes is not None:
-        class_to_attribute_map=[{"base_class_index":None, "attr_index":None}]*len(class_names)
-        for i,a in enumerate(attributes):
-            base_class=a.split(":")[0]
-            if base_class in class_names:
-                base_class_index=class_names.index(base_class)
-                an=a.replace(":","_")
-                if an in class_names:
-                    j=class_names.index(an)
-                    class_to_attribute_map[j]={"base_class_index":base_class_index,
-                                                    "attr_index":i}
-    if class_to_attribute_map is not None:
-        # replace attribute detections with attribute properties in the
-        # underlying object
-        for d in gts:
-            m=class_to_attribute_map[d["class"]]
-            base_class_index=m["base_class_index"]
-            attr_index=m["attr_index"]
-            if attr_index is not None:
-                best_iou=0
-                for i,d2 in enumerate(gts):
-                    if d2["class"]==base_class_index:
-                        iou=coord.box_iou(d2["box"], d["box"])
-                        if iou>best_iou:
-                            best_iou=iou
-                            best_match=i
-                if best_iou>0.3:
-                    d2=gts[best_match]
-                    if not "attrs" in d2:
-                        d2["attrs"]=[0]*len(attributes)
-                    d2["attrs"][attr_index]=max(d2["attrs"][attr_index], d["confidence"])
-                    d["confidence"]=0
-        # delete attribute detections
-        gts=[x for x in gts if x["confidence"]!=0]
-    return gts
+    if plan is None:
+        if attributes is None:
+            return gts
+        plan=attribute_fold_plan(class_names, attributes)
+    return plan.fold(gts)
+
+def to_numpy(x):
+    """
+    Return a tensor (on any device) or array-like as a numpy array
+    """
+    if hasattr(x, "cpu"):
+        x=x.cpu()
+    if hasattr(x, "numpy"):
+        x=x.numpy()
+    return np.asarray(x)
+
+def batch_to_numpy(tensors):
+    """
+    Convert a list of tensors/arrays with the same trailing shape to numpy
+    with a single device transfer: torch tensors are concatenated on their
+    device first, then split again on the host
+    """
+    if len(tensors)==0:
+        return []
+    counts=[len(t) for t in tensors]
+    if type(tensors[0]).__module__.startswith("torch"):
+        import torch
+        joined=to_numpy(torch.cat(list(tensors)))
+    else:
+        joined=np.concatenate([to_numpy(t) for t in tensors])
+    return np.split(joined, np.cumsum(counts)[:-1])
+
+def _yolo_tensors(results):
+    """
+    The tensors we use from a Results: xyxyn, cls, conf, id (or None),
+    keypoint xyn and conf (or None)
+    """
+    boxes=results.boxes
+    ids=None
+    if hasattr(boxes, "id") and boxes.id is not None:
+        ids=boxes.id
+    kp_xy=None
+    kp_conf=None
+    if hasattr(results, "keypoints") and results.keypoints is not None:
+        kp_xy=results.keypoints.xyn
+        if results.keypoints.has_visible:
+            kp_conf=results.keypoints.conf
+    return [boxes.xyxyn, boxes.cls, boxes.conf, ids, kp_xy, kp_conf]
+
+def _arrays_to_detections(boxes, classes, confidences, ids, kp_xy, kp_conf, det_thr, det_class_remap):
+    boxes=boxes.reshape(-1, 4)
+    classes=classes.astype(np.int64)
+    if det_class_remap is not None:
+        classes=np.asarray(det_class_remap, dtype=np.int64)[classes]
+    keep=(classes!=-1) & (confidences>det_thr)
+
+    keypoints=None
+    if kp_xy is not None:
+        keypoints=yolo_keypoints(kp_xy, kp_conf)
+
+    dets=Detections(boxes, classes, confidences, ids, keypoints)
+    return dets[keep]
+
+def yolo_results_to_detections(results, det_thr=0.01, det_class_remap=None):
+    """
+    Convert an ultralytics Results to Detections in one transfer per
+    tensor. Classes are mapped through det_class_remap, dropping those
+    mapped to -1, and detections with confidence<=det_thr are dropped.
+    Keypoints are (N,K,3) x,y,conf with conf 0 for points at (0,0).
+    """
+    arrays=[None if t is None else to_numpy(t) for t in _yolo_tensors(results)]
+    return _arrays_to_detections(*arrays, det_thr, det_class_remap)
+
+def yolo_results_to_detections_batch(results_list, det_thr=0.01, det_class_remap=None):
+    """
+    yolo_results_to_detections for a batch of Results, transferring each
+    tensor type for the whole batch at once (see batch_to_numpy)
+    """
+    tensors=[_yolo_tensors(r) for r in results_list]
+    arrays=[[None]*len(tensors) for _ in range(6)]
+    for field in range(6):
+        column=[t[field] for t in tensors]
+        present=[i for i, t in enumerate(column) if t is not None]
+        for i, a in zip(present, batch_to_numpy([column[i] for i in present])):
+            arrays[field][i]=a
+    return [_arrays_to_detections(*[arrays[field][i] for field in range(6)], det_thr, det_class_remap)
+            for i in range(len(tensors))]
+
+def pose_nms_arrays(boxes, confidences, pose_points, is_person,
+                    pose_nms=None,
+                    pose_area_limit=None,
+                    pose_expand=None,
+                    nms_iou=None):
+    """
+    Keypoint aware NMS for person detections, on arrays:
+        boxes (N,4), confidences (N,), pose_points (N,K,3) (zero for
+        detections without pose points), is_person (N,) bool
+
+    - persons with fewer than 2 pose points (conf>0.01) and a box area
+      over pose_area_limit are removed
+    - with pose_expand, boxes of persons with pose points move that
+      fraction of the way towards the box around their points (conf>0.1)
+    - with pose_nms, going by descending confidence, a person whose pose
+      has kp_iou2>pose_nms with a lower confidence one (boxes overlapping)
+      absorbs it: the boxes are averaged weighted by confidence and the
+      other one is removed
+    - with nms_iou, plain box NMS between the remaining persons
+
+    Returns:
+        new boxes (N,4) and (N,) bool keep mask
+    """
+    boxes=coord.boxes_array(boxes).copy()
+    confidences=np.asarray(confidences, dtype=np.float64)
+    pose_points=np.asarray(pose_points, dtype=np.float64)
+    is_person=np.asarray(is_person, dtype=bool)
+    keep=confidences!=0
+
+    has_pose=is_person & ((pose_points[:,:,2]>0.01).sum(axis=1)>=2)
+    if pose_area_limit is not None:
+        keep&=~(is_person & ~has_pose & (coord.box_a_array(boxes)>pose_area_limit))
+
+    p_index=np.flatnonzero(has_pose)
+    if pose_expand is not None and len(p_index)>0:
+        kp=pose_points[p_index]
+        visible=kp[:,:,2]>0.1
+        b=boxes[p_index]
+        pose_box=np.stack([np.minimum(b[:,0], np.where(visible, kp[:,:,0], np.inf).min(axis=1)),
+                           np.minimum(b[:,1], np.where(visible, kp[:,:,1], np.inf).min(axis=1)),
+                           np.maximum(b[:,2], np.where(visible, kp[:,:,0], -np.inf).max(axis=1)),
+                           np.maximum(b[:,3], np.where(visible, kp[:,:,1], -np.inf).max(axis=1))], axis=1)
+        boxes[p_index]=pose_expand*pose_box+(1.0-pose_expand)*b
+
+    if pose_nms is not None and len(p_index)>1:
+        p_index=p_index[np.argsort(-confidences[p_index], kind="stable")]
+        kp=pose_points[p_index]
+        areas=coord.box_a_array(boxes[p_index])
+        alive=keep[p_index].copy()
+        # score every overlapping pair once with the starting boxes, a
+        # person's box only changes once it absorbs another so rows with no
+        # hits here can't absorb anything
+        ioma=coord.box_ioma_matrix(boxes[p_index], boxes[p_index])
+        r, c=np.nonzero(np.triu(ioma!=0, 1))
+        sim=coord.kp_iou2_array(kp[r], kp[c], np.maximum(areas[r], areas[c]))
+        for n in np.unique(r[sim>pose_nms]):
+            if not alive[n]:
+                continue
+            i=p_index[n]
+            cand=n+1+np.flatnonzero(alive[n+1:])
+            while len(cand)>0:
+                # the box changes on each merge so rescore what's left after it
+                ioma=coord.box_ioma_matrix(boxes[i], boxes[p_index[cand]])[0]
+                s=np.maximum(coord.box_a_array(boxes[i]), areas[cand])
+                sim=coord.kp_iou2_array(kp[n], kp[cand], s)
+                hit=np.flatnonzero((ioma!=0) & (sim>pose_nms))
+                if len(hit)==0:
+                    break
+                m=cand[hit[0]]
+                j=p_index[m]
+                f=confidences[i]/(confidences[i]+confidences[j])
+                coord.interpolate(boxes[j], boxes[i], f, out=boxes[i])
+                alive[m]=False
+                cand=cand[hit[0]+1:]
+        keep[p_index]=alive
+
+    if nms_iou is not None:
+        persons=np.flatnonzero(is_person & keep)
+        keep[persons]=coord.box_nms(boxes[persons], confidences[persons], nms_iou)
+
+    return boxes, keep
+
+def pose_nms_dets(dets, person_class,
+                  pose_nms=None,
+                  pose_area_limit=None,
+                  pose_expand=None,
+                  nms_iou=None):
+    """
+    Run pose_nms_arrays on a list of det dicts, updating boxes in place.
+    Returns the detections that are kept (confidence!=0)
+    """
+    if len(dets)==0:
+        return dets
+    is_person=np.array([d["class"]==person_class for d in dets])
+    num_kp=max([len(d["pose_points"])//3 for d in dets if "pose_points" in d], default=0)
+    pose_points=np.zeros((len(dets), num_kp, 3))
+    for i in np.flatnonzero(is_person):
+        if "pose_points" in dets[i]:
+            kp=dets[i]["pose_points"]
+            pose_points[i, 0:len(kp)//3]=np.reshape(kp, (-1, 3))
+    boxes, keep=pose_nms_arrays([d["box"] for d in dets],
+                                [d["confidence"] for d in dets],
+                                pose_points,
+                                is_person,
+                                pose_nms=pose_nms,
+                                pose_area_limit=pose_area_limit,
+                                pose_expand=pose_expand,
+                                nms_iou=nms_iou)
+    out=[]
+    for d, box, k in zip(dets, boxes.tolist(), keep.tolist()):
+        if k:
+            d["box"][0:4]=box
+            out.append(d)
+    return out
+
+class YoloConverter:
+    """
+    Converts ultralytics Results to det dicts like yolo_results_to_dets
+    (see there for the arguments), with the class, attribute and remap
+    tables worked out once in the constructor. Use convert() per frame or
+    convert_batch() for the results of a batched predict, which also does
+    one device transfer per tensor type for the whole batch.
+    """
+    def __init__(self,
+                 det_thr=0.01,
+                 det_class_remap=None,
+                 yolo_class_names=None,
+                 class_names=None,
+                 attributes=None,
+                 add_faces=False,
+                 face_kp=False,
+                 pose_kp=False,
+                 facepose_kp=False,
+                 fold_attributes=False,
+                 params=None):
+        self.det_thr=det_thr
+        self.det_class_remap=None
+        if det_class_remap is not None:
+            self.det_class_remap=np.asarray(det_class_remap, dtype=np.int64)
+        self.class_names=class_names
+        self.attributes=attributes
+        self.face_kp=face_kp
+        self.pose_kp=pose_kp
+        self.facepose_kp=facepose_kp
+        self.fold_attributes=fold_attributes
+        self.fold_plan=None
+        if fold_attributes and attributes is not None:
+            self.fold_plan=attribute_fold_plan(class_names, attributes)
+
+        self.attr_class_map=[]
+        if yolo_class_names is not None:
+            self.attr_class_map=[i for i,cn in enumerate(yolo_class_names) if "person_" in cn]
+
+        self.person_class=-1
+        self.face_class=-1
+        if class_names is not None:
+            if "person" in class_names:
+                self.person_class=class_names.index("person")
+            if "face" in class_names:
+                self.face_class=class_names.index("face")
+        # faces are only added if the model doesn't detect them itself
+        self.add_faces=(add_faces and (yolo_class_names is None or not "face" in yolo_class_names)
+                        and self.person_class!=-1 and self.face_class!=-1)
+
+        self.pose_nms=None
+        self.pose_area_limit=None
+        self.pose_expand=None
+        self.nms_iou=None
+        if params is not None:
+            if "pose_nms" in params:
+                self.pose_nms=params["pose_nms"]
+            if "pose_area_limit" in params:
+                self.pose_area_limit=params["pose_area_limit"]
+            if "pose_expand" in params:
+                self.pose_expand=params["pose_expand"]
+            if "nms_iou" in params:
+                self.nms_iou=params["nms_iou"]
+
+    def convert(self, results):
+        """
+        Return the list of det dicts for one Results
+        """
+        dets=yolo_results_to_detections(results, det_thr=self.det_thr, det_class_remap=self.det_class_remap)
+        return self.detections_to_dets(dets)
+
+    def convert_batch(self, results_list):
+        """
+        Return a list of det dict lists, one per Results in 'results_list'
+        """
+        dets_list=yolo_results_to_detections_batch(results_list,
+                                                    det_thr=self.det_thr,
+                                                    det_class_remap=self.det_class_remap)
+        return [self.detections_to_dets(dets) for dets in dets_list]
+
+    def face_detections(self, dets):
+        """
+        Face Detections made from the facepose points of the persons in
+        'dets' (see facepose_face_boxes), with the person's confidence
+        and keypoints, skipping faces overlapping an earlier one by IoU
+        0.5 or more. Empty unless the keypoints are facepose points
+        """
+        facepose=split_keypoints(dets.keypoints)[2]
+        if facepose is None:
+            return dets[np.zeros(0, np.int64)]
+        boxes, valid=facepose_face_boxes(facepose)
+        index=np.flatnonzero(valid & (dets.classes==self.person_class))
+        iou=coord.box_iou_matrix(boxes[index], boxes[index])
+        keep=[]
+        for i in range(len(index)):
+            if all(iou[i, j]<0.5 for j in keep):
+                keep.append(i)
+        index=index[keep]
+        return Detections(boxes[index],
+                          np.full(len(index), self.face_class),
+                          dets.confidences[index],
+                          keypoints=dets.keypoints[index])
+
+    def detections_to_dets(self, dets):
+        """
+        Run the rest of the conversion (attribute expansion, added faces,
+        keypoint mapping, attribute folding, pose NMS) on the Detections
+        for one frame and return det dicts
+        """
+        if len(self.attr_class_map)>0:
+            dets=Detections.concatenate([dets, dets.expand_attributes(self.attr_class_map)])
+        if self.add_faces:
+            dets=Detections.concatenate([dets, self.face_detections(dets)])
+
+        person_class=self.person_class
+        face_class=self.face_class
+        # keypoint mapping done on the arrays
+        out_det=dets.to_dicts(face_kp=self.face_kp, pose_kp=self.pose_kp, facepose_kp=self.facepose_kp)
+
+        if self.face_kp or self.pose_kp:
+            for d in out_det:
+                if self.face_kp and d["class"]==face_class:
+                    if "facepose_points" in d:
+                        del d["facepose_points"]
+                    if "pose_points" in d:
+                        del d["pose_points"]
+                if self.pose_kp and d["class"]==person_class:
+                    if "facepose_points" in d:
+                        del d["facepose_points"]
+                    if "face_points" in d:
+                        del d["face_points"]
+
+        if self.fold_attributes:
+            out_det=fold_detections_to_attributes(out_det, self.class_names, self.attributes,
+                                                  plan=self.fold_plan)
+
+        if self.pose_nms is not None or self.pose_area_limit is not None:
+            out_det=pose_nms_dets(out_det, person_class,
+                                  pose_nms=self.pose_nms,
+                                  pose_area_limit=self.pose_area_limit,
+                                  pose_expand=self.pose_expand,
+                                  nms_iou=self.nms_iou)
+
+        return out_det
 
 def yolo_results_to_dets(results,
                          det_thr=0.01,
@@ -164,209 +540,26 @@ def yolo_results_to_dets(results,
                          facepose_kp=False,
                          fold_attributes=False,
                          params=None):
+    """
+    Convert an ultralytics Results to a list of det dicts. To convert
+    many frames with the same settings use a YoloConverter.
 
-    det_boxes = results.boxes.xyxyn.tolist() # center
-    det_classes = results.boxes.cls.tolist()
-    det_confidences = results.boxes.conf.tolist()
-    out_det=[]
-
-    if det_class_remap is None:
-        nc=1
-        if len(det_classes)>0:
-            nc=int(max(det_classes))+1
-        det_class_remap=list(range(0, nc))
-
-    det_kp_list=None
-    det_kp_conf_list=None
-    if hasattr(results, "keypoints") and results.keypoints is not None:
-        det_kp_list=results.keypoints.xyn.tolist()
-        if results.keypoints.has_visible:
-            det_kp_conf_list=results.keypoints.conf.tolist()
-
-    num_det=len(det_boxes)
-    indexes=[i for i in range(num_det) if det_class_remap[int(det_classes[i])]!=-1
-             and det_confidences[i]>det_thr] # remove detected classes we are not interested in
-
-    if hasattr(results.boxes, "id") and results.boxes.id is not None:
-        det_ids=results.boxes.id.tolist()
-    else:
-        det_ids=[None]*len(det_boxes)
-
-    for i in indexes:
-        det={"box":det_boxes[i],
-             "id":det_ids[i],
-            "class":det_class_remap[int(det_classes[i])],
-            "confidence":det_confidences[i]}
-
-        fp, pp, fpp, attr=unpack_yolo_keypoints(det_kp_list, det_kp_conf_list, i)
-        if fp is not None:
-            det["face_points"]=fp
-        if pp is not None:
-            det["pose_points"]=pp
-        if fpp is not None:
-            det["facepose_points"]=fpp
-        if attr is not None:
-            assert (len(attr)%3)==0
-            num_poseattr=len(attr)//3
-            poseattr=[0]*num_poseattr
-            for i in range(num_poseattr):
-                poseattr[i]=attr[3*i+2]
-            det["poseattr"]=poseattr
-        if det["class"]!=-1:
-            out_det.append(det)
-
-    if True:
-        extra_det=[]
-        attr_class_map=[]
-        for i,cn in enumerate(yolo_class_names):
-            if "person_" in cn:
-                attr_class_map.append(i)
-        if len(attr_class_map)>0:
-            for i,d in enumerate(out_det):
-                if "poseattr" in d:
-                    for j,v in enumerate(d["poseattr"]):
-                        if v>0.01:
-                            dcopy=copy.deepcopy(d)
-                            dcopy["confidence"]=v
-                            dcopy["class"]=attr_class_map[j]
-                            extra_det.append(dcopy)
-            out_det+=extra_det
-
-    if add_faces and not "face" in yolo_class_names and "person" in class_names and "face" in class_names:
-        person_class=class_names.index("person")
-        face_class=class_names.index("face")
-        faces=[]
-        for i,d in enumerate(out_det):
-            if d["class"]==person_class and "facepose_points" in d:
-                face_box,_=facepose_facebox(d)
-                if face_box is not None:
-                    det={"box":face_box,
-                        "class":face_class,
-                        "confidence":d["confidence"],
-                        "facepose_points":copy.copy(d["facepose_points"])}
-                    max_iou=0
-                    for f in faces:
-                        max_iou=max(max_iou, box_iou(face_box, f["box"]))
-                    if max_iou<0.5:
-                        faces.append(det)
-
-        out_det+=faces
-    person_class=-1
-    face_class=-1
-    if "person" in class_names:
-        person_class=class_names.index("person")
-    if "face" in class_names:
-        face_class=class_names.index("face")
-    for d in out_det:
-        map_one_gt_keypoints(d, face_kp, pose_kp, facepose_kp)
-        if face_kp and d["class"]==face_class:
-            if "facepose_points" in d:
-                del d["facepose_points"]
-            if "pose_points" in d:
-                del d["pose_points"]
-        if pose_kp and d["class"]==person_class:
-            if "facepose_points" in d:
-                del d["facepose_points"]
-            if "face_points" in d:
-                del d["face_points"]
-
-    if fold_attributes:
-        out_det=fold_detections_to_attributes(out_det, class_names, attributes)
-
-    pose_nms=None
-    pose_area_limit=None
-    pose_expand=None
-    nms_iou=None
-    if params is not None:
-        if "pose_nms" in params:
-            pose_nms=params["pose_nms"]
-        if "pose_area_limit" in params:
-            pose_area_limit=params["pose_area_limit"]
-        if "pose_expand" in params:
-            pose_expand=params["pose_expand"]
-        if "nms_iou" in params:
-            nms_iou=params["nms_iou"]
-
-    if pose_nms is not None or pose_area_limit is not None:
-        p_index=[]
-        for i,d in enumerate(out_det):
-            if d["class"]==person_class:
-                num=0
-                if "pose_points" in d:
-                    for j in range(len(d["pose_points"])//3):
-                        if d["pose_points"][j*3+2]>0.01:
-                            num+=1
-                if num>=2:
-                    p_index.append(i)
-                else:
-                    if pose_area_limit is not None and box_a(d["box"])>pose_area_limit:
-                        d["confidence"]=0
-        if pose_expand is not None:
-            for i in p_index:
-                d=out_det[i]
-                pose_box=d["box"].copy()
-                for j in range(len(d["pose_points"])//3):
-                    if d["pose_points"][j*3+2]>0.1:
-                        pose_box[0]=min(pose_box[0], d["pose_points"][j*3+0])
-                        pose_box[2]=max(pose_box[2], d["pose_points"][j*3+0])
-                        pose_box[1]=min(pose_box[1], d["pose_points"][j*3+1])
-                        pose_box[3]=max(pose_box[3], d["pose_points"][j*3+1])
-                for i in range(4):
-                    d["box"][i]=pose_expand*pose_box[i]+(1.0-pose_expand)*d["box"][i]
-        #kp_iou2(kp_gt, kp_det, s, num_pt)
-        if pose_nms is not None:
-            for n,i in enumerate(p_index):
-                d=out_det[i]
-                if d["confidence"]==0:
-                    continue
-                for m in range(n+1, len(p_index)):
-                    j=p_index[m]
-                    d2=out_det[j]
-                    ioma=box_ioma(d["box"],d2["box"])
-                    if ioma==0:
-                        continue
-                    #if ioma>0.9:
-                    #    d2["confidence"]=0
-                    #    continue
-                    iou=kp_iou2(d["pose_points"], d2["pose_points"], max(box_a(d["box"]), box_a(d2["box"])), len(d["pose_points"])//3)
-                    #print(d["pose_points"])
-                    #print(d2["pose_points"])
-                    #print(box_iou(d["box"],d2["box"]), iou, len(d["pose_points"])//3)
-                    if iou>pose_nms:
-                        f=d["confidence"]/(d["confidence"]+d2["confidence"])
-                        for i in range(4):
-                            d["box"][i]=f*d["box"][i]+(1.0-f)*d2["box"][i]
-                        #print(f"remove keypoint! {iou} {d["confidence"]} {d2["confidence"]}")
-                        #if d2["confidence"]>0.2:
-                        #    img=results.orig_img
-                        #    an=[d,d2]
-                        #    img=draw_boxes(img, an)
-                        #    display_image_wait_key(img)
-                        d2["confidence"]=0
-                    
-        out_det2=[]
-        for d in out_det:
-            if d["confidence"]!=0:
-                out_det2.append(d)
-        #print(f"removed {len(out_det)-len(out_det2)}")
-        out_det=out_det2
-
-        for i,d in enumerate(out_det):
-            if d["class"]==person_class:
-                for j in range(i+1, len(out_det)):
-                    d2=out_det[j]
-                    if d["confidence"]==0:
-                        continue
-                    if d2["class"]==person_class and box_iou(d["box"],d2["box"])>nms_iou:
-                        d2["confidence"]=0
-
-        out_det2=[]
-        for d in out_det:
-            if d["confidence"]!=0:
-                out_det2.append(d)
-        out_det=out_det2
-
-    return out_det
+    With add_faces, if class_names has person and face but the model has
+    no face class, face detections are added for persons with facepose
+    points (a 19 keypoint model); otherwise it does nothing.
+    """
+    converter=YoloConverter(det_thr=det_thr,
+                            det_class_remap=det_class_remap,
+                            yolo_class_names=yolo_class_names,
+                            class_names=class_names,
+                            attributes=attributes,
+                            add_faces=add_faces,
+                            face_kp=face_kp,
+                            pose_kp=pose_kp,
+                            facepose_kp=facepose_kp,
+                            fold_attributes=fold_attributes,
+                            params=params)
+    return converter.convert(results)
 
 def kp_line(display, kp, pts, thickness=2):
     a=pts[0]
@@ -394,6 +587,27 @@ def kp_line(display, kp, pts, thickness=2):
         y1=0.5*(y1+y2)
     display.draw_line([x0,y0], [x1,y1], "half_blue", thickness=thickness)
 
+# skeleton lines between pose points; a line with three points goes from
+# the first to the middle of the other two
+SKELETON_LINES=[[0,1],[0,2],[0, 5, 6],[1, 3],[2, 4],[5, 6],
+                [5, 11],[6,12],[11,12],[5,7],[7,9],[6,8],
+                [8,10],[11,13],[13,15],[12,14],[14,16]]
+FACEPOSE_SKELETON_LINES=SKELETON_LINES+[[17, 18]]
+
+def skeleton_segments(kp, lines):
+    """
+    Return the (M,L,2,2) line segments for 'lines' (see SKELETON_LINES) of
+    (M,K,3) keypoints and an (M,L) mask of those with all points visible,
+    as kp_line draws them
+    """
+    a=np.array([l[0] for l in lines])
+    b=np.array([l[1] for l in lines])
+    c=np.array([l[2] if len(l)>2 else l[1] for l in lines])
+    p0=kp[:, a, 0:2]
+    p1=0.5*(kp[:, b, 0:2]+kp[:, c, 0:2])
+    visible=(kp[:, a, 2]!=0) & (kp[:, b, 2]!=0) & (kp[:, c, 2]!=0)
+    return np.stack([p0, p1], axis=2), visible
+
 def draw_boxes(display,
                an,
                class_names=None,
@@ -402,7 +616,18 @@ def draw_boxes(display,
                attributes=None,
                extra_text=None
                ):
-    
+    """
+    Draw detections or GTs 'an' with their labels, face points and
+    skeletons on 'display'. Boxes, face points and skeleton lines are
+    drawn with the display's batch calls, then the labels.
+    """
+    boxes=[]
+    box_clrs=[]
+    box_thickness=[]
+    face_centres=[]
+    face_clrs=[]
+    skeletons={}    # number of points -> list of (keypoints, thickness)
+    labels=[]
     for index,a in enumerate(an):
         highlight=index==highlight_index
         if alt_clr:
@@ -413,7 +638,9 @@ def draw_boxes(display,
         if highlight:
             clr="flashing_yellow"
             thickness=4
-        display.draw_box(a["box"], clr=clr, thickness=thickness)
+        boxes.append(a["box"][0:4])
+        box_clrs.append(clr)
+        box_thickness.append(thickness)
 
         if class_names==None or not a["class"]<len(class_names):
             label=f"Class_{a['class']}"
@@ -429,24 +656,30 @@ def draw_boxes(display,
                     clr="half_red"
                     if i==0 or i==3: # RIGHT points
                         clr="half_yellow"
-                    display.draw_circle([fp[3*i+0], fp[3*i+1]], radius=0.002, clr=clr)
+                    face_centres.append([fp[3*i+0], fp[3*i+1]])
+                    face_clrs.append(clr)
                 
         if "pose_points" in a or "facepose_points" in a:
             if "pose_points" in a:
                 kp=a["pose_points"]
             else:
                 kp=a["facepose_points"]
-
-            lines=[[0,1],[0,2],[0, 5, 6],[1, 3],[2, 4],[5, 6],
-                   [5, 11],[6,12],[11,12],[5,7],[7,9],[6,8],
-                   [8,10],[11,13],[13,15],[12,14],[14,16]]
-            for l in lines:
-               kp_line(display, kp, l, thickness=thickness)
-
-            if len(kp)==19*3:
-                kp_line(display, kp, [17, 18], thickness=thickness)
-            
-        display.draw_text(label, a["box"][0], a["box"][3])
+            skeletons.setdefault(len(kp), []).append((kp, thickness))
+
+        labels.append((label, a["box"][0], a["box"][3]))
+
+    if len(boxes)>0:
+        display.draw_boxes_batch(boxes, clr=box_clrs, thickness=box_thickness)
+    if len(face_centres)>0:
+        display.draw_circles_batch(face_centres, radius=0.002, clr=face_clrs)
+    for num, skels in skeletons.items():
+        kp=np.array([k for k, _ in skels], dtype=np.float64).reshape(len(skels), -1, 3)
+        lines=FACEPOSE_SKELETON_LINES if num==19*3 else SKELETON_LINES
+        segments, visible=skeleton_segments(kp, lines)
+        thickness=np.repeat([t for _, t in skels], len(lines)).reshape(len(skels), len(lines))
+        display.draw_polylines_batch(segments[visible], clr="half_blue", thickness=thickness[visible])
+    for label, x, y in labels:
+        display.draw_text(label, x, y)
 
     if highlight_index is not None and extra_text is None:
         extra_text=""
@@ -468,7 +701,18 @@ def draw_boxes(display,
     if extra_text is not None:
         display.draw_text(extra_text, 0.05, 0.05, unmap=False, fontScale=0.5)
 
-def find_gt_from_point(gts, x, y):
+def find_gt_from_point(gts, x, y, index=None):
+    """
+    Return (index, squared distance) of the box in 'gts' containing x,y
+    with the nearest centre, or (None, 1000000). 'index' is an optional
+    coord.BoxGrid over the gts boxes (in order) to search instead of
+    scanning them all
+    """
+    if index is not None:
+        indices, dists=index.query([x, y], metric="sq")
+        if len(indices)==0:
+            return None, 1000000
+        return int(indices[0]), float(dists[0])
     ret=None
     best_d=1000000
     for i,gt in enumerate(gts):
@@ -1,53 +1,451 @@
 from collections import OrderedDict
+from bisect import bisect_right
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import pickle
+import queue
+import threading
+import traceback
 import cv2
+import numpy as np
+from stuff.misc import save_atomic_pickle
 
+KEYFRAME_INDEX_VERSION=1
+# OpenCV's FFmpeg backend seeks to the keyframe before (target-16) then
+# decodes forward to the target, so a seek isn't free even to a keyframe
+SEEK_PREROLL=16
+
+def keyframe_index_path(video_path):
+    """
+    Return the sidecar file name used to store the keyframe index of a video
+    """
+    return video_path+".kfidx"
+
+def build_keyframe_index(video_path):
+    """
+    Scan a video without decoding it and return the list of frame
+    indexes that are keyframes (safe seek points).
+
+    The capture is opened in raw packet mode so only demuxing is done.
+    If the backend can't report keyframes we return [0], which means
+    'always decode from the start'.
+    """
+    cap=cv2.VideoCapture(video_path)
+    keyframes=[]
+    if cap.isOpened() and cap.set(cv2.CAP_PROP_FORMAT, -1):
+        index=0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(index)
+            index+=1
+    cap.release()
+    if len(keyframes)==0 or keyframes[0]!=0:
+        keyframes=[0]+keyframes
+    return keyframes
+
+def load_keyframe_index(video_path, index_path=None, build=True):
+    """
+    Load the keyframe index for a video from its sidecar file, building
+    and saving it first if it is missing or out of date (the video
+    size/mtime are stored in the sidecar to detect this).
+    If the sidecar can't be written the index is just returned.
+    """
+    if index_path is None:
+        index_path=keyframe_index_path(video_path)
+    st=os.stat(video_path)
+    if os.path.isfile(index_path):
+        try:
+            with open(index_path, 'rb') as handle:
+                data=pickle.load(handle)
+            if (data["version"]==KEYFRAME_INDEX_VERSION
+                and data["size"]==st.st_size
+                and data["mtime"]==st.st_mtime):
+                return data["keyframes"]
+        except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+            pass
+    if not build:
+        return None
+    keyframes=build_keyframe_index(video_path)
+    data={"version":KEYFRAME_INDEX_VERSION,
+          "size":st.st_size,
+          "mtime":st.st_mtime,
+          "keyframes":keyframes}
+    try:
+        save_atomic_pickle(data, index_path)
+    except OSError as e:
+        print(f"load_keyframe_index: could not write {index_path}: {e}")
+    return keyframes
+
+class FrameCache:
+    """
+    LRU cache of video frames limited by a byte budget and/or a frame count.
+
+    Keys are arbitrary, readers use (owner, frame_index) so one cache can
+    be shared by several readers under one memory limit. All methods are
+    thread safe.
+
+    By default evicted frames are just dropped, so a frame handed out
+    stays valid for as long as the caller keeps it. With recycle=True
+    they are recycled instead: an evicted frame becomes the buffer the
+    next frame of the same shape is decoded into (see acquire), so once
+    the cache is full reading doesn't allocate. Frames handed out then
+    get overwritten some time after they have been evicted, so only use
+    recycle=True if callers copy frames they keep. Use reserve() to
+    preallocate the buffers up front.
+    """
+    def __init__(self, max_bytes=None, max_frames=None, max_spare=4, recycle=False):
+        self.max_bytes=max_bytes
+        self.max_frames=max_frames
+        self.max_spare=max_spare   # spare buffers kept when there is no byte budget
+        self.recycle=recycle
+        self.lock=threading.RLock()
+        self.entries=OrderedDict() # key -> frame
+        self.spare={}              # (shape, dtype) -> [buffer]
+        self.num_spare=0
+        self.loaned={}             # id(buffer) -> buffer, handed out by acquire
+        self.nbytes=0              # bytes held in entries, spare and loaned buffers
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def stats(self):
+        """
+        Return a dict of cache counters
+        """
+        with self.lock:
+            return {"frames":len(self.entries),
+                    "bytes":self.nbytes,
+                    "max_bytes":self.max_bytes,
+                    "hits":self.hits,
+                    "misses":self.misses,
+                    "evictions":self.evictions}
+
+    def get(self, key):
+        """
+        Return the frame for 'key', refreshing its LRU position, or None
+        """
+        with self.lock:
+            frame=self.entries.get(key)
+            if frame is None:
+                self.misses+=1
+                return None
+            self.hits+=1
+            self.entries.move_to_end(key)
+            return frame
+
+    def _over_budget(self, extra_bytes=0, extra_frames=0):
+        if self.max_bytes is not None and self.nbytes+extra_bytes>self.max_bytes:
+            return True
+        if self.max_frames is not None and len(self.entries)+extra_frames>self.max_frames:
+            return True
+        return False
+
+    def _add_spare(self, buf):
+        self.spare.setdefault((buf.shape, buf.dtype), []).append(buf)
+        self.num_spare+=1
+
+    def _release(self, frame):
+        # a frame leaving the cache: keep its buffer to reuse if recycling,
+        # otherwise it may still be in use by whoever it was handed to
+        if self.recycle:
+            self._add_spare(frame)
+        else:
+            self.nbytes-=frame.nbytes
+
+    def _drop_spare(self, extra_bytes=0):
+        # free spare buffers while over the byte budget (or over max_spare
+        # if there is no budget)
+        for spec in list(self.spare.keys()):
+            bufs=self.spare[spec]
+            while bufs:
+                if self.max_bytes is not None:
+                    if self.nbytes+extra_bytes<=self.max_bytes:
+                        return
+                elif self.num_spare<=self.max_spare:
+                    return
+                self.nbytes-=bufs.pop().nbytes
+                self.num_spare-=1
+            del self.spare[spec]
+
+    def _evict(self):
+        _, frame=self.entries.popitem(last=False)
+        self.evictions+=1
+        self._release(frame)
+        return frame
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Return a buffer of 'shape' to decode a frame into, then pass it
+        to put() or discard(). Evicts LRU frames if needed to stay in budget,
+        reusing their buffer if recycling and the shape matches.
+        """
+        shape=tuple(shape)
+        dtype=np.dtype(dtype)
+        spec=(shape, dtype)
+        need=int(np.prod(shape))*dtype.itemsize
+        with self.lock:
+            while True:
+                bufs=self.spare.get(spec)
+                if bufs:
+                    buf=bufs.pop()
+                    self.num_spare-=1
+                    break
+                # a new buffer is needed: spares of other shapes go first,
+                # then LRU frames until it fits
+                self._drop_spare(need)
+                if not self.entries or not self._over_budget(need, 1):
+                    buf=np.empty(shape, dtype)
+                    self.nbytes+=buf.nbytes
+                    break
+                _, frame=self.entries.popitem(last=False)
+                self.evictions+=1
+                if self.recycle and (frame.shape, frame.dtype)==spec:
+                    self._add_spare(frame)
+                else:
+                    self.nbytes-=frame.nbytes
+            self.loaned[id(buf)]=buf
+            return buf
+
+    def reserve(self, shape, count=None, dtype=np.uint8):
+        """
+        Preallocate spare buffers of 'shape', 'count' of them or as many
+        as fit in the byte budget
+        """
+        shape=tuple(shape)
+        dtype=np.dtype(dtype)
+        need=int(np.prod(shape))*dtype.itemsize
+        with self.lock:
+            n=0
+            while count is None or n<count:
+                if self.max_bytes is None:
+                    if count is None:
+                        break
+                elif self.nbytes+need>self.max_bytes:
+                    break
+                self._add_spare(np.empty(shape, dtype))
+                self.nbytes+=need
+                n+=1
+
+    def discard(self, buf):
+        """
+        Give back a buffer from acquire() that wasn't used
+        """
+        with self.lock:
+            if self.loaned.pop(id(buf), None) is not None:
+                self._add_spare(buf)
+                self._drop_spare()
+
+    def put(self, key, frame):
+        """
+        Store 'frame' under 'key'. 'frame' would normally be a buffer
+        from acquire() but any array is accepted.
+        """
+        with self.lock:
+            if self.loaned.pop(id(frame), None) is None:
+                self.nbytes+=frame.nbytes
+            old=self.entries.pop(key, None)
+            if old is not None and old is not frame:
+                self._release(old)
+            self.entries[key]=frame
+            while len(self.entries)>1 and self._over_budget():
+                self._evict()
+            self._drop_spare()
+
+    def drop(self, owner):
+        """
+        Remove all frames with keys (owner, ...) e.g. when a reader is closed
+        """
+        with self.lock:
+            for key in [k for k in self.entries if k[0]==owner]:
+                self._release(self.entries.pop(key))
+            self._drop_spare()
+
+_reader_ids=itertools.count()
 
 class RandomAccessVideoReader:
     """
     Lets you access frames in the file by time in any order.
-    Works with a small LRU cache for video frames.
-    Will reopen and re-read the entire
-    video from the start if you request an older frame that isn't in the cache.
-    
+    Works with a small LRU cache for video frames (a FrameCache limited to
+    max_size frames and/or max_bytes bytes, or a cache shared with other readers).
+    With recycle=True the cache reuses evicted frame buffers, so frames
+    returned get overwritten later and must be copied to keep them.
+
     The typical flow is forward-only, but if you jump back to an older frame
     that's no longer in the cache, we:
-      - close the video
-      - reopen from the start
+      - seek to the nearest keyframe at or before the requested frame
       - read forward up to the requested frame
       - store those frames in the cache
+    Long forward jumps seek the same way instead of decoding every frame
+    in between.
+
+    Keyframes come from an index built once per file (see
+    build_keyframe_index) and kept in a sidecar file next to the video.
+    With use_keyframe_index=False, or if the backend can't report keyframes,
+    we fall back to reopening the video and reading from the start.
     This can be slow if you do it a lot, but it guarantees you never get an error.
+
+    With prefetch=N a background thread decodes up to N frames ahead of the
+    last frame read, so forward playback overlaps decode with whatever the
+    caller does between frames. The thread is stopped on a seek and
+    restarted from the new position on the next forward read, and stopped
+    by close() or when the reader is garbage collected.
     """
-    def __init__(self, video_path, max_size=10):
+    def __init__(self, video_path, max_size=None, use_keyframe_index=True, index_path=None,
+                 max_bytes=None, cache=None, prefetch=0, recycle=False):
         self.video_path = video_path
         self.cap = cv2.VideoCapture(video_path)
+        if max_size is None and max_bytes is None:
+            max_size=10
         self.max_size = max_size
-        
-        self.cache = OrderedDict()  # frame_index -> frame
+
+        if cache is None:
+            cache=FrameCache(max_bytes=max_bytes, max_frames=max_size, recycle=recycle)
+        self.cache = cache          # (self.cache_id, frame_index) -> frame
+        self.cache_id = next(_reader_ids)
         self.next_frame_index = 0   # the next frame we haven't read yet
 
         self.fps = self.cap.get(cv2.CAP_PROP_FPS)
         self.num_frames = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        width=int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height=int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_shape=(height, width, 3) if width>0 and height>0 else None
+
+        self.prefetch=prefetch
+        self.prefetch_thread=None
+        self.prefetch_queue=None
+        self.prefetch_stop=None
+        self.prefetch_position=[0]  # the next frame the prefetch thread will read
+
+        self.keyframes=[0]
+        if use_keyframe_index and self.cap.isOpened():
+            self.keyframes=load_keyframe_index(video_path, index_path=index_path)
+
+    def _read_frame(self):
+        """
+        Decode the next frame into a buffer from the cache, None at EOF
+        """
+        return _read_frame(self.cap, self.cache, self.frame_shape)
+
+    def _start_prefetch(self):
+        # the thread gets only what it reads with, not self, so dropping
+        # the reader still runs __del__ and stops it
+        self.prefetch_position=[self.next_frame_index]
+        self.prefetch_queue=queue.Queue(maxsize=self.prefetch)
+        self.prefetch_stop=threading.Event()
+        self.prefetch_thread=threading.Thread(target=_prefetch_worker,
+                                              args=(self.cap, self.cache, self.frame_shape,
+                                                    self.prefetch_position,
+                                                    self.prefetch_queue, self.prefetch_stop),
+                                              daemon=True)
+        self.prefetch_thread.start()
+
+    def _stop_prefetch(self):
+        """
+        Stop the prefetch thread, if running, so we can use self.cap directly.
+        Frames it had read ahead are dropped and the read pointer moves to
+        where it stopped.
+        """
+        if self.prefetch_thread is None:
+            return
+        self.prefetch_stop.set()
+        self.prefetch_thread.join()
+        while True:
+            try:
+                _, frame=self.prefetch_queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(frame, np.ndarray):
+                self.cache.discard(frame)
+        self.prefetch_thread=None
+        self.prefetch_queue=None
+        self.next_frame_index=self.prefetch_position[0]
+
+    def _keyframe_before(self, frame_index):
+        if frame_index<=0:
+            return 0
+        return self.keyframes[bisect_right(self.keyframes, frame_index)-1]
+
+    def _seek(self, frame_index):
+        """
+        Move the read pointer so that reading forward reaches 'frame_index'
+        with as little decoding as possible: seek to the nearest keyframe
+        at or before it if we are past 'frame_index' already, or if that
+        decodes fewer frames than reading forward from where we are.
+        """
+        keyframe=self._keyframe_before(frame_index)
+        if keyframe==0:
+            seek_cost=frame_index
+        else:
+            seek_cost=frame_index-self._keyframe_before(keyframe-SEEK_PREROLL)
+        if frame_index>=self.next_frame_index and frame_index-self.next_frame_index<=seek_cost:
+            return # reading forward from where we are is cheapest
+        if (self.prefetch_thread is not None and frame_index>=self.next_frame_index
+            and frame_index<self.next_frame_index+self.prefetch):
+            return # already being read ahead
+
+        self._stop_prefetch()
+
+        if keyframe==0:
+            # Reopen from start
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.video_path)
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        self.next_frame_index = keyframe
 
     def _read_forward_until(self, frame_index):
         """
         Read from self.next_frame_index up to 'frame_index' (inclusive),
         storing frames in the cache, and update self.next_frame_index.
         If we can't read that many frames, we'll stop at the last frame we can read.
+        Returns the frame at 'frame_index' or None.
         """
 
+        if self.prefetch>0 and self.next_frame_index <= frame_index:
+            return self._read_prefetched_until(frame_index)
+
+        frame=None
         while self.next_frame_index <= frame_index:
-            success, frame = self.cap.read()
-            if not success:
+            frame=self._read_frame()
+            if frame is None:
                 # Reached the end or can't read further
-                return
+                return None
 
-            # Store in cache
-            self.cache[self.next_frame_index] = frame
-            # Evict LRU if over capacity
-            if len(self.cache) > self.max_size:
-                self.cache.popitem(last=False)
+            # Store in cache, evicting LRU frames if over budget
+            self.cache.put((self.cache_id, self.next_frame_index), frame)
 
             self.next_frame_index += 1
+        return frame
+
+    def _read_prefetched_until(self, frame_index):
+        """
+        As _read_forward_until but taking frames from the prefetch thread,
+        starting it if needed
+        """
+        if self.prefetch_thread is None:
+            self._start_prefetch()
+        frame=None
+        while self.next_frame_index <= frame_index:
+            index, frame=self.prefetch_queue.get()
+            if frame is None:
+                # EOF, the thread has finished
+                self._stop_prefetch()
+                return None
+            if index is None:
+                # the thread failed, pass its exception on
+                self._stop_prefetch()
+                raise frame
+            self.cache.put((self.cache_id, index), frame)
+            self.next_frame_index=index+1
+        return frame
 
     def get_frame_at_time(self, frame_time):
         """
@@ -61,42 +459,392 @@ class RandomAccessVideoReader:
         Return the frame at 'frame_index'.
         
         Cases:
-        1) If 'frame_index' is in the cache, just pop+reinsert to refresh LRU usage.
-        2) If 'frame_index' < self.next_frame_index but not in the cache:
-            - Close, reopen from the start, clear cache,
+        1) If 'frame_index' is in the cache, just refresh its LRU usage.
+        2) If 'frame_index' < self.next_frame_index but not in the cache,
+           or it is far enough ahead that seeking decodes fewer frames:
+            - Seek to the keyframe at or before 'frame_index'
             - Read forward up to 'frame_index'.
-        3) If 'frame_index' >= self.next_frame_index:
+        3) Otherwise:
             - Read forward from self.next_frame_index up to 'frame_index'.
         
         Return None if the requested frame cannot be read (EOF).
+        The frame is shared with the cache, don't modify it. If the cache
+        recycles buffers it is only valid until evicted, see FrameCache.
         """
 
-        frame_index=max(0, min(frame_index, self.num_frames-1))
+        frame_index=self._clamp_index(frame_index)
 
         # Case 1: Already in cache?
-        if frame_index in self.cache:
-            frame = self.cache.pop(frame_index)
-            self.cache[frame_index] = frame
+        frame = self.cache.get((self.cache_id, frame_index))
+        if frame is not None:
             return frame
 
-        # Case 2: If the requested index is behind our read pointer and not cached
-        if frame_index < self.next_frame_index:
-            # Reopen from start
+        # Case 2: Seek if that's cheaper than reading forward
+        self._seek(frame_index)
+
+        # Case 3: Now we read forward until we reach frame_index
+        # (None if we hit EOF)
+        return self._read_forward_until(frame_index)
+
+    def _clamp_index(self, frame_index):
+        return int(max(0, min(frame_index, self.num_frames-1)))
+
+    def _read_sorted(self, indices, out=None, cache=True):
+        """
+        Generator over (k, frame) for the frames at sorted 'indices'.
+        Frames between the ones we want are skipped with grab() and only
+        the wanted ones are retrieve()d. Frames go into the cache, into
+        out[k] if 'out' is given, or with cache=False into new arrays
+        the caller owns. Stops at EOF.
+        """
+        for k, frame_index in enumerate(indices):
+            frame=self.cache.get((self.cache_id, frame_index))
+            if frame is not None:
+                if out is not None:
+                    np.copyto(out[k], frame)
+                    frame=out[k]
+                elif not cache:
+                    frame=frame.copy()
+                yield k, frame
+                continue
+
+            self._stop_prefetch()
+            self._seek(frame_index)
+            while self.next_frame_index < frame_index:
+                if not self.cap.grab():
+                    return
+                self.next_frame_index += 1
+            if not self.cap.grab():
+                return
+            self.next_frame_index += 1
+
+            if out is not None:
+                success, frame = self.cap.retrieve(out[k])
+                if success and frame is not out[k]:
+                    np.copyto(out[k], frame)
+                    frame=out[k]
+            elif not cache:
+                success, frame = self.cap.retrieve()
+            else:
+                buf=None
+                if self.frame_shape is not None:
+                    buf=self.cache.acquire(self.frame_shape)
+                success, frame = self.cap.retrieve(buf)
+                if buf is not None and frame is not buf:
+                    self.cache.discard(buf)
+                if success:
+                    self.cache.put((self.cache_id, frame_index), frame)
+            if not success:
+                return
+            yield k, frame
+
+    def get_frames(self, indices, stack=False):
+        """
+        Return the frames at 'indices' (any order, repeats allowed).
+
+        Frames are read in index order in one pass, skipping unwanted
+        frames with grab(). Returns a list of frames (None where a frame
+        couldn't be read), or with stack=True one contiguous (N,H,W,3)
+        array with zeros where a frame couldn't be read. Either way the
+        frames belong to the caller, they don't go through the cache.
+        """
+        indices=[self._clamp_index(i) for i in indices]
+        order=sorted(set(indices))
+        if stack:
+            if self.frame_shape is None:
+                frames=self.get_frames(indices)
+                shape=next((f.shape for f in frames if f is not None), (0, 0, 3))
+                return np.stack([f if f is not None else np.zeros(shape, np.uint8) for f in frames])
+            out=np.zeros((len(order),)+self.frame_shape, np.uint8)
+            for _ in self._read_sorted(order, out=out):
+                pass
+            if order==indices:
+                return out
+            row={index:k for k, index in enumerate(order)}
+            return out[[row[i] for i in indices]]
+
+        frames={}
+        for k, frame in self._read_sorted(order, cache=False):
+            frames[order[k]]=frame
+        return [frames.get(i) for i in indices]
+
+    def iter_frames(self, start=0, stop=None, step=1, batch_size=None):
+        """
+        Iterate over frames start, start+step, ... up to 'stop' (exclusive,
+        default the end of the video), stopping at EOF.
+
+        Skipped frames are only grab()bed, not decoded to images. Yields
+        single frames, shared with the cache like get_frame_at_index, or with
+        'batch_size' new contiguous (N,H,W,3) arrays of up to 'batch_size'
+        frames. 'start' and 'stop' are clamped to 0..num_frames like the
+        indices of get_frames.
+        """
+        if step<1:
+            raise ValueError(f"iter_frames: step must be at least 1, got {step}")
+        num_frames=int(self.num_frames)
+        if stop is None or (num_frames>0 and stop>num_frames):
+            stop=num_frames
+        indices=range(max(0, start), max(0, stop), step)
+        if batch_size is None:
+            for _, frame in self._read_sorted(indices):
+                yield frame
+            return
+
+        for b in range(0, len(indices), batch_size):
+            batch=indices[b:b+batch_size]
+            if self.frame_shape is None:
+                frames=[f for f in self.get_frames(batch) if f is not None]
+                if len(frames)>0:
+                    yield np.stack(frames)
+                if len(frames)<len(batch):
+                    return
+                continue
+            out=np.empty((len(batch),)+self.frame_shape, np.uint8)
+            n=0
+            for k, _ in self._read_sorted(batch, out=out):
+                n=k+1
+            if n>0:
+                yield out[:n]
+            if n<len(batch):
+                return
+
+    def close(self):
+        """
+        Release the video and drop our frames from the cache
+        """
+        if getattr(self, "cap", None) is not None:
+            self._stop_prefetch()
             self.cap.release()
-            self.cap = cv2.VideoCapture(self.video_path)
+            self.cap = None
+            self.cache.drop(self.cache_id)
 
-            # Clear cache
-            self.cache.clear()
-            self.next_frame_index = 0
+    def __del__(self):
+        self.close()
 
-        # Case 3: Now we read forward until we reach frame_index
-        self._read_forward_until(frame_index)
 
-        # Attempt to retrieve the frame from the cache now
-        if frame_index in self.cache:
-            frame = self.cache.pop(frame_index)
-            self.cache[frame_index] = frame
-            return frame
+def _read_frame(cap, cache, frame_shape):
+    """
+    Decode the next frame from 'cap' into a buffer from 'cache', None at EOF
+    """
+    buf=None
+    if frame_shape is not None:
+        buf=cache.acquire(frame_shape)
+    success, frame=cap.read(buf)
+    if buf is not None and frame is not buf:
+        cache.discard(buf)
+    if not success:
+        return None
+    return frame
+
+def _prefetch_worker(cap, cache, frame_shape, position, q, stop):
+    """
+    Read frames in order from 'cap' onto 'q' as (index, frame), starting
+    at index position[0] and keeping it at the next frame to read, until
+    EOF (signalled by a None frame) or 'stop' is set. Blocks while the
+    queue is full. An exception is passed on as (None, exception) and
+    ends the thread.
+    """
+    while not stop.is_set():
+        index=position[0]
+        try:
+            frame=_read_frame(cap, cache, frame_shape)
+        except Exception as e:
+            index, frame=None, e
+        if isinstance(frame, np.ndarray):
+            position[0]+=1
+        while not stop.is_set():
+            try:
+                q.put((index, frame), timeout=0.05)
+                break
+            except queue.Full:
+                pass
         else:
-            # We might have hit EOF
-            return None
+            if isinstance(frame, np.ndarray):
+                cache.discard(frame)
+        if not isinstance(frame, np.ndarray):
+            return
+
+def _open_capture(video_path, threads=None):
+    if threads is None:
+        return cv2.VideoCapture(video_path)
+    return cv2.VideoCapture(video_path, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads])
+
+def _scan_worker(video_path, shards, scan_start, step, fn, threads, shm_name, slots_shape, free_slots, out_q):
+    """
+    Process body for parallel_scan. For each (shard, start, stop) seek to
+    'start' (a keyframe), read frames scan_start+n*step up to 'stop' and
+    send either fn(frame) results or shared memory slot numbers holding
+    the frame to 'out_q', followed by ("end", shard).
+    """
+    shm=None
+    slots=None
+    try:
+        cap=_open_capture(video_path, threads)
+        if shm_name is not None:
+            shm=shared_memory.SharedMemory(name=shm_name)
+            slots=np.ndarray(slots_shape, np.uint8, buffer=shm.buf)
+        pos=0
+        results=[]
+        for shard, start, stop in shards:
+            if start!=pos:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                pos=start
+            while pos<stop:
+                want=(pos-scan_start)%step==0
+                if not cap.grab():
+                    break
+                pos+=1
+                if not want:
+                    continue
+                if fn is not None:
+                    success, frame=cap.retrieve()
+                    if not success:
+                        break
+                    results.append((pos-1, fn(frame)))
+                    if len(results)>=16:
+                        out_q.put(("results", results))
+                        results=[]
+                else:
+                    slot=free_slots.get()
+                    success, _=cap.retrieve(slots[slot])
+                    if not success:
+                        free_slots.put(slot)
+                        break
+                    out_q.put(("frame", (pos-1, slot)))
+            if len(results)>0:
+                out_q.put(("results", results))
+                results=[]
+            out_q.put(("end", shard))
+        cap.release()
+    except Exception:
+        out_q.put(("error", traceback.format_exc()))
+    finally:
+        if shm is not None:
+            slots=None
+            shm.close()
+
+def _scan_shards(video_path, start, stop, num_shards, index_path=None):
+    """
+    Split [start, stop) into up to 'num_shards' ranges starting on keyframes
+    """
+    keyframes=load_keyframe_index(video_path, index_path=index_path)
+    bounds=[start]
+    for i in range(1, num_shards):
+        target=start+(stop-start)*i//num_shards
+        k=keyframes[bisect_right(keyframes, target)-1]
+        if k>bounds[-1]:
+            bounds.append(k)
+    bounds.append(stop)
+    return [(bounds[i], bounds[i+1]) for i in range(len(bounds)-1)]
+
+def _scan_get(worker, poll=0.1):
+    """
+    Next message from a parallel_scan worker, raising RuntimeError if its
+    process has exited without sending one (e.g. killed or crashed)
+    """
+    while True:
+        try:
+            return worker["out_q"].get(timeout=poll)
+        except queue.Empty:
+            pass
+        if not worker["process"].is_alive():
+            # it may have sent something just before exiting
+            try:
+                return worker["out_q"].get(timeout=poll)
+            except queue.Empty:
+                raise RuntimeError("parallel_scan worker exited with code "
+                                   f"{worker['process'].exitcode} without finishing")
+
+def parallel_scan(video_path, fn=None, start=0, stop=None, step=1,
+                  num_workers=None, shards_per_worker=4, slots_per_worker=8,
+                  worker_threads=1, index_path=None, mp_context=None):
+    """
+    Decode frames start, start+step, ... up to 'stop' using several
+    processes, each with its own capture, and yield (frame_index, result)
+    in frame order.
+
+    The range is split into keyframe aligned shards (see
+    load_keyframe_index) handed out to 'num_workers' processes round robin.
+    If 'fn' is given each worker calls fn(frame) and result is what it
+    returns (must be picklable); this is the mode that scales with cores.
+    Otherwise result is the frame itself, passed back through a ring of
+    'slots_per_worker' shared memory frames and copied out, so yielded
+    frames belong to the caller.
+
+    worker_threads limits each capture's decode threads so N workers don't
+    oversubscribe the machine (None leaves the backend default).
+    """
+    cap=cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return
+    num_frames=int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_shape=None
+    if fn is None:
+        success, frame=cap.read()
+        if not success:
+            return
+        frame_shape=frame.shape
+    cap.release()
+
+    if stop is None or stop>num_frames:
+        stop=num_frames
+    if start>=stop:
+        return
+    if num_workers is None:
+        num_workers=os.cpu_count()
+    if mp_context is None:
+        mp_context=multiprocessing.get_context()
+
+    shards=_scan_shards(video_path, start, stop, num_workers*shards_per_worker, index_path)
+    num_workers=min(num_workers, len(shards))
+
+    workers=[]
+    try:
+        for w in range(num_workers):
+            worker_shards=[(i, a, b) for i, (a, b) in enumerate(shards) if i%num_workers==w]
+            worker={"out_q":mp_context.Queue(), "free_slots":None, "shm":None, "slots":None}
+            shm_name=None
+            slots_shape=None
+            if fn is None:
+                nbytes=int(np.prod(frame_shape))*slots_per_worker
+                worker["shm"]=shared_memory.SharedMemory(create=True, size=nbytes)
+                worker["slots"]=np.ndarray((slots_per_worker,)+frame_shape, np.uint8, buffer=worker["shm"].buf)
+                worker["free_slots"]=mp_context.Queue()
+                for slot in range(slots_per_worker):
+                    worker["free_slots"].put(slot)
+                shm_name=worker["shm"].name
+                slots_shape=worker["slots"].shape
+            worker["process"]=mp_context.Process(target=_scan_worker,
+                                                 args=(video_path, worker_shards, start, step, fn, worker_threads,
+                                                       shm_name, slots_shape, worker["free_slots"], worker["out_q"]),
+                                                 daemon=True)
+            worker["process"].start()
+            workers.append(worker)
+
+        for i in range(len(shards)):
+            worker=workers[i%num_workers]
+            while True:
+                kind, data=_scan_get(worker)
+                if kind=="end":
+                    break
+                if kind=="error":
+                    raise RuntimeError(f"parallel_scan worker failed:\n{data}")
+                if kind=="results":
+                    for r in data:
+                        yield r
+                else:
+                    index, slot=data
+                    # copy out of the slot: the shared memory is unmapped
+                    # when the scan ends, so views into it can't be handed out
+                    frame=worker["slots"][slot].copy()
+                    worker["free_slots"].put(slot)
+                    yield index, frame
+    finally:
+        for worker in workers:
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+            worker["process"].join()
+            if worker["shm"] is not None:
+                worker["slots"]=None
+                worker["shm"].close()
+                worker["shm"].unlink()
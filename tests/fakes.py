@@ -0,0 +1,40 @@
+"""
+Stand ins for ultralytics Results backed by numpy arrays, and random
+data to fill them
+"""
+import numpy as np
+
+class FakeBoxes:
+    def __init__(self, xyxyn, cls, conf, id=None):
+        self.xyxyn=np.asarray(xyxyn, np.float32)
+        self.cls=np.asarray(cls, np.float32)
+        self.conf=np.asarray(conf, np.float32)
+        self.id=None if id is None else np.asarray(id, np.float32)
+
+class FakeKeypoints:
+    def __init__(self, xyn, conf=None):
+        self.xyn=np.asarray(xyn, np.float32)
+        self.conf=None if conf is None else np.asarray(conf, np.float32)
+        self.has_visible=conf is not None
+
+class FakeResults:
+    def __init__(self, boxes, keypoints=None):
+        self.boxes=boxes
+        self.keypoints=keypoints
+
+def random_results(rng, n, num_kp=None, num_classes=3, ids=False):
+    """
+    Results with 'n' random boxes in descending confidence order and, if
+    'num_kp', keypoints inside the boxes with some missing (at 0,0)
+    """
+    xy=rng.random((n, 2))*0.8
+    wh=rng.random((n, 2))*0.2+0.01
+    boxes=np.concatenate([xy, xy+wh], axis=1)
+    conf=np.sort(rng.random(n))[::-1]
+    cls=rng.integers(0, num_classes, n)
+    keypoints=None
+    if num_kp:
+        kp=boxes[:,None,:2]+rng.random((n, num_kp, 2))*(boxes[:,None,2:]-boxes[:,None,:2])
+        kp[rng.random((n, num_kp))<0.2]=0
+        keypoints=FakeKeypoints(kp, rng.random((n, num_kp)))
+    return FakeResults(FakeBoxes(boxes, cls, conf, np.arange(n)+1 if ids else None), keypoints)
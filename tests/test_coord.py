@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import stuff.coord as coord
+
+def test_box_nms_class_aware():
+    boxes=[[0, 0, 1, 1], [0, 0, 1, 0.95], [0, 0, 1, 0.9], [2, 2, 3, 3]]
+    scores=[0.5, 0.9, 0.7, 0.1]
+    assert coord.box_nms(boxes, scores, 0.5).tolist()==[False, True, False, True]
+    assert coord.box_nms(boxes, scores, 0.5, classes=[0, 1, 0, 0]).tolist()==[False, True, True, True]
+
+def scan_hits(boxes, pt):
+    hits=[(coord.point_in_box(pt, b), i) for i, b in enumerate(boxes)]
+    return sorted([h for h in hits if h[0] is not None], key=lambda h: h[0])
+
+@pytest.mark.parametrize("max_box_cells", [1, 4, 64])
+@pytest.mark.parametrize("scan_below", [0, 32])
+def test_box_grid_matches_scan(max_box_cells, scan_below):
+    rng=np.random.default_rng(0)
+    for trial in range(40):
+        n=int(rng.integers(0, 300))
+        xy=rng.random((n, 2))*1.2-0.1
+        boxes=np.concatenate([xy, xy+rng.random((n, 2))*rng.choice([0.05, 0.3, 1.0])], axis=1)
+        if n and trial%5==0:
+            boxes[:n//3]=boxes[0]   # duplicates give ties
+        boxes=boxes.tolist()
+        grid=coord.BoxGrid(boxes, max_box_cells=max_box_cells, scan_below=scan_below)
+        points=(rng.random((20, 2))*1.4-0.2).tolist()+[b[0:2] for b in boxes[:5]]
+        for pt in points:
+            hits=scan_hits(boxes, pt)
+            indices, dists=grid.query(pt)
+            assert indices.tolist()==[i for _, i in hits]
+            assert dists.tolist()==[d for d, _ in hits]
+
+def test_box_grid_rebuilds_after_changes():
+    grid=coord.BoxGrid()
+    assert len(grid.query([0.5, 0.5])[0])==0
+    grid.add_boxes([[0.4, 0.4, 0.6, 0.6]]*40)
+    assert len(grid.query([0.5, 0.5])[0])==40
+    grid.add([0.0, 0.0, 1.0, 1.0])
+    assert len(grid.query([0.5, 0.5])[0])==41
+    grid.clear()
+    assert len(grid.query([0.5, 0.5])[0])==0
+
+def test_box_grid_squared_distance():
+    boxes=[[0.0, 0.0, 1.0, 1.0], [0.2, 0.2, 0.4, 0.4]]
+    grid=coord.BoxGrid(boxes, scan_below=0)
+    indices, dists=grid.query([0.3, 0.25], metric="sq")
+    assert indices.tolist()==[1, 0]
+    assert np.allclose(dists, [0.05**2, 0.2**2+0.25**2])
+
+def test_unmap_roi_matches_scalar():
+    rng=np.random.default_rng(1)
+    roi=rng.random(4).tolist()
+    points=rng.random((10, 17, 3))
+    boxes=rng.random((30, 4))
+    expected=np.array([[coord.unmap_roi_point(roi, p)+[p[2]] for p in person] for person in points.tolist()])
+    assert np.array_equal(coord.unmap_roi_points(roi, points), expected)
+    assert np.array_equal(coord.unmap_roi_boxes(roi, boxes),
+                          np.array([coord.unmap_roi_box(roi, b) for b in boxes.tolist()]))
+    # in place
+    coord.unmap_roi_points(roi, points, out=points)
+    assert np.array_equal(points, expected)
+
+def test_unmap_roi_broadcasts_rois():
+    rng=np.random.default_rng(2)
+    rois=rng.random((5, 4))
+    points=rng.random((5, 17, 2))
+    boxes=rng.random((5, 4))
+    mapped=coord.unmap_roi_points(rois[:,None], points)
+    mapped_boxes=coord.unmap_roi_boxes(rois, boxes)
+    for i in range(5):
+        assert np.array_equal(mapped[i], coord.unmap_roi_points(rois[i], points[i]))
+        assert mapped_boxes[i].tolist()==coord.unmap_roi_box(rois[i].tolist(), boxes[i].tolist())
+
+def test_interpolate():
+    assert coord.interpolate(2, 4, 0.25)==2.5
+    x=[1.0, 2.0]
+    assert coord.interpolate(x, [3.0, 4.0], 0.5) is None
+    assert x==[2.0, 3.0]
+    rng=np.random.default_rng(3)
+    a=rng.random((10, 4))
+    b=rng.random((10, 4))
+    f=rng.random((10, 1))
+    expected=np.array([[(1.0-fi[0])*u+fi[0]*v for u, v in zip(ai, bi)]
+                       for ai, bi, fi in zip(a.tolist(), b.tolist(), f.tolist())])
+    assert np.array_equal(coord.interpolate(a, b, f), expected)
+    coord.interpolate(a, b, f, out=a)
+    assert np.array_equal(a, expected)
@@ -0,0 +1,67 @@
+import copy
+import numpy as np
+import pytest
+from stuff.detections import Detections
+from stuff.ultralytics import yolo_results_to_detections, unpack_yolo_keypoints, map_keypoints
+from tests.fakes import random_results
+
+KEYPOINT_COUNTS=[None, 5, 17, 19, 22, 24]
+KEYPOINT_FLAGS=[dict(),
+                dict(face_kp=True),
+                dict(pose_kp=True),
+                dict(face_kp=True, pose_kp=True),
+                dict(facepose_kp=True)]
+
+def dict_path(results, dets, **flags):
+    """
+    The per detection dict conversion: keypoints unpacked one detection
+    at a time, then mapped with map_keypoints
+    """
+    out=[]
+    for i, d in enumerate(dets.to_dicts()):
+        d=copy.deepcopy(d)
+        for name in ["face_points", "pose_points", "facepose_points", "poseattr"]:
+            d.pop(name, None)
+        if results.keypoints is not None:
+            face, pose, facepose, attr=unpack_yolo_keypoints(results.keypoints.xyn, results.keypoints.conf, i)
+            for name, kp in [("face_points", face), ("pose_points", pose), ("facepose_points", facepose)]:
+                if kp is not None:
+                    d[name]=kp
+            if attr is not None:
+                d["poseattr"]=attr[2::3]
+        out.append(d)
+    if flags:
+        map_keypoints(out, bool(flags.get("face_kp")), bool(flags.get("pose_kp")), bool(flags.get("facepose_kp")))
+    return out
+
+@pytest.mark.parametrize("num_kp", KEYPOINT_COUNTS)
+@pytest.mark.parametrize("flags", KEYPOINT_FLAGS)
+def test_to_dicts_matches_dict_path(num_kp, flags):
+    rng=np.random.default_rng(0)
+    for ids in [False, True]:
+        results=random_results(rng, 20, num_kp, ids=ids)
+        dets=yolo_results_to_detections(results, det_thr=-1)
+        assert dets.to_dicts(**flags)==dict_path(results, dets, **flags)
+
+def test_detections_threshold_and_remap():
+    rng=np.random.default_rng(1)
+    results=random_results(rng, 50, 17)
+    dets=yolo_results_to_detections(results, det_thr=0.3, det_class_remap=[0, -1, 2])
+    conf=results.boxes.conf
+    cls=results.boxes.cls.astype(int)
+    keep=(conf>0.3) & (cls!=1)
+    assert len(dets)==keep.sum()
+    assert np.array_equal(dets.classes, cls[keep])
+    assert np.allclose(dets.boxes, results.boxes.xyxyn[keep])
+
+def test_detections_index_and_concatenate():
+    rng=np.random.default_rng(2)
+    a=yolo_results_to_detections(random_results(rng, 5, 17))
+    b=yolo_results_to_detections(random_results(rng, 3, 17))
+    c=yolo_results_to_detections(random_results(rng, 4, 5))
+    ab=Detections.concatenate([a, b])
+    assert len(ab)==8 and ab.keypoints.shape==(8, 17, 3)
+    assert ab[5:].to_dicts()==b.to_dicts()
+    # different keypoint counts can't be joined, the keypoints are dropped
+    assert Detections.concatenate([a, c]).keypoints is None
+    assert len(Detections.concatenate([]))==0
@@ -0,0 +1,30 @@
+import numpy as np
+import stuff.coord as coord
+from stuff.display import Display
+
+def scan_selected(display, pt):
+    hits=[(coord.point_in_box(pt, d["box"]), d["context"]) for d in display.selected_boxes_list]
+    return sorted([h for h in hits if h[0] is not None], key=lambda h: h[0])
+
+def test_selected_boxes():
+    display=Display(width=320, height=240, offscreen=True)
+    rng=np.random.default_rng(0)
+    xy=rng.random((100, 2))*0.8
+    boxes=np.concatenate([xy, xy+rng.random((100, 2))*0.2], axis=1)
+    for i, box in enumerate(boxes[:40].tolist()):
+        display.draw_box(box, select_context=i)
+    display.draw_boxes_batch(boxes[40:80], select_contexts=list(range(40, 80)))
+    points=rng.random((50, 2)).tolist()
+    for pt in points:
+        assert [(d["dist"], d["context"]) for d in display.selected_boxes(pt)]==scan_selected(display, pt)
+    # entries appended to the list directly are found too
+    for i, box in enumerate(boxes[80:].tolist()):
+        display.selected_boxes_list.append({"box":box, "context":80+i})
+    for pt in points:
+        assert [(d["dist"], d["context"]) for d in display.selected_boxes(pt)]==scan_selected(display, pt)
+    display.selected_boxes_list=display.selected_boxes_list[50:]
+    for pt in points:
+        assert [(d["dist"], d["context"]) for d in display.selected_boxes(pt)]==scan_selected(display, pt)
+    display.clear()
+    assert display.selected_boxes([0.5, 0.5])==[]
+    display.close()
@@ -0,0 +1,21 @@
+import pytest
+from stuff.draw import set_colour
+
+@pytest.mark.parametrize("args, expected", [(("red", 3, None), (0, 0, 255)),
+                                            (("half_blue", 4, None), (128, 255, 0, 0)),
+                                            (("blue", 4, None), (255, 255, 0, 0)),
+                                            (("blue", 4, None, 64), (64, 255, 0, 0)),
+                                            ((None, 3, "green"), (0, 255, 0)),
+                                            ((None, 4, [0, 0, 0]), (255, 0, 0, 0)),
+                                            ((None, 3, (1, 2, 3)), (1, 2, 3)),
+                                            (("white", 3, [0, 0, 0]), (255, 255, 255)),
+                                            (([10, 20, 30], 4, None), (255, 10, 20, 30)),
+                                            (((1, 2, 3, 4), 4, None), (1, 2, 3, 4))])
+def test_set_colour(args, expected):
+    # twice, to go through the cache
+    assert set_colour(*args)==expected
+    assert set_colour(*args)==expected
+
+def test_set_colour_bad_size():
+    with pytest.raises(AssertionError):
+        set_colour([1, 2], 3, None)
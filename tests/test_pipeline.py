@@ -0,0 +1,43 @@
+import threading
+import time
+import pytest
+from stuff.pipeline import Pipeline, Stage
+
+def test_pipeline_order_with_workers():
+    def jitter(x):
+        time.sleep(0.001*(x%3))
+        return x*2
+    pipeline=Pipeline(range(200), [Stage(jitter, workers=4), lambda x: x+1], queue_size=2)
+    assert list(pipeline)==[2*x+1 for x in range(200)]
+    stats=pipeline.stats()
+    assert stats["frames"]==200
+    assert [s["count"] for s in stats["stages"]]==[200, 200, 200]
+
+def test_pipeline_bounds_reorder_buffer():
+    queue_size, workers=2, 4
+    started=[]
+    during_stall=[]
+    lock=threading.Lock()
+    def stall_first(x):
+        with lock:
+            started.append(x)
+        if x==0:
+            time.sleep(0.3)
+            with lock:
+                during_stall.extend(started)
+        return x
+    pipeline=Pipeline(range(100), [Stage(stall_first, workers=workers)], queue_size=queue_size)
+    assert list(pipeline)==list(range(100))
+    # while item 0 stalls the others can't run further ahead than the window
+    assert sorted(during_stall)==list(range(queue_size+workers))
+
+def test_pipeline_error_is_raised():
+    def fail(x):
+        if x==50:
+            raise ValueError("bad item")
+        return x
+    pipeline=Pipeline(range(1000), [Stage(fail, workers=2)])
+    with pytest.raises(ValueError):
+        for x in pipeline:
+            pass
+    assert all(not t.is_alive() for t in pipeline.threads)
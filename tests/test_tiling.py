@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from stuff.detections import Detections
+from stuff.tiling import make_tiles, merge_tile_detections, tile_rois
+
+def tile_view(objects, classes, rect):
+    """
+    What a perfect detector sees of pixel boxes 'objects' in the tile
+    'rect': each box clipped to the tile, normalized to it
+    """
+    x0, y0, x1, y1=rect
+    boxes=[]
+    cls=[]
+    for b, c in zip(objects, classes):
+        clipped=[max(b[0], x0), max(b[1], y0), min(b[2], x1), min(b[3], y1)]
+        if clipped[0]<clipped[2] and clipped[1]<clipped[3]:
+            boxes.append([(clipped[0]-x0)/(x1-x0), (clipped[1]-y0)/(y1-y0),
+                          (clipped[2]-x0)/(x1-x0), (clipped[3]-y0)/(y1-y0)])
+            cls.append(c)
+    return Detections(np.array(boxes).reshape(-1, 4), cls, np.linspace(0.9, 0.5, len(boxes)))
+
+def test_make_tiles_cover_image():
+    for width, height, size, overlap in [(200, 200, 120, 0.2), (1920, 1080, 640, 0.0), (100, 50, 640, 0.5)]:
+        rects=make_tiles(width, height, size, overlap)
+        assert rects[:,0].min()==0 and rects[:,1].min()==0
+        assert rects[:,2].max()==width and rects[:,3].max()==height
+    with pytest.raises(ValueError):
+        make_tiles(200, 200, 120, 1.0)
+    with pytest.raises(ValueError):
+        make_tiles(200, 200, 120, -0.1)
+
+def test_merge_seam_fragments():
+    width, height=200, 200
+    rects=make_tiles(width, height, 120, 0.2)
+    assert len(rects)==4
+    # one object across all four tiles, one across a vertical seam, one
+    # inside a single tile and one nested inside another of a different class
+    objects=[[70, 70, 140, 140], [100, 10, 130, 40], [10, 150, 30, 190], [75, 75, 90, 90]]
+    classes=[0, 0, 0, 1]
+    dets_list=[tile_view(objects, classes, r) for r in rects]
+    merged=merge_tile_detections(dets_list, tile_rois(rects, width, height))
+    got=sorted(zip(merged.classes.tolist(), (merged.boxes*width).round(6).tolist()))
+    assert got==sorted(zip(classes, [[float(v) for v in b] for b in objects]))
+
+def test_merge_keeps_same_tile_detections():
+    rects=make_tiles(200, 200, 120, 0.2)
+    dets_list=[Detections([[0.1, 0.1, 0.5, 0.5], [0.2, 0.2, 0.4, 0.4]], [0, 0], [0.9, 0.8])]
+    dets_list+=[Detections() for _ in range(3)]
+    assert len(merge_tile_detections(dets_list, tile_rois(rects, 200, 200)))==2
@@ -0,0 +1,192 @@
+import copy
+import numpy as np
+import pytest
+import stuff.coord as coord
+from stuff.ultralytics import (AttributeFoldPlan, YoloConverter, find_gt_from_point,
+                               fold_detections_to_attributes, pose_nms_dets, yolo_results_to_dets)
+from tests.fakes import random_results
+
+def legacy_pose_nms(out_det, person_class, pose_nms, nms_iou):
+    """
+    The pose_nms/nms_iou loops as they were in yolo_results_to_dets
+    """
+    p_index=[]
+    for i,d in enumerate(out_det):
+        if d["class"]==person_class:
+            num=0
+            if "pose_points" in d:
+                for j in range(len(d["pose_points"])//3):
+                    if d["pose_points"][j*3+2]>0.01:
+                        num+=1
+            if num>=2:
+                p_index.append(i)
+    for n,i in enumerate(p_index):
+        d=out_det[i]
+        if d["confidence"]==0:
+            continue
+        for m in range(n+1, len(p_index)):
+            j=p_index[m]
+            d2=out_det[j]
+            ioma=coord.box_ioma(d["box"],d2["box"])
+            if ioma==0:
+                continue
+            iou=coord.kp_iou2(d["pose_points"], d2["pose_points"],
+                              max(coord.box_a(d["box"]), coord.box_a(d2["box"])), len(d["pose_points"])//3)
+            if iou>pose_nms:
+                f=d["confidence"]/(d["confidence"]+d2["confidence"])
+                for k in range(4):
+                    d["box"][k]=f*d["box"][k]+(1.0-f)*d2["box"][k]
+                d2["confidence"]=0
+    out_det=[d for d in out_det if d["confidence"]!=0]
+    for i,d in enumerate(out_det):
+        if d["class"]==person_class:
+            for j in range(i+1, len(out_det)):
+                d2=out_det[j]
+                if d["confidence"]==0:
+                    continue
+                if d2["class"]==person_class and coord.box_iou(d["box"],d2["box"])>nms_iou:
+                    d2["confidence"]=0
+    return [d for d in out_det if d["confidence"]!=0]
+
+def random_person_dets(rng, n, num_kp=17):
+    dets=[]
+    xy=rng.random((n, 2))*0.5
+    wh=rng.random((n, 2))*0.1+0.02
+    for i, conf in enumerate(np.sort(rng.random(n))[::-1].tolist()):
+        box=[xy[i,0], xy[i,1], xy[i,0]+wh[i,0], xy[i,1]+wh[i,1]]
+        kp=np.zeros((num_kp, 3))
+        kp[:,0]=box[0]+rng.random(num_kp)*wh[i,0]
+        kp[:,1]=box[1]+rng.random(num_kp)*wh[i,1]
+        kp[:,2]=rng.random(num_kp)
+        dets.append({"box":box, "class":int(rng.random()<0.8), "confidence":conf,
+                     "pose_points":kp.reshape(-1).tolist()})
+    return dets
+
+def test_pose_nms_matches_legacy():
+    rng=np.random.default_rng(1)
+    for n in [0, 1, 5, 50, 200]:
+        dets=random_person_dets(rng, n)
+        expected=legacy_pose_nms(copy.deepcopy(dets), 0, 0.5, 0.7)
+        got=pose_nms_dets(copy.deepcopy(dets), 0, pose_nms=0.5, nms_iou=0.7)
+        assert len(got)==len(expected)
+        for a, b in zip(got, expected):
+            assert np.allclose(a["box"], b["box"])
+            assert {k:v for k, v in a.items() if k!="box"}=={k:v for k, v in b.items() if k!="box"}
+
+@pytest.mark.parametrize("kwargs", [dict(),
+                                    dict(pose_kp=True, params={"pose_nms":0.5, "nms_iou":0.7}),
+                                    dict(face_kp=True, pose_kp=True),
+                                    dict(facepose_kp=True),
+                                    dict(fold_attributes=True, attributes=["person:male", "person:hat"])])
+def test_convert_batch_matches_convert(kwargs):
+    rng=np.random.default_rng(2)
+    yolo_class_names=["person", "face", "person_male", "person_hat"]
+    converter=YoloConverter(yolo_class_names=yolo_class_names,
+                            class_names=["person", "face", "person_male", "person_hat"],
+                            **kwargs)
+    results=[random_results(rng, int(n), 22, num_classes=4) for n in rng.integers(0, 30, 8)]
+    expected=[converter.convert(r) for r in results]
+    assert converter.convert_batch(results)==expected
+    assert expected==[yolo_results_to_dets(r, yolo_class_names=yolo_class_names,
+                                           class_names=["person", "face", "person_male", "person_hat"],
+                                           **kwargs) for r in results]
+
+def test_add_faces():
+    rng=np.random.default_rng(4)
+    class_names=["person", "face"]
+    # without facepose points there is nothing to make faces from
+    results=random_results(rng, 20, 17, num_classes=2)
+    assert (yolo_results_to_dets(results, yolo_class_names=["person", "car"], class_names=class_names, add_faces=True)
+            ==yolo_results_to_dets(results, yolo_class_names=["person", "car"], class_names=class_names))
+    # nothing to add if the model detects faces itself
+    results=random_results(rng, 20, 19, num_classes=2)
+    assert (yolo_results_to_dets(results, yolo_class_names=class_names, class_names=class_names, add_faces=True)
+            ==yolo_results_to_dets(results, yolo_class_names=class_names, class_names=class_names))
+
+    plain=yolo_results_to_dets(results, class_names=class_names, facepose_kp=True)
+    dets=yolo_results_to_dets(results, class_names=class_names, add_faces=True, facepose_kp=True)
+    assert dets[:len(plain)]==plain
+    faces=dets[len(plain):]
+    persons=[d for d in plain if d["class"]==0]
+    assert 0<len(faces)<=len(persons)
+    for f in faces:
+        assert f["class"]==1
+        person=[d for d in persons if d["facepose_points"]==f["facepose_points"]][0]
+        assert f["confidence"]==person["confidence"]
+        points=np.array(f["facepose_points"]).reshape(19, 3)[[0, 1, 2, 17, 18]]
+        points=points[points[:,2]>0]
+        assert len(points)>=2
+        x0, y0, x1, y1=f["box"]
+        assert (points[:,0]>=x0).all() and (points[:,0]<=x1).all()
+        assert (points[:,1]>=y0).all() and (points[:,1]<=y1).all()
+    boxes=[f["box"] for f in faces]
+    assert all(coord.box_iou(a, b)<0.5 for i, a in enumerate(boxes) for b in boxes[:i])
+
+def legacy_fold(gts, class_names, attributes):
+    """
+    fold_detections_to_attributes as it was: a scalar box_iou scan over
+    all detections for each attribute detection
+    """
+    class_to_attribute_map=[{"base_class_index":None, "attr_index":None}]*len(class_names)
+    for i,a in enumerate(attributes):
+        base_class=a.split(":")[0]
+        if base_class in class_names:
+            base_class_index=class_names.index(base_class)
+            an=a.replace(":","_")
+            if an in class_names:
+                j=class_names.index(an)
+                class_to_attribute_map[j]={"base_class_index":base_class_index,
+                                           "attr_index":i}
+    for d in gts:
+        m=class_to_attribute_map[d["class"]]
+        base_class_index=m["base_class_index"]
+        attr_index=m["attr_index"]
+        if attr_index is not None:
+            best_iou=0
+            for i,d2 in enumerate(gts):
+                if d2["class"]==base_class_index:
+                    iou=coord.box_iou(d2["box"], d["box"])
+                    if iou>best_iou:
+                        best_iou=iou
+                        best_match=i
+            if best_iou>0.3:
+                d2=gts[best_match]
+                if not "attrs" in d2:
+                    d2["attrs"]=[0]*len(attributes)
+                d2["attrs"][attr_index]=max(d2["attrs"][attr_index], d["confidence"])
+                d["confidence"]=0
+    return [x for x in gts if x["confidence"]!=0]
+
+def random_fold_dets(rng, n, num_classes):
+    dets=[]
+    for _ in range(n):
+        if dets and rng.random()<0.3:
+            # near copy of an earlier box, as attribute detections are
+            box=[v+rng.normal()*0.02 for v in dets[int(rng.integers(len(dets)))]["box"]]
+        else:
+            x, y=rng.random(2)*0.5
+            w, h=rng.random(2)*0.3+0.01
+            box=[x, y, x+w, y+h]
+        conf=float(rng.random()) if rng.random()>0.05 else 0.0
+        dets.append({"box":box, "class":int(rng.integers(num_classes)), "confidence":conf})
+    return dets
+
+def test_fold_matches_legacy():
+    class_names=["person", "face", "person_male", "person_hat", "car", "car_red", "face_smile"]
+    attributes=["person:male", "person:hat", "car:red", "face:smile", "dog:big", "person:none"]
+    plan=AttributeFoldPlan(class_names, attributes)
+    rng=np.random.default_rng(0)
+    for _ in range(300):
+        dets=random_fold_dets(rng, int(rng.integers(0, 40)), len(class_names))
+        expected=legacy_fold(copy.deepcopy(dets), class_names, attributes)
+        assert fold_detections_to_attributes(copy.deepcopy(dets), class_names, attributes)==expected
+        assert fold_detections_to_attributes(copy.deepcopy(dets), class_names, attributes, plan=plan)==expected
+
+def test_find_gt_from_point_index():
+    rng=np.random.default_rng(3)
+    xy=rng.random((300, 2))
+    boxes=np.concatenate([xy, xy+rng.random((300, 2))*0.2], axis=1).tolist()
+    gts=[{"box":b} for b in boxes]
+    index=coord.BoxGrid(boxes)
+    for x, y in rng.random((200, 2)).tolist():
+        assert find_gt_from_point(gts, x, y, index=index)==find_gt_from_point(gts, x, y)
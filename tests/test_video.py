@@ -0,0 +1,190 @@
+import gc
+import os
+import signal
+import cv2
+import numpy as np
+import pytest
+import stuff.video
+from stuff.video import FrameCache, RandomAccessVideoReader, parallel_scan
+
+NUM_FRAMES=60
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    """
+    A short video with a different grey level in each frame, and its
+    frames as decoded by a plain sequential read
+    """
+    path=str(tmp_path_factory.mktemp("video")/"test.mp4")
+    writer=cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 25, (64, 48))
+    for i in range(NUM_FRAMES):
+        frame=np.full((48, 64, 3), 4*i, np.uint8)
+        cv2.putText(frame, str(i), (5, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        writer.write(frame)
+    writer.release()
+    cap=cv2.VideoCapture(path)
+    frames=[]
+    while True:
+        success, frame=cap.read()
+        if not success:
+            break
+        frames.append(frame)
+    cap.release()
+    assert len(frames)==NUM_FRAMES
+    return path, frames
+
+def test_reader_random_access(video):
+    path, frames=video
+    reader=RandomAccessVideoReader(path, max_size=4)
+    rng=np.random.default_rng(0)
+    for i in rng.integers(0, NUM_FRAMES, 40).tolist():
+        assert np.array_equal(reader.get_frame_at_index(i), frames[i])
+    reader.close()
+
+def fill_cache(cache, count, shape):
+    bufs=[]
+    for i in range(count):
+        buf=cache.acquire(shape)
+        buf[:]=i
+        cache.put(i, buf)
+        bufs.append(buf)
+    return bufs
+
+def test_cache_byte_budget_mixed_sizes():
+    for recycle in [False, True]:
+        cache=FrameCache(max_bytes=8*30000, recycle=recycle)
+        fill_cache(cache, 8, (100, 100, 3))
+        assert len(cache)==8
+        buf=cache.acquire((50, 50, 3))
+        cache.put("small", buf)
+        # only as much evicted as needed, and no dead spare buffers
+        assert len(cache)==8
+        assert cache.num_spare==0
+        assert cache.nbytes==7*30000+7500
+        assert cache.nbytes<=cache.max_bytes
+
+def test_cache_lru_order():
+    cache=FrameCache(max_frames=3)
+    fill_cache(cache, 3, (4, 4, 3))
+    assert cache.get(0) is not None
+    buf=cache.acquire((4, 4, 3))
+    cache.put(3, buf)
+    assert 1 not in cache
+    assert all(k in cache for k in [0, 2, 3])
+    assert cache.stats()["evictions"]==1
+
+def test_cache_frames_stay_valid_unless_recycling():
+    cache=FrameCache(max_frames=2)
+    fill_cache(cache, 2, (4, 4, 3))
+    held=cache.get(0)
+    fill_cache(cache, 10, (4, 4, 3))
+    assert (held==0).all()
+
+    cache=FrameCache(max_frames=2, recycle=True)
+    bufs=fill_cache(cache, 2, (4, 4, 3))
+    assert cache.get(0) is bufs[0]
+    # the least recently used frame's buffer is reused
+    assert cache.acquire((4, 4, 3)) is bufs[1]
+
+def test_cache_drop_and_discard():
+    cache=FrameCache(max_bytes=1000)
+    for owner in ["a", "b"]:
+        for i in range(3):
+            cache.put((owner, i), np.zeros(100, np.uint8))
+    cache.drop("a")
+    assert len(cache)==3 and cache.nbytes==300
+    buf=cache.acquire((100,))
+    cache.discard(buf)
+    assert cache.nbytes<=1000
+
+def test_reader_held_frame_stays_valid(video):
+    path, frames=video
+    reader=RandomAccessVideoReader(path, max_size=3)
+    first=reader.get_frame_at_index(0)
+    for i in range(1, 10):
+        reader.get_frame_at_index(i)
+    assert np.array_equal(first, frames[0])
+    reader.close()
+
+def test_reader_prefetch(video):
+    path, frames=video
+    reader=RandomAccessVideoReader(path, prefetch=4)
+    for i in list(range(20))+[2, 3, 40, 41]:
+        assert np.array_equal(reader.get_frame_at_index(i), frames[i])
+    reader.close()
+
+def test_reader_prefetch_error_is_raised(video, monkeypatch):
+    path, frames=video
+    reader=RandomAccessVideoReader(path, prefetch=4)
+    read_frame=stuff.video._read_frame
+    count=[0]
+    def failing_read(*args):
+        count[0]+=1
+        if count[0]==6:
+            raise IOError("decode failed")
+        return read_frame(*args)
+    monkeypatch.setattr(stuff.video, "_read_frame", failing_read)
+    with pytest.raises(IOError):
+        for i in range(20):
+            reader.get_frame_at_index(i)
+    monkeypatch.setattr(stuff.video, "_read_frame", read_frame)
+    assert np.array_equal(reader.get_frame_at_index(i), frames[i])
+    reader.close()
+
+def test_reader_prefetch_stops_when_dropped(video):
+    path, frames=video
+    reader=RandomAccessVideoReader(path, prefetch=4)
+    reader.get_frame_at_index(0)
+    thread=reader.prefetch_thread
+    assert thread.is_alive()
+    del reader
+    gc.collect()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+def test_reader_get_frames_and_iter_frames(video):
+    path, frames=video
+    reader=RandomAccessVideoReader(path)
+    indices=[5, 1, 30, 5, 59]
+    got=reader.get_frames(indices)
+    assert all(np.array_equal(g, frames[i]) for g, i in zip(got, indices))
+    assert np.array_equal(reader.get_frames(indices, stack=True), np.stack([frames[i] for i in indices]))
+    batches=list(reader.iter_frames(start=3, stop=50, step=7, batch_size=3))
+    assert np.array_equal(np.concatenate(batches), np.stack(frames[3:50:7]))
+    reader.close()
+
+def test_reader_iter_frames_clamps_range(video):
+    path, frames=video
+    reader=RandomAccessVideoReader(path)
+    assert np.array_equal(np.stack(list(reader.iter_frames(start=-3, stop=2))), np.stack(frames[0:2]))
+    assert np.array_equal(np.concatenate(list(reader.iter_frames(start=55, stop=100, batch_size=2))),
+                          np.stack(frames[55:]))
+    assert list(reader.iter_frames(start=-5, stop=-1))==[]
+    assert all((reader.cache_id, i) not in reader.cache for i in range(-3, 0))
+    with pytest.raises(ValueError):
+        list(reader.iter_frames(step=0))
+    reader.close()
+
+def frame_mean(frame):
+    return float(frame.mean())
+
+def test_parallel_scan_fn_order(video):
+    path, frames=video
+    results=list(parallel_scan(path, fn=frame_mean, start=2, step=3, num_workers=2, shards_per_worker=3))
+    assert [i for i, _ in results]==list(range(2, NUM_FRAMES, 3))
+    assert [m for _, m in results]==[frame_mean(frames[i]) for i in range(2, NUM_FRAMES, 3)]
+
+def test_parallel_scan_frames_outlive_scan(video):
+    path, frames=video
+    results=list(parallel_scan(path, num_workers=2, slots_per_worker=2))
+    assert [i for i, _ in results]==list(range(NUM_FRAMES))
+    for i, frame in results:
+        assert np.array_equal(frame, frames[i])
+
+def kill_self(frame):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def test_parallel_scan_dead_worker_is_raised(video):
+    path, frames=video
+    with pytest.raises(RuntimeError):
+        list(parallel_scan(path, fn=kill_self, num_workers=2))